@@ -1,15 +1,20 @@
 import tkinter as tk
 from tkinter import messagebox, filedialog
 import customtkinter as ctk
-import cv2
 import threading
 import time
 import os
 import traceback
-from scanner_logic import ScannerLogic
-from session_manager import SessionManager
-from ui_panels import TopBar, SideBar, AnswerPanel, ImagePanel
+from scanner_logic import ScannerLogic, ARCHIVO_TIEMPOS
+from omr_timing import StageTimer, TimingStats
+from session_manager import SessionManager, compress_view
+from session_journal import SessionJournal
+from scoring import load_keys, score_session, write_students, write_items
+from scan_pipeline import ScanPipeline
+from ui_panels import TopBar, SideBar, AnswerPanel, ImagePanel, render_thumbnail, source_image
+from scan_prefetch import ScanPrefetcher
 from names_service import NamesService
+from rut_index import check_digit, choose, clean_rut, is_valid_rut
 from updater import AutoUpdater
 
 class ScannerApp:
@@ -40,12 +45,27 @@ class ScannerApp:
         # Inicialización de subsistemas
         self.logic = ScannerLogic()       # Lógica base TWAIN y procesamiento de imagen
         self.session = SessionManager()   # Manejo de datos y persistencia
-        self.names_service = NamesService() # Servicio de nombres de alumnos
+        self.journal = SessionJournal()   # Autoguardado: diario de cambios de la sesión
+        self.names_service = NamesService(background=True) # Servicio de nombres de alumnos (carga en segundo plano)
         
         self.current_scan_index = -1
+        self.nav_stats = TimingStats() # Latencia de cambio de hoja (ver mostrar_memoria)
+
+        # Pipeline de escaneo: transferencia (hilo Tk) -> decodificación (pool) -> UI en lotes
+        self.scan_pipeline = ScanPipeline(self._decode_scan)
+        self._poll_job = None
         
         # Construcción de la interfaz gráfica
         self._setup_ui()
+
+        # Modo revisión: las hojas vecinas se decodifican y preparan en segundo plano
+        self.review_mode = False
+        self.prefetcher = ScanPrefetcher(self.session, lambda image, w, h: render_thumbnail(source_image(image), w, h))
+        self.image_panel.prerendered = self.prefetcher.get_render
+        self.root.protocol("WM_DELETE_WINDOW", self._on_close)
+
+        # Recuperar la sesión anterior si el programa no se cerró bien, y empezar a registrar la actual
+        self.root.after(200, self._recover_session)
         
         # Iniciar verificación de actualizaciones en segundo plano después de 1 segundo
         self.root.after(1000, self._check_updates)
@@ -62,7 +82,10 @@ class ScannerApp:
             'load': self.cargar_sesion,
             'review': self.generar_reporte_txt,
             'reload_names': self.recargar_nombres,
-            'toggle_view': self.toggle_viewer
+            'toggle_view': self.toggle_viewer,
+            'memory_stats': self.mostrar_memoria,
+            'score': self.corregir_pruebas,
+            'review_mode': self.toggle_review_mode
         }
         self.top_bar = TopBar(main_frame, top_callbacks)
 
@@ -113,15 +136,38 @@ class ScannerApp:
             self.answer_panel.update_rut_cursor()
         
         self._save_current_rut_state(formatted)
+        if self.current_scan_index >= 0:
+            self._update_rut_hint(self.session.get_scan(self.current_scan_index))
+
+    def _update_rut_hint(self, scan_data):
+        """Aviso bajo el RUT: dígito verificador malo, o lectura corregida / RUT posibles."""
+        raw = clean_rut(scan_data.get('rut_text', "")).replace('?', '')
+        read = scan_data.get('rut_leido', "")
+        others = [self._format_rut(r) for r in scan_data.get('rut_candidatos', []) if r != raw]
+        if len(raw) > 1 and not is_valid_rut(raw):
+            hint = f"Dígito verificador no válido (debería ser {check_digit(raw[:-1])})" if raw[:-1].isdigit() else "RUT no válido"
+            valid = False
+        elif read and read != raw:
+            hint = f"Corregido desde la lectura {read}"
+            valid = True
+        else:
+            hint = ""
+            valid = True
+        if others and not scan_data.get('student_name', '').strip():
+            hint = (hint + "\n" if hint else "") + "Posibles: " + ", ".join(others)
+        self.answer_panel.set_rut_hint(hint, valid)
 
     def _on_name_key_release(self, event):
         val = self.answer_panel.get_name()
         if self.current_scan_index >= 0:
             self.session.update_name(self.current_scan_index, val)
+            self.side_bar.set_unnamed(self.current_scan_index, not val.strip())
 
     def _save_current_rut_state(self, val):
         if self.current_scan_index >= 0:
             self.session.update_rut(self.current_scan_index, val)
+            # La fila de la lista muestra el RUT editado
+            self.side_bar.set_item_text(self.current_scan_index, val or f"Hoja {self.current_scan_index + 1}")
     
     def _on_answer_key_release(self, event, index):
         widget = event.widget
@@ -140,6 +186,7 @@ class ScannerApp:
             widget.insert(0, clean_val)
             val = clean_val
             
+        self.answer_panel.answer_edited(index, val)
         self.session.update_answer(self.current_scan_index, index, val)
 
     def _format_rut(self, text):
@@ -228,13 +275,18 @@ class ScannerApp:
             
             self.scan_index = 0
             self.is_scanning = True
+            # Cada lote puede ser otro formulario: la plantilla se recalibra con su primera hoja limpia
+            self.logic.reset_layout()
             
             # Cambiar texto del botón para indicar que se puede detener
             self.side_bar.btn_scan.configure(text="Detener Escaneo")
             
             # Iniciamos Loop de Polling con retraso inicial
-            # Este loop llamará a _poll_scan_status repetidamente para ver si llegó una hoja
-            self.root.after(1000, self._poll_scan_status)
+            # Este loop llamará a _poll_scan_status repetidamente para ver si llegó una hoja.
+            # Si el loop anterior sigue vaciando la cola, se reemplaza por este.
+            if self._poll_job:
+                self.root.after_cancel(self._poll_job)
+            self._poll_job = self.root.after(1000, self._poll_scan_status)
             
         except Exception as e:
             msg = str(e)
@@ -246,32 +298,57 @@ class ScannerApp:
         self._finish_scanning()
 
     def _poll_scan_status(self):
-        if not getattr(self, 'is_scanning', False):
-            return
+        """
+        Loop de polling (hilo de Tk) del pipeline de escaneo.
+        1. Transfiere todas las páginas que el driver tenga listas mientras la cola tenga espacio.
+        2. La decodificación OMR ocurre en los hilos del pipeline (ver _decode_scan).
+        3. Agrega a la sesión, en un solo lote y en orden, las hojas ya decodificadas.
+        Sigue corriendo tras terminar el lote del driver hasta vaciar la cola.
+        """
+        self._poll_job = None
+        pipeline = self.scan_pipeline
 
-        try:
-            # Intentamos transferir. Ahora transfer_next suprime errores de "No Listo" indefinidamente.
-            filepath, pending = self.logic.transfer_next(self.scan_source, self.base_scan_filename, self.scan_index)
-            
-            if filepath:
-                # Imagen recibida
-                self._process_new_scan(filepath)
-                self.scan_index += 1
-            
-            # Si pending == 0, el driver indica que terminó el lote
-            if pending == 0:
+        if getattr(self, 'is_scanning', False):
+            try:
+                # Intentamos transferir. Ahora transfer_next suprime errores de "No Listo" indefinidamente.
+                # La página llega como arreglo en memoria (sin escribir/leer/borrar un BMP temporal),
+                # directo en grises: la sesión guarda la página en grises y las marcas como datos.
+                while not pipeline.is_full():
+                    image, pending, dpi = self.logic.transfer_next(self.scan_source, self.base_scan_filename, self.scan_index, grayscale=True)
+                    
+                    if image is not None:
+                        # Imagen recibida -> a la cola de decodificación (con la resolución que informa el driver)
+                        source_path = f"{self.base_scan_filename}_{self.scan_index}.bmp" if self.logic.save_raw_scans else ""
+                        pipeline.submit(image, source_path, dpi)
+                        self.scan_index += 1
+                    
+                    # Si pending == 0, el driver indica que terminó el lote
+                    if pending == 0:
+                        self._finish_scanning()
+                        break
+
+                    if image is None:
+                        break
+
+            except Exception as e:
+                # Error fatal real
+                print(f"Error fatal en polling: {e}")
+                traceback.print_exc()
                 self._finish_scanning()
-                return
+                messagebox.showerror("Error Escáner", f"Se detuvo el escaneo:\n{e}")
 
-            # Programar siguiente chequeo
-            self.root.after(200, self._poll_scan_status)
+        self._add_decoded_scans(pipeline.drain_ready())
+        self.side_bar.update_queue(pipeline.depth())
 
-        except Exception as e:
-            # Error fatal real
-            print(f"Error fatal en polling: {e}")
-            traceback.print_exc()
-            self._finish_scanning()
-            messagebox.showerror("Error Escáner", f"Se detuvo el escaneo:\n{e}")
+        # Programar siguiente chequeo (más seguido si hay hojas decodificándose)
+        if getattr(self, 'is_scanning', False) or pipeline.depth():
+            self._poll_job = self.root.after(50 if pipeline.depth() else 200, self._poll_scan_status)
+        elif self.logic.timing_stats is not None:
+            # Lote terminado: histogramas de tiempo por etapa acumulados en la sesión
+            try:
+                self.logic.timing_stats.dump(ARCHIVO_TIEMPOS)
+            except Exception as e:
+                print(f"Error guardando tiempos: {e}")
 
     def _finish_scanning(self):
         self.is_scanning = False
@@ -292,63 +369,112 @@ class ScannerApp:
         self.root.lift()
         self.root.focus_force()
 
-    def _process_new_scan(self, image_path):
-        rut_text, answer_values, vis_img = self.logic.process_image(image_path)
-        
-        # ELIMINAR PROVISIONALMENTE EL ARCHIVO DE IMAGEN
-        # El usuario solicitó no acumular imágenes en disco.
+    def _decode_scan(self, image, source_path, dpi=None):
+        """
+        Etapa de decodificación del pipeline: corre en un hilo worker, no toca widgets Tk.
+        Retorna un dict con el resultado, o None si la imagen no se pudo procesar.
+        La hoja queda como página limpia + marcas como datos (SheetOverlay); el visor las dibuja.
+        dpi: resolución informada por el escáner (None = se estima a partir del ancho).
+        """
         try:
-            if os.path.exists(image_path):
-                os.remove(image_path)
+            rut_scores = []
+            rut_text, answer_values, vis_img = self.logic.process_image(image, lazy_overlay=True, dpi=dpi,
+                                                                        rut_scores=rut_scores)
         except Exception as e:
-            print(f"Advertencia: No se pudo eliminar imagen temporal {image_path}: {e}")
+            print(f"Error procesando imagen: {e}")
+            traceback.print_exc()
+            return None
 
         if vis_img is None:
-            messagebox.showerror("Error", "No se pudo procesar la imagen.")
-            return
+            return None
 
         # OPTIMIZACION: Reducir tamaño en memoria para visualización rápida
         try:
-            h, w = vis_img.shape[:2]
-            if h > 1000: 
-                scale = 1000 / h
-                new_w = int(w * scale)
-                vis_img = cv2.resize(vis_img, (new_w, 1000), interpolation=cv2.INTER_AREA)
+            vis_img = vis_img.resized(1000)
         except Exception as e:
             print(f"Error optimizando imagen: {e}")
 
-        initial_rut = ""
-        student_name = ""
-        if rut_text:
-             initial_rut = self._format_rut(rut_text)
-             raw_rut = ''.join(filter(lambda x: x.isdigit() or x.lower() == 'k', rut_text)).upper()
-             student_name = self.names_service.get_name(raw_rut)
-        
-        # Rellenar lista de 90 respuestas
-        full_answers = [""] * 90
-        for i, val in enumerate(answer_values):
-            if i < 90:
-                full_answers[i] = val
-        
-        scan_data = {
-            'path': image_path,
-            'rut_marks': [], 
-            'ans_marks': [], 
-            'vis_img': vis_img,
-            'rut_text': initial_rut,
-            'student_name': student_name,
-            'answers_values': full_answers 
-        }
-        
-        self.session.add_scan(scan_data)
-        
-        idx = len(self.session.get_scans())
-        # Mostrar RUT si se detectó, sino Hoja X
-        display_text = initial_rut if initial_rut else f"Hoja {idx}"
-        self.side_bar.add_item(display_text)
-        self.side_bar.select_last()
-        self._load_scan_into_view(idx - 1)
-        self._update_sidebar_stats()
+        # La sesión guarda solo el JPG de la página y las marcas; se comprime aquí para no ocupar el hilo de Tk
+        try:
+            view = compress_view(vis_img)
+        except Exception as e:
+            print(f"Error comprimiendo imagen: {e}")
+            return None
+
+        result = {'path': source_path, 'rut_text': rut_text, 'answers': answer_values, **view}
+        result.update(self._check_rut(rut_text, rut_scores))
+        return result
+
+    def _check_rut(self, rut_text, rut_scores):
+        """
+        Hilo worker: si el RUT leído no es válido (módulo 11) o no está en la base de nombres,
+        busca en la base los RUT a una columna de distancia. Con un candidato claro el RUT
+        se corrige; la lectura original y los candidatos quedan en la hoja para revisión.
+        """
+        raw = clean_rut(rut_text)
+        if not raw or (is_valid_rut(raw) and self.names_service.get_name(raw)):
+            return {}
+        candidates = self.names_service.find_ruts(raw, rut_scores)
+        if not candidates:
+            return {}
+        info = {'rut_leido': raw, 'rut_candidatos': [rut for rut, _ in candidates]}
+        fixed = choose(raw, candidates)
+        if fixed:
+            info['rut_text'] = fixed
+        return info
+
+    def _add_decoded_scans(self, results):
+        """Agrega a la sesión un lote de hojas decodificadas (hilo de Tk) y refresca la UI una vez."""
+        if not results:
+            return
+
+        failed = 0
+        for result in results:
+            if result is None:
+                failed += 1
+                continue
+
+            rut_text = result['rut_text']
+            initial_rut = ""
+            student_name = ""
+            if rut_text:
+                 initial_rut = self._format_rut(rut_text)
+                 raw_rut = ''.join(filter(lambda x: x.isdigit() or x.lower() == 'k', rut_text)).upper()
+                 student_name = self.names_service.get_name(raw_rut)
+            
+            # Rellenar lista de 90 respuestas
+            full_answers = [""] * 90
+            for i, val in enumerate(result['answers']):
+                if i < 90:
+                    full_answers[i] = val
+            
+            scan_data = {
+                'path': result['path'],
+                'rut_leido': result.get('rut_leido', ""),
+                'rut_candidatos': result.get('rut_candidatos', []),
+                'rut_marks': [], 
+                'ans_marks': [], 
+                'vis_img': None,
+                'vis_img_compressed': result['vis_img_compressed'],
+                'mark_boxes': result.get('mark_boxes'),
+                'rut_text': initial_rut,
+                'student_name': student_name,
+                'answers_values': full_answers 
+            }
+            
+            self.session.add_scan(scan_data)
+            
+            idx = len(self.session.get_scans())
+            # Mostrar RUT si se detectó, sino Hoja X
+            display_text = initial_rut if initial_rut else f"Hoja {idx}"
+            self.side_bar.add_item(display_text, unnamed=not student_name.strip())
+
+        if failed < len(results):
+            self.side_bar.select_last()
+            self._load_scan_into_view(len(self.session.get_scans()) - 1)
+
+        if failed:
+            messagebox.showerror("Error", f"No se pudo procesar {failed} imagen(es).")
 
     def eliminar_prueba(self):
         index = self.side_bar.get_selection_index()
@@ -360,7 +486,6 @@ class ScannerApp:
             if self.session.remove_scan(index):
                 # Actualizar UI
                 self.side_bar.delete_item(index)
-                self._update_sidebar_stats()
                 
                 # Si borramos el actual, limpiar o mover seleccion
                 if index == self.current_scan_index:
@@ -371,7 +496,7 @@ class ScannerApp:
                     # self.image_panel.display_image(None) 
                     
                     # Intentar seleccionar otro
-                    count = self.side_bar.lst_scans.size()
+                    count = self.side_bar.size()
                     if count > 0:
                         new_idx = max(0, index - 1)
                         self.side_bar.select_index(new_idx)
@@ -387,33 +512,49 @@ class ScannerApp:
     def _load_scan_into_view(self, index):
         scan_data = self.session.get_scan(index)
         if not scan_data: return
+        timer = StageTimer()
             
         self.current_scan_index = index
         
         self.answer_panel.set_rut(scan_data.get('rut_text', ""))
         self.answer_panel.set_name(scan_data.get('student_name', ""))
+        self._update_rut_hint(scan_data)
         
+        # Solo se fija el estado: las celdas que cambian se escriben en un idle (ver AnswerPanel)
         vals = scan_data.get('answers_values', [""] * 90)
-        self.answer_panel.clear_answers()
-        
-        for i in range(90):
-             val = vals[i]
-             self.answer_panel.set_answer(i, val, mark_detected=False)
+        self.answer_panel.show_answers(list(vals), range(min(len(scan_data['ans_marks']), 90)))
+        timer.lap('panel')
 
-        for i, ans in enumerate(scan_data['ans_marks']):
-             if i < 90:
-                 self.answer_panel.highlight_mark(i)
+        # Tiempo de navegación: este idle corre después del de AnswerPanel
+        self.root.after_idle(self._record_navigation, timer)
 
-        vis_img = scan_data['vis_img'].copy()
-        
-        for i, ans in enumerate(scan_data['ans_marks']):
-             if i < 90:
-                 cx, cy = ans['pos']
-                 cv2.putText(vis_img, str(i+1), (cx, cy), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)
+        # La imagen se decodifica al seleccionarla (o sale de la caché de la sesión)
+        vis_img = self.session.get_image(index)
+        timer.lap('imagen')
+        if vis_img is None:
+            return
         
-        self.image_panel.display_image(vis_img)
+        # Las anotaciones (marcas y números de pregunta) son ítems del canvas: la imagen no se copia.
+        # Sesiones antiguas: números de pregunta en la posición guardada en ans_marks.
+        labels = [(str(i + 1), ans['pos']) for i, ans in enumerate(scan_data['ans_marks'][:90])]
+        self.image_panel.display_image(vis_img, labels)
+        timer.lap('visor')
+
+        if self.review_mode:
+            self.prefetcher.request(index, self.image_panel.canvas_size())
+
+    def _record_navigation(self, timer):
+        """Cierra la medición de un cambio de hoja (incluye escribir las celdas en idle)."""
+        timer.lap('celdas')
+        timer.count('celdas_actualizadas', self.answer_panel.last_flush_cells)
+        result = timer.as_dict()
+        result['etapas_ms']['total'] = sum(result['etapas_ms'].values())
+        self.nav_stats.add(result)
 
     def guardar_sesion(self):
+        if self.session.is_saving():
+            messagebox.showwarning("Advertencia", "La sesión se está guardando. Espere a que termine.")
+            return
         if not self.session.get_scans():
             messagebox.showwarning("Advertencia", "No hay escaneos para guardar.")
             return
@@ -423,13 +564,37 @@ class ScannerApp:
             filetypes=[("Archivos de Escaner", "*.escaner")]
         )
         if filename:
+            # Se guarda en segundo plano: la sesión sigue disponible mientras se comprimen las imágenes
+            self._save_progress = (0, len(self.session.get_scans()))
             try:
-                self.session.save_session(filename)
-                messagebox.showinfo("Éxito", f"Sesión guardada en {os.path.basename(filename)}")
+                self.session.start_save(filename, progress=self._on_save_progress)
             except Exception as e:
                 messagebox.showerror("Error", f"No se pudo guardar: {e}")
+                return
+            self.root.after(100, self._poll_save)
+
+    def _on_save_progress(self, done, total):
+        # Hilo de guardado: solo deja el avance para que _poll_save lo muestre
+        self._save_progress = (done, total)
+
+    def _poll_save(self):
+        if not self.session.save_done():
+            done, total = self._save_progress
+            self.side_bar.set_status(f"Guardando sesión... {done}/{total}")
+            self.root.after(100, self._poll_save)
+            return
+
+        self.side_bar.set_status("")
+        try:
+            filename = self.session.finish_save()
+            messagebox.showinfo("Éxito", f"Sesión guardada en {os.path.basename(filename)}")
+        except Exception as e:
+            messagebox.showerror("Error", f"No se pudo guardar: {e}")
 
     def cargar_sesion(self):
+        if self.session.is_saving():
+            messagebox.showwarning("Advertencia", "La sesión se está guardando. Espere a que termine.")
+            return
         if self.session.get_scans():
              if not messagebox.askyesno("Confirmar", "Se borrará la sesión actual. ¿Continuar?"): return
 
@@ -442,24 +607,80 @@ class ScannerApp:
                 scans, missing = self.session.load_session(filename)
                 if missing:
                     messagebox.showwarning("Faltantes", "Faltan imagenes: " + str(missing[:2]))
+                if self.session.session_format == "pickle" and scans:
+                    if messagebox.askyesno("Formato antiguo", "La sesión usa el formato antiguo (más lento de abrir).\n¿Convertirla al formato nuevo ahora?"):
+                        self.session.save_session(filename)
                 
-                self.side_bar.clear()
-                for i, scan in enumerate(scans):
-                    rut = scan.get('rut_text', "")
-                    display_text = rut if rut else f"Hoja {i+1}"
-                    self.side_bar.add_item(display_text)
-                
-                if scans:
-                    self.side_bar.select_index(0)
-                    self._load_scan_into_view(0)
-                else:
-                    self.current_scan_index = -1
-                
-                self._update_sidebar_stats()
+                self._show_loaded_scans(scans)
                 messagebox.showinfo("Éxito", f"Cargadas {len(scans)} hojas.")
             except Exception as e:
                 messagebox.showerror("Error", str(e))
 
+    def _show_loaded_scans(self, scans):
+        """Llena la barra lateral con una sesión recién cargada y muestra su primera hoja."""
+        self.image_panel.clear_cache() # Renders de la sesión anterior
+        self.prefetcher.cancel()
+        items = []
+        for i, scan in enumerate(scans):
+            rut = scan.get('rut_text', "")
+            display_text = rut if rut else f"Hoja {i+1}"
+            items.append((display_text, not scan.get('student_name', '').strip()))
+        self.side_bar.set_items(items)
+        
+        if scans:
+            self.side_bar.select_index(0)
+            self._load_scan_into_view(0)
+        else:
+            self.current_scan_index = -1
+
+    def _recover_session(self):
+        if self.journal.has_pending():
+            if messagebox.askyesno("Recuperar sesión", "La última sesión no se guardó antes de cerrar el programa.\n¿Recuperar sus hojas?"):
+                try:
+                    scans = self.journal.recover(self.session)
+                except Exception as e:
+                    # El diario queda intacto para intentarlo en el próximo inicio
+                    traceback.print_exc()
+                    messagebox.showerror("Error", f"No se pudo recuperar la sesión: {e}")
+                    return
+                self._show_loaded_scans(scans)
+            else:
+                self.journal.discard()
+        try:
+            self.journal.start(self.session)
+        except Exception as e:
+            print(f"No se pudo iniciar el autoguardado: {e}")
+
+    def _on_close(self):
+        # Detener la transferencia y terminar las hojas que se están decodificando: se agregan
+        # a la sesión (y al diario) antes de cerrarla, con los workers aún con sesión y nombres
+        self.is_scanning = False
+        if self._poll_job:
+            self.root.after_cancel(self._poll_job)
+            self._poll_job = None
+        if getattr(self, 'scan_source', None):
+            self.logic.close_source(self.scan_source)
+            self.scan_source = None
+        try:
+            self._add_decoded_scans(self.scan_pipeline.drain_all())
+        except Exception as e:
+            print(f"Error terminando las hojas en proceso: {e}")
+        self.scan_pipeline.shutdown()
+
+        if self.session.is_saving():
+            # El guardado en curso se completa antes de cerrar
+            try:
+                self.session.finish_save()
+            except Exception as e:
+                messagebox.showerror("Error", f"No se pudo guardar: {e}")
+        try:
+            self.journal.close()
+        except Exception as e:
+            print(f"Error cerrando el diario de sesión: {e}")
+        self.prefetcher.close()
+        self.session.close()
+        self.root.destroy()
+
     def generar_reporte_txt(self):
         if not self.session.get_scans():
             messagebox.showwarning("Advertencia", "No hay pruebas para revisar.")
@@ -478,9 +699,55 @@ class ScannerApp:
         except Exception as e:
             messagebox.showerror("Error", f"No se pudo generar el reporte:\n{e}")
 
+    def corregir_pruebas(self):
+        if not self.session.get_scans():
+            messagebox.showwarning("Advertencia", "No hay pruebas para corregir.")
+            return
+
+        keys_file = filedialog.askopenfilename(
+            title="Pautas de corrección", filetypes=[("Pautas", "*.txt"), ("Todos", "*.*")]
+        )
+        if not keys_file:
+            return
+        filename = filedialog.asksaveasfilename(
+            title="Guardar puntajes", defaultextension=".csv", initialfile="puntajes.csv",
+            filetypes=[("CSV", "*.csv")]
+        )
+        if not filename:
+            return
+
+        try:
+            keys = load_keys(keys_file)
+            report = score_session(self.session, keys)
+            items_file = os.path.splitext(filename)[0] + "_preguntas.csv"
+            write_students(report, filename, self.session.ruts, self.session.names)
+            write_items(report, items_file)
+        except Exception as e:
+            messagebox.showerror("Error", f"No se pudo corregir:\n{e}")
+            return
+
+        summary = report.summary()
+        forms = "\n".join(f"  {name}: {count} hojas" for name, count in summary['por_forma'].items())
+        messagebox.showinfo("Corrección",
+            f"Corregidas {summary['hojas']} hojas.\n"
+            f"Logro promedio: {summary['promedio_porcentaje']:.1f}%\n{forms}\n\n"
+            f"Puntajes: {os.path.basename(filename)}\n"
+            f"Análisis por pregunta: {os.path.basename(items_file)}")
+
     def recargar_nombres(self):
-        self.names_service.reload()
-        
+        # La relectura del archivo va en segundo plano; al terminar se completan los nombres
+        self.names_service.start_reload()
+        self.side_bar.set_status("Cargando nombres...")
+        self._poll_names()
+
+    def _poll_names(self):
+        if self.names_service.is_loading():
+            self.root.after(100, self._poll_names)
+            return
+        self.side_bar.set_status("")
+        self._apply_names()
+
+    def _apply_names(self):
         count = 0
         current_scans = self.session.get_scans()
         for i, scan in enumerate(current_scans):
@@ -490,30 +757,46 @@ class ScannerApp:
                  name = self.names_service.get_name(raw_rut)
                  if name:
                      self.session.update_name(i, name)
+                     self.side_bar.set_unnamed(i, False)
                      count += 1
         
         if self.current_scan_index >= 0:
             self._load_scan_into_view(self.current_scan_index)
             
-        self._update_sidebar_stats()
         messagebox.showinfo("Nombres", f"Base de datos recargada.\nSe actualizaron {count} estudiantes.")
 
-    def _update_sidebar_stats(self):
-        scans = self.session.get_scans()
-        total = len(scans)
-        unnamed = 0
-        
-        for i, s in enumerate(scans):
-            has_name = bool(s.get('student_name', '').strip())
-            if not has_name:
-                unnamed += 1
-                self.side_bar.set_item_style(i, "white", "#e74c3c")
-            else:
-                self.side_bar.set_item_style(i, "#2c3e50", "#ecf0f1")
-        
-        try:
-            self.side_bar.update_stats(total, unnamed)
-        except: pass
+    def toggle_review_mode(self):
+        """
+        Modo revisión: Ctrl+→ / Ctrl+← pasan a la hoja siguiente / anterior y las vecinas de la
+        hoja actual se precargan (ver ScanPrefetcher).
+        Los atajos van en la ventana y no actúan mientras se escribe en un campo (RUT, nombre,
+        respuestas): ahí Ctrl+← / Ctrl+→ mueven el cursor por palabra.
+        """
+        self.review_mode = not self.review_mode
+        if self.review_mode:
+            self.root.bind("<Control-Right>", lambda e: self._review_step(1))
+            self.root.bind("<Control-Left>", lambda e: self._review_step(-1))
+            self.top_bar.set_review_text("Salir del modo revisión")
+            self.side_bar.lst_scans.canvas.focus_set()
+            if self.current_scan_index >= 0:
+                self.prefetcher.request(self.current_scan_index, self.image_panel.canvas_size())
+        else:
+            self.root.unbind("<Control-Right>")
+            self.root.unbind("<Control-Left>")
+            self.top_bar.set_review_text("Modo revisión (Ctrl+← / Ctrl+→)")
+            self.prefetcher.cancel()
+
+    def _review_step(self, step):
+        if isinstance(self.root.focus_get(), tk.Entry):
+            return None # La tecla ya movió el cursor del campo en edición
+        count = len(self.session.get_scans())
+        if count == 0:
+            return "break"
+        index = max(0, min(self.current_scan_index + step, count - 1))
+        if index != self.current_scan_index:
+            self.side_bar.select_index(index)
+            self._load_scan_into_view(index)
+        return "break"
 
     def toggle_viewer(self):
         if self.image_panel.winfo_viewable():
@@ -523,7 +806,33 @@ class ScannerApp:
             self.image_panel.pack(side=tk.RIGHT, fill=tk.BOTH, expand=True)
             self.top_bar.set_toggle_text("Ocultar Visor")
             if self.image_panel.current_vis_img is not None:
-                 self.image_panel.display_image(self.image_panel.current_vis_img)
+                 self.image_panel.display_image(self.image_panel.current_vis_img, self.image_panel.current_labels)
+
+    def mostrar_memoria(self):
+        stats = self.session.memory_stats()
+        mb = 1024 * 1024
+        messagebox.showinfo("Uso de memoria",
+            f"Hojas en la sesión: {stats['hojas']}\n"
+            f"JPG en memoria: {stats['bytes_comprimidos'] / mb:.1f} MB\n\n"
+            f"Caché de imágenes: {stats['imagenes']}/{stats['max_imagenes']} imágenes, "
+            f"{stats['bytes_residentes'] / mb:.1f}/{stats['max_bytes'] / mb:.0f} MB\n"
+            f"Aciertos: {stats['aciertos']}  Fallos: {stats['fallos']}  ({stats['tasa_aciertos']:.0%})\n"
+            f"Descartes: {stats['descartes']}\n\n"
+            f"{self._navigation_summary()}")
+
+    def _navigation_summary(self):
+        summary = self.nav_stats.summary()
+        total = summary['etapas'].get('total')
+        if not total:
+            return "Navegación: sin mediciones"
+        stages = summary['etapas']
+        cells = summary['conteos'].get('celdas_actualizadas', {}).get('promedio', 0)
+        return (f"Navegación ({total['n']} cambios de hoja): prom {total['promedio_ms']:.1f} ms, "
+                f"máx {total['max_ms']:.1f} ms\n"
+                f"  panel {stages['panel']['promedio_ms']:.1f}  celdas {stages['celdas']['promedio_ms']:.1f}  "
+                f"imagen {stages.get('imagen', {}).get('promedio_ms', 0):.1f}  "
+                f"visor {stages.get('visor', {}).get('promedio_ms', 0):.1f} ms; "
+                f"{cells:.0f} celdas por cambio")
 
     def _check_updates(self):
         try:
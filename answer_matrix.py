@@ -0,0 +1,103 @@
+import numpy as np
+
+# Preguntas por hoja
+PREGUNTAS = 90
+
+# Código uint8 de cada respuesta: 0 = en blanco, 1.. = opciones, DUDOSA = lectura no válida ('?')
+OPCIONES = "ABCDEFGHIJK"
+VALORES = ("",) + tuple(OPCIONES) + ("?",)
+DUDOSA = len(VALORES) - 1
+_CODIGOS = {value: code for code, value in enumerate(VALORES)}
+
+# Capacidad inicial (filas) de la matriz; crece al doble cuando se llena
+CAPACIDAD_INICIAL = 256
+
+
+def encode_answer(value):
+    """Código de una respuesta ("" -> 0, "A" -> 1, ...; cualquier otro valor -> DUDOSA)."""
+    if not value:
+        return 0
+    return _CODIGOS.get(str(value).upper(), DUDOSA)
+
+
+def encode_answers(values):
+    """Fila de códigos (PREGUNTAS) para una lista de respuestas; se rellena con blancos o se corta."""
+    row = np.zeros(PREGUNTAS, dtype=np.uint8)
+    for i, value in enumerate(list(values or [])[:PREGUNTAS]):
+        row[i] = encode_answer(value)
+    return row
+
+
+class AnswerRow:
+    """
+    Vista de las respuestas de una hoja sobre la matriz de la sesión.
+    Se comporta como la lista de 90 strings de antes ('answers_values'): índice, asignación,
+    largo e iteración. list(row) entrega una copia independiente.
+    """
+    __slots__ = ('_matrix', 'slot')
+
+    def __init__(self, matrix, slot):
+        self._matrix = matrix
+        self.slot = slot
+
+    def __len__(self):
+        return PREGUNTAS
+
+    def __getitem__(self, index):
+        codes = self._matrix.data[self.slot, index]
+        if isinstance(index, slice):
+            return [VALORES[c] for c in codes.tolist()]
+        return VALORES[codes]
+
+    def __setitem__(self, index, value):
+        self._matrix.data[self.slot, index] = encode_answer(value)
+
+    def __iter__(self):
+        return iter([VALORES[c] for c in self._matrix.data[self.slot].tolist()])
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return f"AnswerRow({list(self)!r})"
+
+    def codes(self):
+        return self._matrix.data[self.slot]
+
+
+class AnswerMatrix:
+    """
+    Matriz de Respuestas de la Sesión.
+
+    Todas las respuestas viven en una sola matriz uint8 (filas x PREGUNTAS, ver VALORES).
+    Cada hoja ocupa una fila fija (slot) mientras existe: eliminar una hoja solo libera su fila,
+    así las vistas (AnswerRow) de las demás siguen válidas. El orden de las hojas lo lleva
+    quien usa la matriz (lista de slots); rows(slots) arma la submatriz en ese orden.
+    """
+    def __init__(self, capacity=CAPACIDAD_INICIAL):
+        self.data = np.zeros((capacity, PREGUNTAS), dtype=np.uint8)
+        self._free = list(range(capacity - 1, -1, -1))
+
+    def allocate(self, values=None):
+        """Reserva una fila con las respuestas `values` (lista de strings) y retorna su vista."""
+        if not self._free:
+            old = len(self.data)
+            grown = np.zeros((old * 2, PREGUNTAS), dtype=np.uint8)
+            grown[:old] = self.data
+            self.data = grown
+            self._free = list(range(old * 2 - 1, old - 1, -1))
+        slot = self._free.pop()
+        self.data[slot] = encode_answers(values)
+        return AnswerRow(self, slot)
+
+    def release(self, slot):
+        self.data[slot] = 0
+        self._free.append(slot)
+
+    def clear(self):
+        self.data = np.zeros((CAPACIDAD_INICIAL, PREGUNTAS), dtype=np.uint8)
+        self._free = list(range(CAPACIDAD_INICIAL - 1, -1, -1))
+
+    def rows(self, slots):
+        """Submatriz (copia) con las filas `slots`, en ese orden."""
+        return self.data[np.asarray(slots, dtype=np.intp)]
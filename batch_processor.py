@@ -0,0 +1,203 @@
+import argparse
+import csv
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import freeze_support
+
+from scanner_logic import ScannerLogic
+from session_manager import SessionManager
+from names_service import NamesService
+from omr_timing import TimingStats
+
+EXTENSIONES_IMAGEN = ('.bmp', '.png', '.jpg', '.jpeg')
+
+# Instancia de ScannerLogic propia de cada proceso worker (se crea en _init_worker)
+_worker_logic = None
+
+
+def _init_worker(template=None, use_layout=True):
+    """
+    Prepara la instancia del worker. Con `template` (hoja en blanco o limpia del formulario)
+    la plantilla se calibra de entrada; si no, cada worker la calibra con su primera hoja limpia.
+    """
+    global _worker_logic
+    _worker_logic = ScannerLogic()
+    _worker_logic.auto_calibrate = use_layout
+    if use_layout and template:
+        if _worker_logic.calibrate_layout(template) is None:
+            print(f"No se pudo calibrar la plantilla desde {template}; se calibra con la primera hoja limpia.", file=sys.stderr)
+
+
+def _process_one(image_path):
+    """
+    Procesa una hoja dentro de un worker.
+    Retorna solo datos livianos (sin la imagen de visualización) para no serializar
+    imágenes completas entre procesos.
+    """
+    logic = _worker_logic or ScannerLogic()
+    start = time.perf_counter()
+    error = ""
+    timings = {}
+    try:
+        # Modo liviano: lectura en grises y sin dibujar el overlay
+        rut, answers, vis_img = logic.process_image(image_path, lazy_overlay=True, use_layout=logic.auto_calibrate,
+                                                    timings=timings)
+        if vis_img is None:
+            error = "No se pudo leer la imagen"
+    except Exception as e:
+        rut, answers = "", []
+        error = str(e)
+    elapsed = time.perf_counter() - start
+    return {'path': image_path, 'rut': rut, 'answers': answers, 'seconds': elapsed, 'error': error, 'timings': timings}
+
+
+def collect_images(inputs):
+    """
+    Expande carpetas y patrones glob a una lista ordenada de imágenes (BMP/PNG/JPG).
+    Mantiene el orden de los argumentos y elimina duplicados.
+    """
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            found = [os.path.join(item, f) for f in os.listdir(item)]
+        else:
+            found = glob.glob(item)
+        paths.extend(sorted(p for p in found if p.lower().endswith(EXTENSIONES_IMAGEN) and os.path.isfile(p)))
+
+    seen = set()
+    unique = []
+    for p in paths:
+        key = os.path.abspath(p)
+        if key not in seen:
+            seen.add(key)
+            unique.append(p)
+    return unique
+
+
+def run_batch(image_paths, workers=None, on_progress=None, template=None, use_layout=True):
+    """
+    Ejecuta ScannerLogic.process_image sobre todas las imágenes usando un pool de procesos.
+    Los resultados se entregan en el mismo orden que `image_paths`.
+    on_progress(hechas, total, resultado) se invoca tras cada hoja.
+    template / use_layout: plantilla del formulario (ver _init_worker).
+    """
+    total = len(image_paths)
+    results = []
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if workers <= 1:
+        # Modo secuencial (útil para depurar o en equipos de un solo núcleo)
+        _init_worker(template, use_layout)
+        for res in map(_process_one, image_paths):
+            results.append(res)
+            if on_progress: on_progress(len(results), total, res)
+        return results
+
+    # chunksize > 1 reduce el overhead de IPC en lotes grandes sin perder el orden
+    chunksize = max(1, min(16, total // (workers * 8)))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(template, use_layout)) as pool:
+        for res in pool.map(_process_one, image_paths, chunksize=chunksize):
+            results.append(res)
+            if on_progress: on_progress(len(results), total, res)
+    return results
+
+
+def _raw_rut(rut):
+    return ''.join(filter(lambda x: x.isdigit() or x.lower() == 'k', rut)).upper()
+
+
+def write_csv(results, filename, names_service=None):
+    """CSV con archivo, RUT, nombre, tiempo por hoja, error y las 90 respuestas."""
+    header = ['archivo', 'rut', 'nombre', 'segundos', 'error'] + [f"P{i}" for i in range(1, 91)]
+    with open(filename, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for r in results:
+            name = names_service.get_name(_raw_rut(r['rut'])) if names_service and r['rut'] else ""
+            answers = (list(r['answers']) + [""] * 90)[:90]
+            writer.writerow([r['path'], r['rut'], name, f"{r['seconds']:.4f}", r['error']] + answers)
+
+
+def write_resp(results, filename, names_service=None):
+    """Reutiliza SessionManager.generate_report para producir el formato resp.txt."""
+    session = SessionManager()
+    for r in results:
+        name = names_service.get_name(_raw_rut(r['rut'])) if names_service and r['rut'] else ""
+        session.add_scan({
+            'path': r['path'],
+            'rut_text': r['rut'],
+            'student_name': name,
+            'answers_values': (list(r['answers']) + [""] * 90)[:90]
+        })
+    session.generate_report(filename)
+
+
+def _print_progress(done, total, res, started):
+    elapsed = time.perf_counter() - started
+    rate = done / elapsed if elapsed > 0 else 0.0
+    sys.stderr.write(f"\r[{done}/{total}] {rate:.1f} hojas/s - {os.path.basename(res['path'])[:40]:<40}")
+    if done == total:
+        sys.stderr.write("\n")
+    sys.stderr.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Procesamiento OMR por lotes (sin interfaz gráfica).")
+    parser.add_argument('entradas', nargs='+', help="Carpetas o patrones (ej: C:\\hojas o 'C:\\hojas\\*.bmp')")
+    parser.add_argument('-o', '--salida', default="resultados.csv", help="Archivo de salida (default: resultados.csv)")
+    parser.add_argument('-f', '--formato', choices=['csv', 'resp'], default=None,
+                        help="csv (con tiempos) o resp (formato resp.txt). Por defecto se deduce de la extensión.")
+    parser.add_argument('-j', '--workers', type=int, default=None, help="Cantidad de procesos (default: todos los núcleos)")
+    parser.add_argument('--nombres', default=None, help="Ruta a nombres.txt para completar nombres")
+    parser.add_argument('--plantilla', default=None,
+                        help="Hoja en blanco (o limpia) del formulario para calibrar la posición de las burbujas")
+    parser.add_argument('--sin-plantilla', action='store_true',
+                        help="Procesar cada hoja con el pipeline completo, sin plantilla")
+    parser.add_argument('--tiempos', default=None,
+                        help="Guardar en JSON los histogramas de tiempo por etapa de process_image")
+    args = parser.parse_args(argv)
+
+    image_paths = collect_images(args.entradas)
+    if not image_paths:
+        print("No se encontraron imágenes (BMP/PNG/JPG).", file=sys.stderr)
+        return 1
+
+    formato = args.formato
+    if formato is None:
+        formato = 'csv' if args.salida.lower().endswith('.csv') else 'resp'
+
+    names_service = NamesService(args.nombres) if args.nombres else NamesService()
+
+    started = time.perf_counter()
+    results = run_batch(image_paths, workers=args.workers,
+                        on_progress=lambda d, t, r: _print_progress(d, t, r, started),
+                        template=args.plantilla,
+                        use_layout=not args.sin_plantilla)
+    elapsed = time.perf_counter() - started
+
+    if formato == 'csv':
+        write_csv(results, args.salida, names_service)
+    else:
+        write_resp(results, args.salida, names_service)
+
+    if args.tiempos:
+        stats = TimingStats()
+        for r in results:
+            if r['timings']:
+                stats.add(r['timings'])
+        stats.dump(args.tiempos)
+        print(stats.format_table(), file=sys.stderr)
+
+    errors = sum(1 for r in results if r['error'])
+    print(f"Procesadas {len(results)} hojas en {elapsed:.1f}s ({len(results) / elapsed:.1f} hojas/s). "
+          f"Errores: {errors}. Salida: {args.salida}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    freeze_support()
+    sys.exit(main())
@@ -0,0 +1,161 @@
+import cv2
+import numpy as np
+
+# Búsqueda del desplazamiento de la hoja completa respecto de la plantilla (fracción del tamaño de la página)
+BUSQUEDA_GLOBAL = 0.05
+
+# Ajuste fino por región, como fracción del paso entre burbujas.
+# Menor a 0.5 para que una fila nunca se confunda con la vecina.
+BUSQUEDA_REGION = 0.45
+
+# Correlación normalizada mínima entre los perfiles de la hoja y la plantilla
+CORRELACION_MINIMA = 0.6
+
+# Diferencia de tamaño tolerada entre la hoja y la plantilla (fracción)
+TOLERANCIA_TAMANO = 0.02
+
+# Preguntas por región de alineación. Regiones chicas absorben una leve inclinación de la hoja.
+PREGUNTAS_POR_REGION = 10
+
+
+def _best_shift(template, profile, max_shift):
+    """
+    Desplazamiento s en [-max_shift, max_shift] que maximiza la correlación normalizada entre
+    `template` y profile[max_shift + s : max_shift + s + len(template)].
+    Retorna (s, correlación). Un máximo en el borde de la búsqueda no es confiable (None).
+
+    cv2.matchTemplate (TM_CCOEFF_NORMED) calcula la misma correlación sin armar la matriz
+    de ventanas; una ventana sin variación (perfil plano) cuenta como correlación 0.
+    """
+    scores = cv2.matchTemplate(profile[None, :], template[None, :], cv2.TM_CCOEFF_NORMED).ravel()
+    scores = np.nan_to_num(scores, nan=0.0, posinf=0.0, neginf=0.0)
+    best = int(np.argmax(scores))
+    if max_shift > 0 and best in (0, len(scores) - 1):
+        return None, float(scores[best])
+    return best - max_shift, float(scores[best])
+
+
+def ink_table(thresh):
+    """
+    Tabla de áreas sumadas (cv2.integral, int32) de la hoja binarizada como 0/1: la tinta de
+    cualquier rectángulo se lee con 4 accesos. Se arma una vez por hoja y sirve para la
+    alineación y el muestreo de las burbujas.
+    """
+    return cv2.integral(thresh >> 7, sdepth=cv2.CV_32S)
+
+
+def _profiles(sat, x0, y0, x1, y1):
+    """Perfiles de tinta (pixeles por columna y por fila) de la ventana [x0, x1) x [y0, y1)."""
+    cols = np.diff(sat[y1, x0:x1 + 1] - sat[y0, x0:x1 + 1]).astype(np.float32)
+    rows = np.diff(sat[y0:y1 + 1, x1] - sat[y0:y1 + 1, x0]).astype(np.float32)
+    return cols, rows
+
+
+class FormLayout:
+    """
+    Plantilla de Formulario Calibrada.
+
+    Guarda la posición de cada burbuja impresa, medida una sola vez con el pipeline completo
+    sobre una hoja limpia (o una hoja en blanco). Las hojas siguientes del mismo formulario
+    solo se alinean con la plantilla y se muestrean directo en esas posiciones.
+
+    - rects: rectángulos Nx4 [x, y, w, h] de las burbujas, en coordenadas de la plantilla.
+    - rut_slots: por columna del RUT, (índices en rects, caracteres de cada fila).
+    - answer_slots: por pregunta, (índices en rects, letras de cada opción).
+    - ring_density: densidad típica del rectángulo completo de una burbuja vacía
+      (su borde impreso); sirve para verificar que la alineación cae sobre las burbujas.
+
+    Alineación (align):
+    1. Desplazamiento global de la hoja por correlación de los perfiles de tinta horizontal y vertical.
+    2. Ajuste fino por región (RUT y grupos de PREGUNTAS_POR_REGION preguntas), acotado a
+       menos de medio paso entre burbujas.
+    """
+    def __init__(self, thresh, rects, rut_slots, answer_slots, pitch, ring_density):
+        self.shape = thresh.shape[:2]
+        sat = ink_table(thresh)
+        self.rects = rects
+        self.rut_slots = rut_slots
+        self.answer_slots = answer_slots
+        self.ring_density = ring_density
+
+        # Pregunta de cada burbuja (-1 en el RUT), para el overlay como datos
+        self.questions = np.full(len(rects), -1, np.int16)
+        for q, (idx, _) in enumerate(answer_slots):
+            self.questions[idx] = q
+
+        height, width = self.shape
+        self.global_shift = max(1, int(max(height, width) * BUSQUEDA_GLOBAL))
+        self.region_shift = max(1, int(pitch * BUSQUEDA_REGION))
+
+        # Perfiles de la página completa, sin el margen que se recorre al buscar
+        g = self.global_shift
+        cols, rows = _profiles(sat, 0, 0, width, height)
+        self.col_profile = cols[g:width - g]
+        self.row_profile = rows[g:height - g]
+
+        # Regiones: el RUT completo y las preguntas en grupos consecutivos
+        groups = [np.concatenate([idx for idx, _ in rut_slots])]
+        for start in range(0, len(answer_slots), PREGUNTAS_POR_REGION):
+            chunk = answer_slots[start:start + PREGUNTAS_POR_REGION]
+            groups.append(np.concatenate([idx for idx, _ in chunk]))
+
+        self.regions = []
+        pad = int(pitch / 2)
+        r = self.region_shift
+        for idx in groups:
+            sel = rects[idx]
+            x0 = max(0, int(sel[:, 0].min()) - pad)
+            y0 = max(0, int(sel[:, 1].min()) - pad)
+            x1 = min(width, int((sel[:, 0] + sel[:, 2]).max()) + pad)
+            y1 = min(height, int((sel[:, 1] + sel[:, 3]).max()) + pad)
+            # El perfil de columnas suma filas con holgura vertical (y viceversa),
+            # igual que la ventana que se mide en align() sobre la hoja.
+            cols, _ = _profiles(sat, x0, max(0, y0 - r), x1, min(height, y1 + r))
+            _, rows = _profiles(sat, max(0, x0 - r), y0, min(width, x1 + r), y1)
+            self.regions.append({'idx': idx, 'box': (x0, y0, x1, y1), 'cols': cols, 'rows': rows})
+
+    def align(self, sat):
+        """
+        Ubica las burbujas de la plantilla en una hoja binarizada igual que la plantilla,
+        dada su tabla de tinta (ink_table): los perfiles salen de la tabla sin recorrer la página.
+        Retorna (rects Nx4 alineados, correlación mínima) o None si la hoja no calza con la plantilla.
+        """
+        height, width = sat.shape[0] - 1, sat.shape[1] - 1
+        t_height, t_width = self.shape
+        if abs(height - t_height) > t_height * TOLERANCIA_TAMANO or abs(width - t_width) > t_width * TOLERANCIA_TAMANO:
+            return None
+
+        # 1. Desplazamiento global
+        g = self.global_shift
+        cols, rows = _profiles(sat, 0, 0, width, height)
+        n_cols = min(width, t_width) - 2 * g
+        n_rows = min(height, t_height) - 2 * g
+        dx, score_x = _best_shift(self.col_profile[:n_cols], cols[:n_cols + 2 * g], g)
+        dy, score_y = _best_shift(self.row_profile[:n_rows], rows[:n_rows + 2 * g], g)
+        if dx is None or dy is None:
+            return None
+        worst = min(score_x, score_y)
+
+        # 2. Ajuste fino por región
+        r = self.region_shift
+        aligned = self.rects.copy()
+        for region in self.regions:
+            x0, y0, x1, y1 = region['box']
+            x0, x1 = x0 + dx, x1 + dx
+            y0, y1 = y0 + dy, y1 + dy
+            if x0 - r < 0 or y0 - r < 0 or x1 + r > width or y1 + r > height:
+                return None
+
+            cols, rows = _profiles(sat, x0 - r, y0 - r, x1 + r, y1 + r)
+            rx, score_x = _best_shift(region['cols'], cols, r)
+            ry, score_y = _best_shift(region['rows'], rows, r)
+            if rx is None or ry is None:
+                return None
+            worst = min(worst, score_x, score_y)
+
+            aligned[region['idx'], 0] += dx + rx
+            aligned[region['idx'], 1] += dy + ry
+
+        if worst < CORRELACION_MINIMA:
+            return None
+        return aligned, worst
@@ -0,0 +1,94 @@
+import threading
+from collections import OrderedDict
+
+# Presupuesto de la caché de imágenes decodificadas (lo que se cumpla primero).
+# Una hoja de visualización (~1000 px de alto, BGR) ocupa unos 2.3 MB.
+CACHE_MAX_IMAGENES = 12
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+
+def _image_bytes(image):
+    """Memoria de una imagen decodificada (ndarray u objeto con atributo nbytes)."""
+    return int(getattr(image, 'nbytes', 0))
+
+
+class ImageCache:
+    """
+    Caché LRU de Imágenes Decodificadas.
+
+    Las hojas de la sesión se guardan comprimidas (JPG); aquí quedan solo las últimas
+    decodificadas, acotadas por cantidad (max_items) y por memoria (max_bytes).
+    Lleva estadísticas (aciertos, fallos, descartes, bytes residentes) para ajustar el presupuesto.
+
+    Thread safe. El loader se ejecuta fuera del lock: dos hilos pueden decodificar la misma
+    hoja a la vez, y la segunda copia simplemente reemplaza a la primera.
+    Las imágenes entregadas son compartidas: quien las quiera modificar debe copiarlas.
+    """
+    def __init__(self, max_items=CACHE_MAX_IMAGENES, max_bytes=CACHE_MAX_BYTES):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._items = OrderedDict() # clave -> (imagen, bytes)
+        self._lock = threading.Lock()
+        self.resident_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, loader):
+        """Imagen de `key`; si no está, la obtiene con loader() y la guarda (None no se guarda)."""
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        image = loader()
+        if image is not None:
+            self.put(key, image)
+        return image
+
+    def put(self, key, image):
+        size = _image_bytes(image)
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.resident_bytes -= old[1]
+            self._items[key] = (image, size)
+            self.resident_bytes += size
+            # La más reciente se conserva aunque sola supere el presupuesto de memoria
+            while len(self._items) > 1 and (len(self._items) > self.max_items or self.resident_bytes > self.max_bytes):
+                _, (_, evicted) = self._items.popitem(last=False)
+                self.resident_bytes -= evicted
+                self.evictions += 1
+
+    def contains(self, key):
+        with self._lock:
+            return key in self._items
+
+    def discard(self, key):
+        with self._lock:
+            entry = self._items.pop(key, None)
+            if entry is not None:
+                self.resident_bytes -= entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.resident_bytes = 0
+
+    def stats(self):
+        """Estadísticas para ajustar el presupuesto."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'imagenes': len(self._items),
+                'max_imagenes': self.max_items,
+                'bytes_residentes': self.resident_bytes,
+                'max_bytes': self.max_bytes,
+                'aciertos': self.hits,
+                'fallos': self.misses,
+                'tasa_aciertos': self.hits / lookups if lookups else 0.0,
+                'descartes': self.evictions,
+            }
@@ -1,33 +1,204 @@
 import os
+import pickle
+import threading
+import time
+import zlib
+
+from rut_index import MAX_CANDIDATOS, RutIndex
+
+# Índice binario de la base de nombres (se guarda junto al programa, uno por archivo de nombres).
+# Si el archivo no cambió (tamaño y fecha) se carga el índice sin leer el archivo; si solo creció
+# y lo ya leído sigue igual (CRC32 de todo ese tramo) se leen únicamente las líneas agregadas.
+CARPETA_INDICE = "indices"
+VERSION_INDICE = 2
+
+# Bloque con que se relee lo ya leído para comparar su CRC32
+BLOQUE_CONTROL = 1024 * 1024
+
 
 class NamesService:
-    def __init__(self, db_path=r"C:\psicofas\pruebas\nombres.txt"):
+    """
+    Servicio de Nombres de Alumnos (RUT -> nombre) desde nombres.txt (líneas RUT=NOMBRE).
+
+    background=True: la primera carga se hace en un hilo aparte (la ventana abre sin esperar).
+    get_name() espera esa primera carga; las recargas posteriores reemplazan el diccionario de
+    una vez al terminar, así las búsquedas nunca ven una base a medio cargar.
+
+    find_ruts() busca en la base los RUT cercanos a uno mal leído (ver rut_index); el índice
+    se arma junto con cada carga.
+    """
+    def __init__(self, db_path=r"C:\psicofas\pruebas\nombres.txt", background=False):
         self.db_path = db_path
         self.db = {}
-        self.reload()
+        self.rut_index = RutIndex(())
+        self._state = None # Lo leído del archivo: tamaño, fecha, posición, CRC32 y última línea
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._loader = None
+        if background:
+            self.start_reload()
+        else:
+            self.reload()
+
+    def start_reload(self):
+        """Recarga en segundo plano (no hace nada si ya hay una en curso)."""
+        with self._lock:
+            if self.is_loading():
+                return
+            self._loader = threading.Thread(target=self.reload, name="cargar-nombres", daemon=True)
+            self._loader.start()
+
+    def is_loading(self):
+        return self._loader is not None and self._loader.is_alive()
+
+    def wait(self):
+        """Espera a que termine la carga en curso."""
+        loader = self._loader
+        if loader is not None and loader is not threading.current_thread():
+            loader.join()
 
     def reload(self):
-        """Recarga la base de datos de nombres desde el archivo."""
-        self.db = {}
-        if not os.path.exists(self.db_path):
-            return 0
-        
-        count = 0
+        """
+        Recarga la base de datos de nombres desde el archivo. Retorna la cantidad de nombres.
+        Sin cambios en el archivo no se lee nada; si solo se agregaron líneas, se leen solo esas.
+        """
+        started = time.perf_counter()
         try:
-            with open(self.db_path, 'r', encoding='latin-1') as f:
-                 for line in f:
-                     line = line.strip()
-                     if "=" in line:
-                         p = line.split("=", 1)
-                         rut_key = p[0].strip().upper() 
-                         name = p[1].strip()
-                         self.db[rut_key] = name
-                         count += 1
-            print(f"Service: Cargados {len(self.db)} nombres.")
+            if not os.path.exists(self.db_path):
+                self.db = {}
+                self.rut_index = RutIndex(())
+                self._state = None
+                return 0
+
+            st = os.stat(self.db_path)
+            state = self._state
+            mode = "sin cambios"
+            if state is None:
+                state = self._load_index()
+                if state is not None:
+                    self.db = state.pop('nombres')
+                    self._state = state
+                    mode = "índice"
+
+            if state is not None and state['tamano'] == st.st_size and state['fecha'] == st.st_mtime_ns:
+                pass
+            elif state is not None and st.st_size > state['tamano'] and self._only_appended(state):
+                # Misma longitud con otra fecha = editado en el lugar: va por la lectura completa
+                db = dict(self.db)
+                db.pop(state['clave_parcial'], None) # La última línea sin salto pudo quedar incompleta
+                self._state = self._parse(db, state['posicion'], state['crc'])
+                self.db = db
+                mode = "incremental"
+            else:
+                db = {}
+                self._state = self._parse(db, 0, 0)
+                self.db = db
+                mode = "completo"
+
+            if mode != "sin cambios":
+                self.rut_index = RutIndex(self.db)
+            if mode in ("incremental", "completo"):
+                self._save_index()
+            elapsed = (time.perf_counter() - started) * 1000
+            print(f"Service: Cargados {len(self.db)} nombres ({mode}, {elapsed:.0f} ms).")
         except Exception as e:
             print(f"Error cargando nombres: {e}")
+        finally:
+            self._ready.set()
         return len(self.db)
 
     def get_name(self, raw_rut):
         """Busca un nombre dado un RUT raw (sin puntos ni guion)."""
+        self._ready.wait()
         return self.db.get(raw_rut, "")
+
+    def find_ruts(self, decoded, scores=None):
+        """
+        RUT de la base a una columna de `decoded` (RUT leído, '?' = columna sin marca),
+        del más al menos probable: lista de (rut, puntaje) de a lo más MAX_CANDIDATOS.
+        scores: densidad de las burbujas por columna (ver ScannerLogic.process_image).
+        """
+        self._ready.wait()
+        return self.rut_index.candidates(decoded, scores)[:MAX_CANDIDATOS]
+
+    # --- Lectura del archivo ---
+
+    def _only_appended(self, state):
+        """True si lo ya leído del archivo sigue igual byte a byte (el archivo solo creció)."""
+        crc = 0
+        remaining = state['posicion']
+        with open(self.db_path, 'rb') as f:
+            while remaining > 0:
+                block = f.read(min(BLOQUE_CONTROL, remaining))
+                if not block:
+                    return False
+                crc = zlib.crc32(block, crc)
+                remaining -= len(block)
+        return crc == state['crc']
+
+    def _parse(self, db, offset, crc):
+        """
+        Lee el archivo desde `offset` y agrega sus líneas a `db`. Retorna el estado nuevo.
+        crc: CRC32 de los bytes [0, offset), que se extiende con las líneas completas leídas.
+        La posición queda al final de la última línea completa; una última línea sin salto
+        se carga igual, pero se vuelve a leer en la próxima recarga.
+        """
+        with open(self.db_path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            f.seek(offset)
+            data = f.read()
+
+        end = data.rfind(b"\n") + 1
+        partial_key = None
+        lines = data.decode('latin-1').split("\n")
+        for line in lines:
+            line = line.strip()
+            if "=" in line:
+                p = line.split("=", 1)
+                rut_key = p[0].strip().upper()
+                db[rut_key] = p[1].strip()
+        if end < len(data):
+            last = lines[-1].strip()
+            if "=" in last:
+                partial_key = last.split("=", 1)[0].strip().upper()
+
+        position = offset + end
+        return {
+            'tamano': st.st_size,
+            'fecha': st.st_mtime_ns,
+            'posicion': position,
+            'crc': zlib.crc32(data[:end], crc),
+            'clave_parcial': partial_key,
+        }
+
+    # --- Índice persistente ---
+
+    def _index_path(self):
+        name = os.path.abspath(self.db_path)
+        return os.path.join(CARPETA_INDICE, f"nombres_{zlib.crc32(name.encode('utf-8')):08x}.idx")
+
+    def _load_index(self):
+        path = self._index_path()
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                index = pickle.load(f)
+            if index.get('version') != VERSION_INDICE or index.get('archivo') != os.path.abspath(self.db_path):
+                return None
+            return index
+        except Exception as e:
+            print(f"Índice de nombres no válido, se vuelve a leer el archivo: {e}")
+            return None
+
+    def _save_index(self):
+        path = self._index_path()
+        tmp = path + ".tmp"
+        index = dict(self._state, nombres=self.db, version=VERSION_INDICE, archivo=os.path.abspath(self.db_path))
+        try:
+            os.makedirs(CARPETA_INDICE, exist_ok=True)
+            with open(tmp, 'wb') as f:
+                pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        except Exception as e:
+            print(f"No se pudo guardar el índice de nombres: {e}")
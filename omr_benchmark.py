@@ -0,0 +1,173 @@
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from omr_timing import TimingStats
+from scanner_logic import ScannerLogic
+from synthetic_sheets import generate_sheets
+
+# Degradaciones por escenario (parámetros de synthetic_sheets.render_sheet)
+ESCENARIOS = {
+    'limpia': {},
+    'lapiz': {'pencil_gray': 150},
+    'borrones': {'erasures': 40},
+    'rayas': {'streaks': 5},
+    'inclinada': {'skew_deg': 0.6, 'shift': (25, -15)},
+    'ruido': {'noise': 20},
+    'todo': {'pencil_gray': 140, 'erasures': 30, 'streaks': 4, 'skew_deg': 0.5, 'shift': (-20, 10), 'noise': 15},
+}
+
+
+def _percentile(values, q):
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def run_scenario(logic, sheets, lazy_overlay=True, use_layout=True, memory=False):
+    """
+    Procesa las hojas con logic.process_image y compara contra la verdad de terreno.
+    Retorna un dict con tiempos (ms por hoja) y precisión.
+
+    memory: mide además las asignaciones de Python por hoja (tracemalloc: bloques y pico
+    de memoria) y las recolecciones del GC. Agrega overhead: no comparar sus tiempos
+    con una corrida sin esta opción.
+    """
+    latencies = []
+    blocks = []
+    peaks = []
+    rut_ok = 0
+    sheets_ok = 0
+    items_ok = 0
+    items_total = 0
+
+    logic.reset_layout()
+    if memory:
+        tracemalloc.start()
+        gc_before = sum(g['collections'] for g in gc.get_stats())
+    started = time.perf_counter()
+    for sheet in sheets:
+        if memory:
+            tracemalloc.clear_traces()
+            tracemalloc.reset_peak()
+        t0 = time.perf_counter()
+        rut, answers, _ = logic.process_image(sheet.image, lazy_overlay=lazy_overlay, use_layout=use_layout)
+        latencies.append((time.perf_counter() - t0) * 1000.0)
+        if memory:
+            # Bloques aún vivos de la hoja (resultado incluido) y pico durante el proceso
+            snapshot = tracemalloc.take_snapshot()
+            blocks.append(sum(stat.count for stat in snapshot.statistics('filename')))
+            peaks.append(tracemalloc.get_traced_memory()[1] / 1024.0)
+
+        answers = (list(answers) + [""] * len(sheet.answers))[:len(sheet.answers)]
+        hits = sum(1 for got, exp in zip(answers, sheet.answers) if got == exp)
+        rut_ok += rut == sheet.rut
+        items_ok += hits
+        items_total += len(sheet.answers)
+        sheets_ok += rut == sheet.rut and hits == len(sheet.answers)
+    elapsed = time.perf_counter() - started
+
+    count = len(sheets)
+    extra = {}
+    if memory:
+        extra = {
+            'bloques_por_hoja': _percentile(blocks, 50),
+            'pico_kb_por_hoja': _percentile(peaks, 50),
+            'recolecciones_gc': sum(g['collections'] for g in gc.get_stats()) - gc_before,
+        }
+        tracemalloc.stop()
+    return {**extra,
+        'hojas': count,
+        'hojas_por_segundo': count / elapsed if elapsed > 0 else 0.0,
+        'p50_ms': _percentile(latencies, 50),
+        'p95_ms': _percentile(latencies, 95),
+        'rut_correctos': rut_ok / count if count else 0.0,
+        'respuestas_correctas': items_ok / items_total if items_total else 0.0,
+        'hojas_correctas': sheets_ok / count if count else 0.0,
+    }
+
+
+def save_sheets(sheets, folder, prefix):
+    """Guarda las hojas como PNG y retorna {archivo: [rut, respuestas]} (verdad de terreno)."""
+    os.makedirs(folder, exist_ok=True)
+    truth = {}
+    for i, sheet in enumerate(sheets):
+        path = os.path.join(folder, f"{prefix}_{i:04d}.png")
+        cv2.imwrite(path, sheet.image)
+        truth[path] = [sheet.rut, sheet.answers]
+    return truth
+
+
+def _print_row(name, dpi, res):
+    line = (f"{name:<10} {dpi:>4} {res['hojas']:>6} {res['hojas_por_segundo']:>8.1f} "
+            f"{res['p50_ms']:>8.1f} {res['p95_ms']:>8.1f} {res['rut_correctos']:>7.1%} "
+            f"{res['respuestas_correctas']:>8.2%} {res['hojas_correctas']:>7.1%}")
+    if 'bloques_por_hoja' in res:
+        line += f" {res['bloques_por_hoja']:>8.0f} {res['pico_kb_por_hoja']:>8.0f} {res['recolecciones_gc']:>4}"
+    print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de velocidad y precisión del motor OMR con hojas sintéticas.")
+    parser.add_argument('-n', '--hojas', type=int, default=20, help="Hojas por escenario y resolución (default: 20)")
+    parser.add_argument('--dpi', type=int, nargs='+', default=[200], help="Resoluciones a generar (default: 200)")
+    parser.add_argument('-e', '--escenarios', nargs='+', choices=sorted(ESCENARIOS), default=sorted(ESCENARIOS),
+                        help="Escenarios de degradación (default: todos)")
+    parser.add_argument('--semilla', type=int, default=0, help="Semilla para reproducir las hojas")
+    parser.add_argument('--sin-plantilla', action='store_true', help="Medir siempre el pipeline completo")
+    parser.add_argument('--overlay', action='store_true', help="Dibujar el overlay en cada hoja (modo escaneo con UI)")
+    parser.add_argument('--memoria', action='store_true',
+                        help="Medir asignaciones por hoja (tracemalloc) y recolecciones del GC")
+    parser.add_argument('--tiempos', default=None,
+                        help="Guardar en JSON los histogramas de tiempo por etapa (y mostrar el resumen)")
+    parser.add_argument('--json', default=None, help="Guardar los resultados en un archivo JSON")
+    parser.add_argument('--guardar', default=None,
+                        help="Carpeta donde dejar las hojas (PNG) y verdad.json, p.ej. para batch_processor")
+    args = parser.parse_args(argv)
+
+    logic = ScannerLogic()
+    if args.tiempos:
+        logic.timing_stats = TimingStats()
+
+    header = (f"{'escenario':<10} {'dpi':>4} {'hojas':>6} {'hojas/s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+              f"{'rut':>7} {'resp.':>8} {'hojas':>7}")
+    if args.memoria:
+        header += f" {'bloques':>8} {'pico kb':>8} {'gc':>4}"
+    print(header)
+
+    results = []
+    truth = {}
+    for dpi in args.dpi:
+        for k, name in enumerate(args.escenarios):
+            # La generación queda fuera de la medición
+            seed = args.semilla * 1000 + dpi + k
+            sheets = list(generate_sheets(args.hojas, dpi=dpi, seed=seed, **ESCENARIOS[name]))
+            if args.guardar:
+                truth.update(save_sheets(sheets, args.guardar, f"{name}_{dpi}"))
+
+            res = run_scenario(logic, sheets, lazy_overlay=not args.overlay, use_layout=not args.sin_plantilla,
+                               memory=args.memoria)
+            res.update({'escenario': name, 'dpi': dpi})
+            results.append(res)
+            _print_row(name, dpi, res)
+
+    if args.tiempos:
+        logic.timing_stats.dump(args.tiempos)
+        print()
+        print(logic.timing_stats.format_table())
+    if args.guardar:
+        with open(os.path.join(args.guardar, "verdad.json"), 'w', encoding='utf-8') as f:
+            json.dump(truth, f)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+import json
+import threading
+import time
+
+# Límites superiores (ms) de los intervalos de los histogramas por etapa
+LIMITES_MS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000)
+
+
+class StageTimer:
+    """
+    Cronómetro por etapas de una hoja.
+    lap(nombre) acumula el tiempo transcurrido desde la vuelta anterior en la etapa `nombre`;
+    count(nombre, valor) registra conteos (candidatos, marcas, ...).
+    """
+    __slots__ = ('stages', 'counts', '_last')
+
+    def __init__(self):
+        self.stages = {}
+        self.counts = {}
+        self._last = time.perf_counter()
+
+    def lap(self, name):
+        now = time.perf_counter()
+        self.stages[name] = self.stages.get(name, 0.0) + (now - self._last) * 1000.0
+        self._last = now
+
+    def count(self, name, value):
+        self.counts[name] = value
+
+    def as_dict(self):
+        return {'etapas_ms': dict(self.stages), 'conteos': dict(self.counts)}
+
+
+class NullTimer:
+    """Cronómetro apagado: sin medición y con costo casi nulo en el camino caliente."""
+    __slots__ = ()
+
+    def lap(self, name):
+        pass
+
+    def count(self, name, value):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+class TimingStats:
+    """
+    Histogramas de tiempos por etapa acumulados en la sesión.
+    add() es thread safe (las hojas se decodifican en paralelo).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.sheets = 0
+        self.stages = {}
+        self.counts = {}
+
+    def add(self, timings):
+        """Agrega el resultado de una hoja (dict de StageTimer.as_dict)."""
+        with self._lock:
+            self.sheets += 1
+            for name, ms in timings.get('etapas_ms', {}).items():
+                stage = self.stages.get(name)
+                if stage is None:
+                    stage = {'n': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'histograma': [0] * (len(LIMITES_MS) + 1)}
+                    self.stages[name] = stage
+                stage['n'] += 1
+                stage['total_ms'] += ms
+                stage['max_ms'] = max(stage['max_ms'], ms)
+                bucket = next((i for i, limit in enumerate(LIMITES_MS) if ms <= limit), len(LIMITES_MS))
+                stage['histograma'][bucket] += 1
+            for name, value in timings.get('conteos', {}).items():
+                if not isinstance(value, (int, float)):
+                    continue
+                agg = self.counts.setdefault(name, {'n': 0, 'total': 0, 'min': value, 'max': value})
+                agg['n'] += 1
+                agg['total'] += value
+                agg['min'] = min(agg['min'], value)
+                agg['max'] = max(agg['max'], value)
+
+    def summary(self):
+        """Resumen serializable: por etapa n, total, promedio, máximo e histograma."""
+        with self._lock:
+            stages = {}
+            for name, s in self.stages.items():
+                stages[name] = dict(s, promedio_ms=s['total_ms'] / s['n'], histograma=list(s['histograma']))
+            counts = {name: dict(c, promedio=c['total'] / c['n']) for name, c in self.counts.items()}
+            return {'hojas': self.sheets, 'limites_ms': list(LIMITES_MS), 'etapas': stages, 'conteos': counts}
+
+    def dump(self, filename):
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def format_table(self):
+        """Tabla de texto (promedio y máximo por etapa) para consola."""
+        summary = self.summary()
+        lines = [f"{'etapa':<20} {'n':>6} {'prom ms':>9} {'max ms':>9}"]
+        for name, s in summary['etapas'].items():
+            lines.append(f"{name:<20} {s['n']:>6} {s['promedio_ms']:>9.2f} {s['max_ms']:>9.2f}")
+        return "\n".join(lines)
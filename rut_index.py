@@ -0,0 +1,159 @@
+import numpy as np
+
+# --- Validación y corrección de RUT leídos ---
+# Un RUT leído con el dígito verificador malo, o que no está en la base de nombres, se busca
+# en la base entre los RUT que difieren en a lo más una columna ('?' = columna sin marca).
+# Los candidatos se ordenan por la densidad de tinta de las burbujas que cada uno implica.
+
+# Candidatos que se guardan en la hoja para que el operador elija
+MAX_CANDIDATOS = 5
+# Ventaja mínima de densidad del primer candidato sobre el segundo para corregir solo
+MARGEN_CORRECCION = 0.15
+
+# Caracteres de un RUT: código 0..10 ('K' = 10); COMODIN = columna sin lectura
+CARACTERES = "0123456789K"
+COMODIN = len(CARACTERES)
+_TABLA = np.full(256, 255, dtype=np.uint8)
+for _code, _char in enumerate(CARACTERES + "?"):
+    _TABLA[ord(_char)] = _code
+_TABLA[ord('k')] = 10
+
+
+def clean_rut(text):
+    """RUT sin puntos ni guion, en mayúsculas; conserva los '?' de columnas no leídas."""
+    return ''.join(c for c in str(text or "").upper() if c in CARACTERES or c == '?')
+
+
+def check_digit(body):
+    """Dígito verificador (módulo 11) del cuerpo numérico de un RUT."""
+    total = 0
+    factor = 2
+    for digit in reversed(body):
+        total += int(digit) * factor
+        factor = 2 if factor == 7 else factor + 1
+    dv = 11 - total % 11
+    return "0" if dv == 11 else "K" if dv == 10 else str(dv)
+
+
+def is_valid_rut(raw):
+    """True si `raw` (cuerpo + dígito verificador, sin puntos ni guion) cumple el módulo 11."""
+    raw = str(raw or "").upper()
+    if len(raw) < 2 or not raw[:-1].isdigit():
+        return False
+    return check_digit(raw[:-1]) == raw[-1]
+
+
+def _encode(ruts):
+    """Matriz de códigos (N x largo) para RUT del mismo largo (255 = carácter que no es de RUT)."""
+    data = np.frombuffer("".join(ruts).encode('latin-1', errors='replace'), dtype=np.uint8)
+    return _TABLA[data].reshape(len(ruts), -1)
+
+
+def _half_keys(codes, start, end):
+    """Clave entera (base 12) de las columnas [start, end) de cada fila."""
+    keys = np.zeros(len(codes), dtype=np.int64)
+    for j in range(start, end):
+        keys = keys * 12 + codes[:, j]
+    return keys
+
+
+class RutIndex:
+    """
+    Índice de RUT conocidos para buscar los que están a una columna de un RUT leído.
+
+    Por cada largo: los RUT como matriz de códigos y, para la mitad izquierda y la derecha,
+    sus claves ordenadas. Si dos RUT difieren en una sola columna, la otra mitad es idéntica:
+    basta una búsqueda binaria por mitad y verificar los pocos RUT que comparten esa mitad.
+    """
+    def __init__(self, ruts):
+        by_length = {}
+        for rut in ruts:
+            by_length.setdefault(len(rut), []).append(rut)
+
+        self._groups = {}
+        for length, group in by_length.items():
+            if length == 0:
+                continue
+            codes = _encode(group)
+            valid = (codes < COMODIN).all(axis=1) # Claves de la base que no son RUT se ignoran
+            if not valid.all():
+                group = [rut for rut, ok in zip(group, valid.tolist()) if ok]
+                codes = codes[valid]
+            half = length // 2
+            halves = []
+            for start, end in ((0, half), (half, length)):
+                keys = _half_keys(codes, start, end)
+                order = np.argsort(keys, kind='stable')
+                halves.append((start, end, keys[order], order))
+            self._groups[length] = (np.array(group), codes, halves)
+
+    def __len__(self):
+        return sum(len(g[0]) for g in self._groups.values())
+
+    def candidates(self, decoded, scores=None):
+        """
+        RUT conocidos a una sustitución o comodín de `decoded` (texto leído, con '?').
+        Retorna lista de (rut, puntaje) del mejor al peor: primero los de dígito verificador
+        válido, luego por densidad de las burbujas que el candidato implica en las columnas
+        donde difiere (scores: por columna del RUT leído, dict carácter -> densidad).
+
+        Si la lectura empieza con columnas vacías (RUT más corto que la grilla) se busca también
+        sin ellas.
+        """
+        decoded = clean_rut(decoded)
+        found = {}
+        offsets = [0]
+        stripped = len(decoded) - len(decoded.lstrip('?'))
+        if stripped:
+            offsets.append(stripped)
+        for offset in offsets:
+            for rut, columns in self._search(decoded[offset:]):
+                score = 0.0
+                if scores:
+                    for j in columns:
+                        column = scores[offset + j] if offset + j < len(scores) else {}
+                        score += column.get(rut[j], 0.0)
+                found[rut] = max(score, found.get(rut, 0.0))
+
+        ranked = sorted(found.items(), key=lambda item: (not is_valid_rut(item[0]), -item[1], item[0]))
+        return ranked
+
+    def _search(self, query):
+        """RUT a distancia <= 1 de `query` (mismo largo). Genera (rut, columnas distintas)."""
+        group = self._groups.get(len(query))
+        if group is None or not query:
+            return
+        ruts, codes, halves = group
+        q = _encode([query])[0]
+        wild = q == COMODIN
+        if wild.sum() > 1:
+            return
+
+        rows = []
+        for start, end, keys, order in halves:
+            if wild[start:end].any():
+                continue # El comodín está en esta mitad: la otra debe calzar
+            key = int(_half_keys(q[None, :], start, end)[0])
+            lo, hi = np.searchsorted(keys, [key, key + 1])
+            rows.append(order[lo:hi])
+        if not rows:
+            return
+        rows = np.unique(np.concatenate(rows))
+
+        differ = (codes[rows] != q) | wild
+        distance = differ.sum(axis=1)
+        for k in np.flatnonzero(distance <= 1).tolist():
+            yield str(ruts[rows[k]]), np.flatnonzero(differ[k]).tolist()
+
+
+def choose(decoded, candidates):
+    """
+    RUT con el que se corrige la lectura, o None si no hay uno claro: un único candidato
+    válido, o el primero con MARGEN_CORRECCION más de densidad que el segundo.
+    """
+    valid = [c for c in candidates if is_valid_rut(c[0]) and c[0] != clean_rut(decoded)]
+    if not valid:
+        return None
+    if len(valid) == 1 or valid[0][1] - valid[1][1] >= MARGEN_CORRECCION:
+        return valid[0][0]
+    return None
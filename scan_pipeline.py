@@ -0,0 +1,70 @@
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Páginas transferidas que pueden esperar decodificación antes de dejar de pedirle hojas al driver
+MAX_EN_COLA = 8
+
+
+class ScanPipeline:
+    """
+    Pipeline de Escaneo en Segundo Plano.
+
+    Etapas:
+    1. Transferencia (hilo de Tk): el polling TWAIN entrega páginas tan rápido como el driver
+       las suelta. TWAIN debe usarse desde el hilo que abrió la fuente, por eso esta etapa
+       no se mueve de hilo.
+    2. Decodificación (pool de hilos): process_fn corre en paralelo; OpenCV libera el GIL.
+    3. Resultados (hilo de Tk): drain_ready() entrega en lote los resultados terminados,
+       siempre en el orden de llegada de las hojas.
+
+    La cola es acotada: mientras is_full() el polling no transfiere más páginas y el
+    alimentador queda retenido en el driver (contrapresión), acotando la memoria.
+
+    Todos los métodos se llaman desde el hilo de Tk; solo process_fn corre en los workers.
+    process_fn debe capturar sus propios errores: una excepción se re-lanza en drain_ready().
+    """
+    def __init__(self, process_fn, workers=None, max_pending=MAX_EN_COLA):
+        self.process_fn = process_fn
+        self.max_pending = max_pending
+        if workers is None:
+            # Se deja un núcleo libre para la UI y el driver
+            workers = max(1, (os.cpu_count() or 2) - 1)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="omr")
+        self._pending = deque() # Futures en orden de llegada
+
+    def submit(self, *args, **kwargs):
+        """Encola una página para decodificar."""
+        future = self._executor.submit(self.process_fn, *args, **kwargs)
+        self._pending.append(future)
+        return future
+
+    def is_full(self):
+        return len(self._pending) >= self.max_pending
+
+    def depth(self):
+        """Cantidad de páginas transferidas que aún no se entregan a la UI."""
+        return len(self._pending)
+
+    def drain_ready(self):
+        """
+        Retorna los resultados ya terminados desde el inicio de la cola.
+        Se detiene en la primera hoja pendiente para preservar el orden.
+        """
+        results = []
+        while self._pending and self._pending[0].done():
+            results.append(self._pending.popleft().result())
+        return results
+
+    def drain_all(self):
+        """Espera las hojas en curso y retorna todos sus resultados, en orden (al cerrar)."""
+        results = [future.result() for future in self._pending]
+        self._pending.clear()
+        return results
+
+    def shutdown(self):
+        """Descarta las hojas que no empezaron y espera a los workers que están decodificando."""
+        for future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,131 @@
+import threading
+from collections import OrderedDict
+
+from session_manager import CLAVE_CACHE
+
+# --- Precarga de hojas vecinas (modo revisión) ---
+# Hojas que se preparan por adelantado en la dirección en que se avanza y en la contraria
+PRECARGA_ADELANTE = 4
+PRECARGA_ATRAS = 1
+# Memoria que puede ocupar la ventana precargada (imágenes decodificadas + miniaturas)
+PRECARGA_MAX_BYTES = 32 * 1024 * 1024
+# Estimación por hoja mientras la caché no tiene imágenes para medir (página ~1000 px en grises)
+BYTES_HOJA_ESTIMADOS = 1024 * 1024
+
+
+class ScanPrefetcher:
+    """
+    Precarga de Hojas Vecinas.
+
+    request() (hilo de Tk, al mostrar una hoja) calcula la ventana de hojas vecinas y reemplaza
+    el pedido anterior; un hilo worker las decodifica en la caché de la sesión (image_cache) y
+    prepara la miniatura al tamaño del visor con render_fn(imagen, ancho, alto) -> (PIL, escala).
+    Al llegar a una de esas hojas el visor solo crea el PhotoImage (ver get_render).
+
+    La ventana se inclina hacia la dirección de la última navegación y se acota por
+    PRECARGA_MAX_BYTES y por el tamaño de la caché de imágenes (no debe desalojar la hoja actual).
+    """
+    def __init__(self, session, render_fn=None):
+        self.session = session
+        self.render_fn = render_fn
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._wanted = [] # Hojas (dicts) por preparar, la más cercana primero
+        self._size = None
+        self._renders = OrderedDict() # (id imagen, ancho, alto) -> (clave hoja, imagen, PIL, escala)
+        self._keep = set() # CLAVE_CACHE de las hojas de la ventana actual
+        self._last_index = None
+        self._direction = 1
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name="precarga-hojas", daemon=True)
+        self._worker.start()
+
+    def request(self, index, size=None):
+        """Nueva hoja en pantalla: precargar sus vecinas. size: (ancho, alto) del visor."""
+        if self._last_index is not None and index != self._last_index:
+            self._direction = 1 if index > self._last_index else -1
+        self._last_index = index
+
+        scans = self.session.get_scans()
+        ahead, behind = self._window()
+        order = []
+        for step in range(1, max(ahead, behind) + 1):
+            if step <= ahead:
+                order.append(index + step * self._direction)
+            if step <= behind:
+                order.append(index - step * self._direction)
+        wanted = [scans[i] for i in order if 0 <= i < len(scans)]
+
+        with self._lock:
+            self._wanted = wanted
+            self._size = size
+            self._keep = set(s[CLAVE_CACHE] for s in wanted)
+            if 0 <= index < len(scans):
+                self._keep.add(scans[index][CLAVE_CACHE])
+            # Miniaturas de hojas que quedaron fuera de la ventana
+            for key in [k for k, entry in self._renders.items() if entry[0] not in self._keep]:
+                del self._renders[key]
+            self._wake.notify()
+
+    def cancel(self):
+        """Descarta la ventana (p.ej. al cargar otra sesión)."""
+        with self._lock:
+            self._wanted = []
+            self._keep = set()
+            self._renders.clear()
+            self._last_index = None
+
+    def get_render(self, image, width, height):
+        """Miniatura precargada de `image` para un visor de ancho x alto: (PIL, escala) o None."""
+        with self._lock:
+            entry = self._renders.get((id(image), width, height))
+        return entry[2:] if entry is not None else None
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._wanted = []
+            self._wake.notify()
+        self._worker.join()
+
+    def _window(self):
+        """(hojas adelante, hojas atrás) que caben en el presupuesto de memoria."""
+        stats = self.session.image_cache.stats()
+        per_sheet = stats['bytes_residentes'] / stats['imagenes'] if stats['imagenes'] else BYTES_HOJA_ESTIMADOS
+        per_sheet *= 1.5 # Más la miniatura
+        total = int(PRECARGA_MAX_BYTES // max(per_sheet, 1))
+        total = max(0, min(total, PRECARGA_ADELANTE + PRECARGA_ATRAS, stats['max_imagenes'] - 1))
+        ahead = min(PRECARGA_ADELANTE, total)
+        return ahead, min(PRECARGA_ATRAS, total - ahead)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._wanted and not self._closed:
+                    self._wake.wait()
+                if self._closed:
+                    return
+                scan = self._wanted.pop(0)
+                size = self._size
+                if scan[CLAVE_CACHE] not in self._keep:
+                    continue
+            try:
+                # La hoja pudo eliminarse mientras esperaba: no volver a ponerla en la caché
+                if not self.session.has_scan(scan):
+                    continue
+                image = self.session.get_scan_image(scan)
+                if not self.session.has_scan(scan):
+                    self.session.image_cache.discard(scan[CLAVE_CACHE])
+                    continue
+                if image is None or self.render_fn is None or size is None:
+                    continue
+                key = (id(image), size[0], size[1])
+                with self._lock:
+                    if key in self._renders or scan[CLAVE_CACHE] not in self._keep:
+                        continue
+                thumb, scale = self.render_fn(image, *size)
+                with self._lock:
+                    if scan[CLAVE_CACHE] in self._keep and self.session.has_scan(scan):
+                        self._renders[key] = (scan[CLAVE_CACHE], image, thumb, scale)
+            except Exception as e:
+                print(f"Error precargando hoja: {e}")
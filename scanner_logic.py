@@ -1,14 +1,163 @@
-import twain
+try:
+    import twain
+except ImportError:
+    # Sin TWAIN (Linux, procesamiento por lotes) solo queda disponible la parte OMR.
+    twain = None
 import cv2
 import numpy as np
+import base64
+import bisect
 import os
+import struct
+import threading
 import time
 
+from form_layout import FormLayout, ink_table
+from omr_timing import NULL_TIMER, StageTimer, TimingStats
+
 # --- Configuración ---
 UMBRAL_NEGRO = 165 # Ajustado para lapiz grafito (Gris medio)
 AREA_MINIMA = 100
 AREA_MAXIMA = 3000
 
+# Resolución de trabajo: toda hoja se lleva a estos DPI antes de binarizar.
+# AREA_MINIMA/AREA_MAXIMA, el kernel vertical 1x40 y las tolerancias de grilla están
+# expresados en esta resolución.
+DPI_TRABAJO = 200
+# Ancho de la hoja (carta/oficio) para estimar los DPI cuando no se conocen
+ANCHO_HOJA_PULGADAS = 8.5
+# Diferencia relativa de resolución que no justifica re-escalar (p.ej. hoja A4 a 200 dpi)
+TOLERANCIA_DPI = 0.10
+# Resolución informada por el driver (XResolution) que se acepta; fuera de este rango, o si
+# el ancho de la página no calza con ANCHO_HOJA_PULGADAS (+/- 50%), se estima desde el ancho
+RANGO_DPI_FUENTE = (50, 1200)
+
+# Guardar en disco (BMP) cada página transferida desde el escáner.
+# Por defecto las imágenes pasan directo de memoria al motor OMR.
+GUARDAR_ESCANEOS = False
+
+# Plantilla de formulario: la primera hoja limpia de un escaneo calibra la posición de las
+# burbujas y las hojas siguientes solo se alinean y muestrean (ver FormLayout).
+USAR_PLANTILLA = True
+# Fracción mínima de burbujas que deben aparecer donde la plantilla las espera
+CONFIANZA_MINIMA_PLANTILLA = 0.95
+
+# Registrar el tiempo de cada etapa de process_image en histogramas de sesión (ver omr_timing)
+REGISTRAR_TIEMPOS = False
+ARCHIVO_TIEMPOS = "tiempos_omr.json"
+
+# Marca candidata (burbuja): centro, área, densidad de tinta del ROI interno y si está marcada.
+# Las marcas de una hoja viven en un solo arreglo estructurado (sin un dict por burbuja).
+MARK_DTYPE = np.dtype([('x', np.int32), ('y', np.int32), ('area', np.float64),
+                       ('density', np.float64), ('marked', np.bool_)])
+
+# Marcas de una hoja como datos (sesión y visor): rectángulo, si está marcada y pregunta (-1 = RUT)
+OVERLAY_DTYPE = np.dtype([('x', '<i2'), ('y', '<i2'), ('w', '<i2'), ('h', '<i2'),
+                          ('marked', 'u1'), ('question', '<i2')])
+
+MSG_SIN_ESCANER = "No se encontró escaner en el equipo, revise la configuración o instalación de los drivers de su escaner."
+
+def dib_to_bmp(buffer):
+    """
+    Convierte en memoria un DIB (BITMAPINFOHEADER + paleta + pixeles, tal como lo entrega
+    la transferencia nativa TWAIN) en los bytes de un archivo BMP.
+    Si el buffer ya es un BMP completo se retorna tal cual.
+    """
+    data = bytes(buffer)
+    if data[:2] != b'BM':
+        # Reconstruir el BITMAPFILEHEADER (14 bytes) que falta en un DIB empaquetado
+        header_size = struct.unpack_from('<I', data, 0)[0]
+        if header_size == 12:
+            # BITMAPCOREHEADER (OS/2): paleta de 3 bytes por color
+            bit_count = struct.unpack_from('<H', data, 10)[0]
+            palette_size = (1 << bit_count) * 3 if bit_count <= 8 else 0
+        else:
+            compression, = struct.unpack_from('<I', data, 16)
+            bit_count = struct.unpack_from('<H', data, 14)[0]
+            colors_used = struct.unpack_from('<I', data, 32)[0]
+            if bit_count <= 8:
+                colors_used = colors_used or (1 << bit_count)
+            palette_size = colors_used * 4
+            if compression == 3 and header_size == 40:
+                palette_size += 12 # BI_BITFIELDS: máscaras RGB tras el header
+        offset = 14 + header_size + palette_size
+        data = struct.pack('<2sIHHI', b'BM', 14 + len(data), 0, 0, offset) + data
+    return data
+
+def dib_to_array(buffer, grayscale=False):
+    """
+    Decodifica un DIB o BMP en memoria a un arreglo NumPy (BGR o grises), sin pasar por disco.
+    Retorna None si el buffer no se puede decodificar.
+    """
+    flags = cv2.IMREAD_GRAYSCALE if grayscale else cv2.IMREAD_COLOR
+    return cv2.imdecode(np.frombuffer(dib_to_bmp(buffer), np.uint8), flags)
+
+class SheetOverlay:
+    """
+    Visualización diferida de una hoja procesada.
+
+    Guarda la página en grises y la geometría de los candidatos (rects Nx4, marcado N y
+    pregunta N, -1 en el RUT). El visor dibuja las marcas como ítems del canvas; la imagen
+    BGR con los rectángulos (verde = marcado, rojo = vacío) se construye solo si se pide render().
+    En la sesión se guarda la página (JPG en grises) y las marcas como datos (to_data/from_data).
+    """
+    def __init__(self, gray, rects, marked, line_width=2, questions=None):
+        self.gray = gray
+        self.rects = rects
+        self.marked = marked
+        self.line_width = line_width
+        self.questions = questions if questions is not None else np.full(len(rects), -1, np.int16)
+
+    @property
+    def shape(self):
+        return self.gray.shape
+
+    @property
+    def nbytes(self):
+        return self.gray.nbytes + self.rects.nbytes + self.marked.nbytes + self.questions.nbytes
+
+    def to_data(self):
+        """Marcas como texto compacto (arreglo OVERLAY_DTYPE en base64) para la tabla de la sesión."""
+        data = np.empty(len(self.rects), dtype=OVERLAY_DTYPE)
+        if len(self.rects):
+            data['x'], data['y'], data['w'], data['h'] = np.asarray(self.rects).T
+        data['marked'] = self.marked
+        data['question'] = self.questions
+        return base64.b64encode(data.tobytes()).decode('ascii')
+
+    @classmethod
+    def from_data(cls, gray, text):
+        data = np.frombuffer(base64.b64decode(text), dtype=OVERLAY_DTYPE)
+        rects = np.stack([data['x'], data['y'], data['w'], data['h']], axis=1).astype(np.int32)
+        return cls(gray, rects, data['marked'].astype(bool), questions=data['question'].astype(np.int16))
+
+    def question_anchors(self):
+        """Por pregunta, (número desde 1, rectángulo de su primera opción): donde el visor pone el número."""
+        anchors = []
+        for q in np.unique(self.questions[self.questions >= 0]).tolist():
+            idx = np.flatnonzero(self.questions == q)
+            first = idx[np.argmin(self.rects[idx, 0])]
+            anchors.append((q + 1, self.rects[first].tolist()))
+        return anchors
+
+    def resized(self, max_height):
+        """Versión reducida a max_height (para mantener en memoria), escalando la geometría."""
+        h, w = self.gray.shape[:2]
+        if h <= max_height:
+            return self
+        scale = max_height / h
+        gray = cv2.resize(self.gray, (int(w * scale), max_height), interpolation=cv2.INTER_AREA)
+        rects = np.round(self.rects * scale).astype(np.int32)
+        return SheetOverlay(gray, rects, self.marked, max(1, int(round(self.line_width * scale))), self.questions)
+
+    def render(self):
+        """Construye la imagen BGR con los rectángulos de los candidatos."""
+        img = cv2.cvtColor(self.gray, cv2.COLOR_GRAY2BGR)
+        for (x, y, w, h), is_marked in zip(self.rects.tolist(), self.marked.tolist()):
+            color = (0, 255, 0) if is_marked else (0, 0, 255)
+            cv2.rectangle(img, (x, y), (x + w, y + h), color, self.line_width)
+        return img
+
 class ScannerLogic:
     """
     Lógica de Negocio del Escáner y Procesamiento de Imagen.
@@ -20,8 +169,16 @@ class ScannerLogic:
     """
     def __init__(self):
         self.current_source_name = None
+        self.save_raw_scans = GUARDAR_ESCANEOS
+        self.auto_calibrate = USAR_PLANTILLA
+        self.form_layout = None
+        self._layout_lock = threading.Lock()
+        # Histogramas de tiempos por etapa (None = instrumentación apagada)
+        self.timing_stats = TimingStats() if REGISTRAR_TIEMPOS else None
 
     def get_sources(self, window_id):
+        if twain is None:
+            raise Exception(MSG_SIN_ESCANER)
         try:
             sm = twain.SourceManager(window_id)
             return sm.GetSourceList()
@@ -29,7 +186,7 @@ class ScannerLogic:
             # Capturar errores comunes de TWAIN (falta de DSM, drivers, etc)
             err_msg = str(e).lower()
             if "dll" in err_msg or "module" in err_msg or "twain" in err_msg:
-                 raise Exception("No se encontró escaner en el equipo, revise la configuración o instalación de los drivers de su escaner.")
+                 raise Exception(MSG_SIN_ESCANER)
             raise e
 
     def set_source(self, source_name):
@@ -40,6 +197,8 @@ class ScannerLogic:
         Inicia el proceso de escaneo (Modeless/Background friendly).
         Retorna el objeto Source (ss) activo, o None si se canceló/falló apertura.
         """
+        if twain is None:
+            raise Exception(MSG_SIN_ESCANER)
         try:
             sm = twain.SourceManager(window_id)
             ss = sm.OpenSource(self.current_source_name)
@@ -53,7 +212,7 @@ class ScannerLogic:
         except Exception as e:
             err_msg = str(e).lower()
             if "dll" in err_msg or "module" in err_msg or "twain" in err_msg:
-                 raise Exception("No se encontró escaner en el equipo, revise la configuración o instalación de los drivers de su escaner.")
+                 raise Exception(MSG_SIN_ESCANER)
             raise e
 
     def close_source(self, ss):
@@ -65,22 +224,29 @@ class ScannerLogic:
             except:
                 pass
 
-    def transfer_next(self, ss, base_filename, index):
+    def transfer_next(self, ss, base_filename=None, index=0, grayscale=False):
         """
-        Intenta transferir una imagen desde la fuente activa.
-        Retorna: (ruta_archivo, pending_count) si hay éxito.
-                 (None, pending_count) si no hay imagen lista pero connection ok.
+        Intenta transferir una imagen desde la fuente activa directamente a memoria.
+        Retorna: (imagen_numpy, pending_count, dpi) si hay éxito.
+                 (None, pending_count, None) si no hay imagen lista pero connection ok.
         Lanza excepción si hay error real (no SEQERROR).
+
+        dpi: XResolution informada por la fuente (ver _source_dpi), para process_image;
+        None si el driver no la informa o no es creíble.
+
+        grayscale: decodifica la página directamente en grises (ver lazy_overlay).
+        Si self.save_raw_scans está activo, además guarda la página en
+        f"{base_filename}_{index}.bmp".
         """
         try:
             # Primero consultamos si hay información de imagen lista (State 6)
             # Esto verifica si el usuario ya presionó "Escanear" en la UI del driver.
-            ss.GetImageInfo()
+            info = ss.GetImageInfo()
         except Exception:
             # Si falla GetImageInfo, asumimos que no estamos en State 6 (Not Ready).
             # Puede ser SEQERROR, o que la ventana se cerró (State 4).
             # En cualquier caso, no podemos transferir. Retornamos None (Wait).
-            return (None, -1)
+            return (None, -1, None)
 
         # Si GetImageInfo funciona, estamos en State 6 -> Transferimos
         try:
@@ -89,20 +255,65 @@ class ScannerLogic:
             raise e
         
         if handle:
-            filename = f"{base_filename}_{index}.bmp"
             try:
-                twain.DIBToBMFile(handle, filename)
-                twain.GlobalHandleFree(handle)
-                return (filename, count)
-            except Exception as save_err:
-                print(f"Error guardando imagen: {save_err}")
-                twain.GlobalHandleFree(handle)
-                return (None, count)
+                # El handle nativo es memoria global de Windows: se copia a bytes y se libera.
+                # Una fuente de prueba puede entregar directamente los bytes del DIB.
+                if isinstance(handle, (bytes, bytearray, memoryview)):
+                    buffer = handle
+                else:
+                    try:
+                        buffer = twain.DIBToBMFile(handle)
+                    finally:
+                        twain.GlobalHandleFree(handle)
+
+                bmp = dib_to_bmp(buffer)
+                if self.save_raw_scans and base_filename:
+                    with open(f"{base_filename}_{index}.bmp", 'wb') as f:
+                        f.write(bmp)
+
+                image = dib_to_array(bmp, grayscale=grayscale)
+                return (image, count, self._source_dpi(info, image.shape[1]))
+            except Exception as xfer_err:
+                print(f"Error transfiriendo imagen: {xfer_err}")
+                return (None, count, None)
         
         # Si handle es None pero no hubo excepción
-        return (None, count)
+        return (None, count, None)
+
+    def _source_dpi(self, info, width):
+        """XResolution de GetImageInfo si es creíble para una página de `width` pixeles; si no, None."""
+        try:
+            dpi = float(info['XResolution'])
+        except (KeyError, TypeError, ValueError):
+            return None
+        if not RANGO_DPI_FUENTE[0] <= dpi <= RANGO_DPI_FUENTE[1]:
+            return None
+        if abs(width / dpi / ANCHO_HOJA_PULGADAS - 1.0) > 0.5:
+            return None # Ancho de página imposible con esa resolución (p.ej. 72 dpi por defecto)
+        return dpi
+
+    def reset_layout(self):
+        """Descarta la plantilla calibrada (p.ej. al iniciar un escaneo con otro formulario)."""
+        self.form_layout = None
 
-    def process_image(self, image_path):
+    def calibrate_layout(self, image):
+        """
+        Calibra la plantilla desde una hoja en blanco o limpia del formulario (ruta o arreglo).
+        Retorna el FormLayout, o None si no se pudo reconstruir la grilla completa.
+        """
+        gray = self._load_image(image, grayscale=True)
+        if gray is None:
+            return None
+        work, _ = self._to_working_resolution(gray)
+        thresh = self._binarize(work)
+        grid = {}
+        _, _, rects, marked = self._decode_candidates(thresh, grid)
+        layout = self._build_layout(thresh, rects, marked, grid)
+        if layout is not None:
+            self.form_layout = layout
+        return layout
+
+    def process_image(self, image, lazy_overlay=False, use_layout=True, dpi=None, timings=None, rut_scores=None):
         """
         Procesa la imagen midiendo dinámicamente el tamaño promedio de las burbujas para filtrar texto.
         
@@ -115,22 +326,134 @@ class ScannerLogic:
         4. Análisis de Densidad: Verifica si el candidato tiene suficientes pixeles negros (marcado).
         5. Clasificación Espacial: Separa marcas de RUT (arriba) de marcas de Respuestas (abajo).
         6. Decodificación: Reconstrucción de grillas y lectura de valores.
-        """
-        if not os.path.exists(image_path):
-            return "", [], None
 
-        img = cv2.imread(image_path)
-        if img is None:
-            return "", [], None
+        image: ruta a un archivo de imagen o arreglo NumPy (BGR o grises) ya en memoria.
+
+        lazy_overlay: Modo liviano (escaneo rápido / lotes / visor). Lee la hoja directamente en
+        grises, no copia la imagen ni dibuja los rectángulos; el tercer valor retornado es un
+        SheetOverlay (página + marcas como datos, con la pregunta de cada marca).
 
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        use_layout: usar (y calibrar) la plantilla del formulario. Con False siempre se corre
+        el pipeline completo.
+
+        dpi: resolución de la hoja. Si no se indica se estima a partir del ancho.
+        El análisis se hace a DPI_TRABAJO; los rectángulos retornados (overlay) quedan
+        en coordenadas de la imagen original.
+
+        timings: dict opcional. Si se entrega, se llena con la duración de cada etapa
+        ('etapas_ms') y los conteos de candidatos/marcas de la hoja ('conteos').
+        Con self.timing_stats activo cada hoja se suma además a los histogramas de la sesión.
+
+        rut_scores: lista opcional. Si se entrega, se llena con un dict por columna del RUT
+        leído: carácter de cada fila -> densidad de su burbuja (para corregir RUT mal leídos).
+        """
+        stats = self.timing_stats
+        timer = StageTimer() if timings is not None or stats is not None else NULL_TIMER
+
+        if lazy_overlay:
+            img = None
+            gray = self._load_image(image, grayscale=True)
+            if gray is None:
+                return "", [], None
+            page = gray
+        else:
+            img = self._load_image(image, grayscale=False)
+            if img is None:
+                return "", [], None
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        timer.lap('carga')
         
+        # 0. Normalización de resolución (una sola vez, antes de umbralizar)
+        work, scale = self._to_working_resolution(gray, dpi)
+        timer.lap('resolucion')
+        thresh = self._binarize(work, timer)
+
+        vis_img = img.copy() if img is not None else None
+
+        # Ruta rápida: muestrear directo en las burbujas de la plantilla calibrada.
+        # Si la hoja no calza con suficiente confianza se usa el pipeline completo.
+        decoded = None
+        questions = None
+        layout = self.form_layout if use_layout else None
+        if layout is not None:
+            decoded = self._decode_with_layout(thresh, layout, timer, rut_scores)
+            timer.count('plantilla', decoded is not None)
+            questions = layout.questions
+
+        if decoded is None:
+            # Sin plantilla: la primera hoja limpia decodificada la calibra
+            grid = {} if use_layout and self.auto_calibrate and self.form_layout is None else None
+            info = {} if lazy_overlay or rut_scores is not None else None
+            decoded = self._decode_candidates(thresh, grid, timer, info)
+            questions = info.get('questions') if info is not None else None
+            if rut_scores is not None:
+                rut_scores[:] = info['rut_scores']
+            if grid is not None:
+                self._store_layout(self._build_layout(thresh, decoded[2], decoded[3], grid))
+                timer.lap('calibracion')
+
+        decoded_rut, decoded_answers, rects, marked = decoded
+        if scale != 1.0:
+            # Marcas de vuelta a coordenadas de la hoja original (overlay)
+            rects = np.round(rects / scale).astype(np.int32)
+
+        if vis_img is not None:
+            for (x, y, w, h), is_marked in zip(rects.tolist(), marked.tolist()):
+                color = (0, 255, 0) if is_marked else (0, 0, 255)
+                cv2.rectangle(vis_img, (x, y), (x + w, y + h), color, 2)
+        timer.lap('overlay')
+
+        if timer is not NULL_TIMER:
+            timer.count('marcadas', int(np.count_nonzero(marked)))
+            result = timer.as_dict()
+            if timings is not None:
+                timings.update(result)
+            if stats is not None:
+                stats.add(result)
+
+        if lazy_overlay:
+            return decoded_rut, decoded_answers, SheetOverlay(page, rects, marked, questions=questions)
+        return decoded_rut, decoded_answers, vis_img
+
+    def _to_working_resolution(self, gray, dpi=None):
+        """
+        Lleva la hoja a DPI_TRABAJO. Retorna (hoja en resolución de trabajo, escala trabajo/original).
+
+        La reducción usa una pirámide de promedios por área: mitades exactas (la ruta rápida de
+        INTER_AREA) y un único ajuste final menor a 2x, interpolado (INTER_AREA con razón no
+        entera es ~5 veces más lento). Así una hoja a 300 o 600 dpi cuesta lo mismo que una
+        a 200 dpi en el resto del pipeline.
+        """
+        h, w = gray.shape[:2]
+        if not dpi:
+            dpi = w / ANCHO_HOJA_PULGADAS
+        scale = DPI_TRABAJO / dpi
+        if abs(scale - 1.0) <= TOLERANCIA_DPI:
+            return gray, 1.0
+
+        target_w = max(1, int(round(w * scale)))
+        target_h = max(1, int(round(h * scale)))
+        if scale > 1.0:
+            # Hoja de baja resolución: se amplía para que los umbrales sigan siendo válidos
+            return cv2.resize(gray, (target_w, target_h), interpolation=cv2.INTER_LINEAR), target_w / w
+
+        work = gray
+        while work.shape[1] >= 2 * target_w and work.shape[0] >= 2 * target_h:
+            work = cv2.resize(work, (work.shape[1] // 2, work.shape[0] // 2), interpolation=cv2.INTER_AREA)
+        if work.shape[:2] != (target_h, target_w):
+            work = cv2.resize(work, (target_w, target_h), interpolation=cv2.INTER_LINEAR)
+        return work, target_w / w
+
+    def _binarize(self, gray, timer=NULL_TIMER):
+        """Preprocesamiento: hoja en grises -> imagen binaria (tinta = 255) sin líneas de escáner."""
         # [MEJORA PENCIL] Normalizar brillo/contraste
         # Estira el histograma para que el negro mas negro sea 0 y el blanco mas blanco sea 255.
         # Esto hace que el lapiz gris se oscurezca más relativo al papel blanco.
         gray = cv2.normalize(gray, None, 0, 255, cv2.NORM_MINMAX)
+        timer.lap('normalizar')
         
         _, thresh = cv2.threshold(gray, UMBRAL_NEGRO, 255, cv2.THRESH_BINARY_INV)
+        timer.lap('umbral')
         
         # --- Eliminacion de Ruido (Lineas Verticales de Escaner) ---
         # 1. Definir kernel vertical (1px ancho, 40px alto). Ajustar alto si es necesario.
@@ -144,24 +467,212 @@ class ScannerLogic:
         # 3. Restar las lineas detectadas de la imagen original binaria.
         # cv2.subtract maneja la saturacion (evita negativos, clipea a 0).
         thresh = cv2.subtract(thresh, detected_lines)
+        timer.lap('lineas_verticales')
         # -----------------------------------------------------------
         
-        # Morphological Closing
         # Morphological Closing
         kernel = np.ones((3,3), np.uint8)
         thresh = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel)
-        
-        contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-        rut_marks = []
-        answer_marks = []
-        vis_img = img.copy()
+        timer.lap('cierre')
+        return thresh
 
-        height, width = img.shape[:2]
+    def _decode_candidates(self, thresh, grid=None, timer=NULL_TIMER, info=None):
+        """
+        Pipeline completo (pasos 1-6 de process_image) sobre la imagen binarizada.
+        Retorna (rut, respuestas, rects Nx4, marcado N).
+        grid: dict opcional donde los decodificadores dejan la grilla reconstruida (ver _build_layout).
+        info: dict opcional; recibe info['questions'], la pregunta de cada rect (-1 en el RUT o sin fila),
+        e info['rut_scores'], la densidad de cada burbuja por columna del RUT (ver process_image).
+        """
+        height, width = thresh.shape[:2]
         limit_y_rut = height * 0.35
 
         # 1. Recolección de Candidatos Geométricos
-        candidates = []
+        rects, areas = self._candidates_from_contours(thresh)
+        timer.lap('candidatos')
+        timer.count('candidatos', len(rects))
+
+        # 2. Filtro Dinámico de Tamaño (para eliminar letras pequeñas)
+        if len(areas):
+            # Calcular mediana del área de los candidatos (tamaño de burbuja típico)
+            median_area = np.sort(areas)[len(areas)//2]
+            
+            # Umbral: Aceptamos burbujas que sean al menos el 70% del tamaño mediano
+            min_dynamic_area = median_area * 0.70
+            
+            keep = areas >= min_dynamic_area
+            rects, areas = rects[keep], areas[keep]
+        timer.count('candidatos_filtrados', len(rects))
+
+        # 3. Procesamiento de Candidatos Finales (Detección de Tinta)
+        # Densidad de tinta del ROI interno de cada candidato
+        densities = self._inner_densities(thresh, rects)
+
+        # Umbral de marcado ajustado para "relleno solido"
+        # Al quitar bordes, una marca real deberia ser casi 100% negra en el centro.
+        # Usamos 0.50 para ser seguros (vs 0.32 anterior con bordes)
+        marked = densities > 0.50
+        timer.lap('densidad')
+
+        marks = np.empty(len(rects), dtype=MARK_DTYPE)
+        marks['x'] = rects[:, 0] + rects[:, 2] // 2
+        marks['y'] = rects[:, 1] + rects[:, 3] // 2
+        marks['area'] = areas
+        marks['density'] = densities
+        marks['marked'] = marked
+
+        # Clasificación espacial: RUT arriba, respuestas abajo (se conserva el orden de los candidatos)
+        in_rut = marks['y'] < limit_y_rut
+        rut_marks = marks[in_rut]
+        answer_marks = marks[~in_rut]
+        timer.lap('clasificacion')
+        timer.count('marcas_rut', len(rut_marks))
+        timer.count('marcas_respuestas', len(answer_marks))
+        
+        if info is not None:
+            info['rut_scores'] = []
+            decoded_rut = self._decode_rut(rut_marks, grid, info['rut_scores'])
+        else:
+            decoded_rut = self._decode_rut(rut_marks, grid)
+        if info is not None:
+            answer_questions = np.full(len(answer_marks), -1, np.int16)
+            decoded_answers = self._decode_answers(answer_marks, grid, answer_questions)
+            questions = np.full(len(rects), -1, np.int16)
+            questions[~in_rut] = answer_questions
+            info['questions'] = questions
+        else:
+            decoded_answers = self._decode_answers(answer_marks, grid)
+        timer.lap('decodificacion')
+        return decoded_rut, decoded_answers, rects, marked
+
+    def _store_layout(self, layout):
+        # Varias hojas pueden decodificarse en paralelo: se conserva la primera plantilla
+        if layout is None:
+            return
+        with self._layout_lock:
+            if self.form_layout is None:
+                self.form_layout = layout
+
+    def _build_layout(self, thresh, rects, marked, grid):
+        """
+        Construye la plantilla a partir de la grilla que reconstruyeron _decode_rut/_decode_answers.
+        Solo se acepta una hoja limpia: cada punto de la grilla (columna x fila) debe tener
+        su burbuja detectada y cada fila debe mapear a caracteres distintos.
+        """
+        rut_grid = grid.get('rut')
+        answer_grid = grid.get('answers')
+        if not rut_grid or not answer_grid or len(rects) == 0:
+            return None
+
+        centers = rects[:, :2] + rects[:, 2:] // 2
+
+        def nearest(x, y, tol):
+            dist = np.maximum(np.abs(centers[:, 0] - x), np.abs(centers[:, 1] - y))
+            i = int(np.argmin(dist))
+            return i if dist[i] < tol else None
+
+        selected = []
+        def slot(points, labels, tol):
+            if '?' in labels or len(set(labels)) != len(labels):
+                return None
+            found = [nearest(x, y, tol) for x, y in points]
+            if None in found:
+                return None
+            start = len(selected)
+            selected.extend(found)
+            return np.arange(start, start + len(found)), ''.join(labels)
+
+        rut_slots = []
+        for x in rut_grid['x']:
+            s = slot([(x, y) for y in rut_grid['y']], rut_grid['labels'], rut_grid['tol'])
+            if s is None:
+                return None
+            rut_slots.append(s)
+
+        answer_slots = []
+        for block in answer_grid:
+            for y in block['y']:
+                s = slot([(x, y) for x in block['x']], block['labels'], block['tol'])
+                if s is None:
+                    return None
+                answer_slots.append(s)
+
+        if len(set(selected)) != len(selected):
+            return None
+
+        # Paso mínimo entre burbujas (acota el ajuste fino de la alineación)
+        lines = [rut_grid['x'], rut_grid['y']] + [b['x'] for b in answer_grid] + [b['y'] for b in answer_grid]
+        steps = [np.median(np.diff(v)) for v in lines if len(v) > 1]
+        if not steps:
+            return None
+
+        # Densidad del borde impreso: mediana del rectángulo completo de las burbujas vacías
+        layout_rects = rects[selected].astype(np.int32)
+        full = self._box_densities(thresh, layout_rects, 0.0)
+        empty = ~marked[selected]
+        if not empty.any():
+            return None
+        ring_density = float(np.median(full[empty]))
+
+        return FormLayout(thresh, layout_rects, rut_slots, answer_slots, min(steps), ring_density)
+
+    def _decode_with_layout(self, thresh, layout, timer=NULL_TIMER, rut_scores=None):
+        """
+        Ruta rápida: alinea la hoja con la plantilla y mide la tinta solo en las burbujas conocidas.
+        Retorna (rut, respuestas, rects, marcado) o None si la alineación no es confiable.
+        rut_scores: lista opcional, ver process_image.
+        """
+        # Una tabla de tinta por hoja: perfiles de alineación, verificación y muestreo
+        sat = ink_table(thresh)
+        timer.lap('tabla_tinta')
+        aligned = layout.align(sat)
+        timer.lap('alineacion')
+        if aligned is None:
+            return None
+        rects, _ = aligned
+
+        # Confianza: el borde impreso de casi todas las burbujas debe estar donde se espera
+        present = self._table_densities(sat, rects, 0.0) >= layout.ring_density * 0.5
+        timer.lap('verificacion')
+        if present.mean() < CONFIANZA_MINIMA_PLANTILLA:
+            return None
+
+        densities = self._table_densities(sat, rects, 0.25)
+        marked = densities > 0.50
+        # Por grupo se elige la marca más densa, igual que _decode_rut/_decode_answers
+        scores = np.where(marked, densities, -1.0)
+
+        def read(idx, labels, empty):
+            k = int(np.argmax(scores[idx]))
+            return labels[k] if scores[idx[k]] >= 0 else empty
+
+        rut = ''.join(read(idx, labels, '?') for idx, labels in layout.rut_slots)
+        if rut_scores is not None:
+            rut_scores[:] = [dict(zip(labels, densities[idx].tolist())) for idx, labels in layout.rut_slots]
+        answers = [read(idx, labels, '') for idx, labels in layout.answer_slots]
+        timer.lap('muestreo')
+        return rut, answers, rects, marked
+
+    def _load_image(self, image, grayscale):
+        """Obtiene la hoja como arreglo BGR (o grises) desde una ruta o un arreglo en memoria."""
+        if isinstance(image, np.ndarray):
+            if grayscale:
+                return image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            return image if image.ndim == 3 else cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+
+        if not image or not os.path.exists(image):
+            return None
+        return cv2.imread(image, cv2.IMREAD_GRAYSCALE if grayscale else cv2.IMREAD_COLOR)
+
+    def _candidates_from_contours(self, thresh):
+        """
+        Contornos externos con los filtros absolutos de área, aspect ratio y extent.
+        Retorna (rects Nx4 [x, y, w, h], areas N).
+        """
+        contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+        rects = []
+        areas = []
         for cnt in contours:
             area = cv2.contourArea(cnt)
             # Filtro Absoluto Inicial
@@ -176,109 +687,119 @@ class ScannerLogic:
                     
                     # Solidez razonable (Relajada para permitir formas irregulares)
                     if extent > 0.35:
-                       candidates.append({
-                           'cnt': cnt,
-                           'area': area,
-                           'rect': (x, y, w, h),
-                           'extent': extent
-                       })
+                        rects.append((x, y, w, h))
+                        areas.append(area)
 
-        # 2. Filtro Dinámico de Tamaño (para eliminar letras pequeñas)
-        if candidates:
-            # Calcular mediana del área de los candidatos (tamaño de burbuja típico)
-            areas = sorted([c['area'] for c in candidates])
-            median_area = areas[len(areas)//2]
-            
-            # Umbral: Aceptamos burbujas que sean al menos el 70% del tamaño mediano
-            min_dynamic_area = median_area * 0.70
-            
-            final_candidates = [c for c in candidates if c['area'] >= min_dynamic_area]
-        else:
-            final_candidates = []
+        return np.array(rects, dtype=np.int32).reshape(-1, 4), np.array(areas, dtype=np.float64)
 
-        # 3. Procesamiento de Candidatos Finales (Detección de Tinta)
-        for c in final_candidates:
-            x, y, w, h = c['rect']
-            area = c['area']
-            
-            # --- MEJORA: ROI Interno (Inner Crop) ---
-            # Evita contar el borde impreso de la burbuja como tinta.
-            # Recortamos un 25% de margenes para analizar solo el centro.
-            margin_x = int(w * 0.25)
-            margin_y = int(h * 0.25)
-            
-            # Sanity check para evitar ROI vacio
-            if margin_x < 1: margin_x = 1
-            if margin_y < 1: margin_y = 1
-            
-            inner_x = x + margin_x
-            inner_y = y + margin_y
-            inner_w = w - (2 * margin_x)
-            inner_h = h - (2 * margin_y)
-            
-            if inner_w <= 0 or inner_h <= 0:
-                # Fallback por si es muy chico
-                inner_x, inner_y, inner_w, inner_h = x, y, w, h
-                
-            roi = thresh[inner_y:inner_y+inner_h, inner_x:inner_x+inner_w]
-            density = cv2.countNonZero(roi) / (inner_w * inner_h)
-            
-            # Umbral de marcado ajustado para "relleno solido"
-            # Al quitar bordes, una marca real deberia ser casi 100% negra en el centro.
-            # Usamos 0.50 para ser seguros (vs 0.32 anterior con bordes)
-            is_marked = density > 0.50 
-            
-            color = (0, 255, 0) if is_marked else (0, 0, 255)
-            cv2.rectangle(vis_img, (x, y), (x + w, y + h), color, 2)
-            # Dibujar ROI interno visualmente para debug (azul)
-            # cv2.rectangle(vis_img, (inner_x, inner_y), (inner_x + inner_w, inner_y + inner_h), (255, 0, 0), 1)
+    def _inner_densities(self, thresh, rects):
+        """
+        Densidad de tinta del ROI interno de cada candidato.
+
+        --- MEJORA: ROI Interno (Inner Crop) ---
+        Evita contar el borde impreso de la burbuja como tinta.
+        Recortamos un 25% de margenes para analizar solo el centro
+        (mínimo 1px; si el ROI queda vacío se usa el rectángulo completo).
+        Equivale a cv2.countNonZero(roi) / area_roi por candidato.
+        """
+        return self._box_densities(thresh, rects, 0.25)
 
-            cx, cy = x + w // 2, y + h // 2
+    def _box_densities(self, thresh, rects, margin):
+        """
+        Fracción de tinta (cv2.countNonZero) de cada rectángulo recortado en `margin`
+        (fracción por lado). margin=0 mide el rectángulo completo.
 
-            mark_data = {'pos': (cx, cy), 'area': area, 'density': density, 'marked': is_marked}
+        Con unos cientos de burbujas por hoja el recorrido rectángulo a rectángulo es más
+        barato que una tabla de áreas sumadas de la página completa (cv2.integral); la ruta
+        de la plantilla, que ya tiene la tabla, usa _table_densities.
+        """
+        densities = np.empty(len(rects), np.float64)
+        count = cv2.countNonZero
+        for i, (x, y, w, h) in enumerate(self._inner_rects(rects, margin).tolist()):
+            densities[i] = count(thresh[y:y + h, x:x + w]) / (w * h)
+        return densities
 
-            if cy < limit_y_rut:
-                rut_marks.append(mark_data)
-            else:
-                answer_marks.append(mark_data)
-        
-        decoded_rut = self._decode_rut(rut_marks)
-        decoded_answers = self._decode_answers(answer_marks)
+    def _table_densities(self, sat, rects, margin):
+        """Como _box_densities, leyendo la tinta de la tabla de la hoja (form_layout.ink_table)."""
+        x, y, w, h = self._inner_rects(rects, margin).T
+        ink = sat[y + h, x + w] - sat[y, x + w] - sat[y + h, x] + sat[y, x]
+        return ink / (w * h)
 
-        return decoded_rut, decoded_answers, vis_img
+    def _inner_rects(self, rects, margin):
+        """
+        Rectángulos recortados en `margin` (fracción por lado, mínimo 1px).
+        Si el recorte queda vacío se usa el rectángulo completo.
+        """
+        rects = rects.astype(np.int64)
+        if margin <= 0:
+            return rects
+        x, y, w, h = rects.T
+        margin_x = np.maximum((w * margin).astype(np.int64), 1)
+        margin_y = np.maximum((h * margin).astype(np.int64), 1)
+        inner = np.stack([x + margin_x, y + margin_y, w - 2 * margin_x, h - 2 * margin_y], axis=1)
+        # Fallback por si es muy chico
+        small = (inner[:, 2] <= 0) | (inner[:, 3] <= 0)
+        inner[small] = rects[small]
+        return inner
 
     def _cluster_1d(self, values, tolerance):
-        # ... (same)
-        if not values: return []
-        sorted_vals = sorted(values)
-        clusters = []
-        current = [sorted_vals[0]]
-        
-        for v in sorted_vals[1:]:
-            if v - current[-1] > tolerance:
-                clusters.append(sum(current)/len(current))
-                current = [v]
-            else:
-                current.append(v)
-        clusters.append(sum(current)/len(current))
-        return clusters
+        """
+        Agrupa valores 1D (coordenadas enteras): un salto mayor a `tolerance` entre valores
+        consecutivos ordenados inicia un grupo nuevo. Retorna la lista de promedios.
+        """
+        sorted_vals = np.sort(np.asarray(values, dtype=np.int64))
+        if len(sorted_vals) == 0: return []
+        starts = np.concatenate(([0], np.nonzero(np.diff(sorted_vals) > tolerance)[0] + 1))
+        counts = np.diff(np.append(starts, len(sorted_vals)))
+        return (np.add.reduceat(sorted_vals, starts) / counts).tolist()
+
+    def _sorted_by(self, marks, indices, axis):
+        """
+        Ordena los índices de marcas según la coordenada `axis` ('x' o 'y').
+        Retorna (valores ordenados como lista, para búsqueda binaria con bisect; índices).
+        """
+        values = marks[axis][indices]
+        order = np.argsort(values, kind='stable')
+        return values[order].tolist(), indices[order]
+
+    def _best_marked(self, sorted_vals, order, center, tol, densities, marked):
+        """
+        Índice (en el arreglo de marcas) de la marca marcada más densa con |valor - center| < tol,
+        o None si no hay ninguna.
+
+        El rango se ubica con búsqueda binaria sobre los valores ordenados en vez de recorrer
+        todas las marcas por cada línea. Ante empate de densidad gana la primera en el orden
+        original, igual que max().
+        densities/marked: columnas de las marcas como listas (el rango suele tener pocas marcas
+        y recorrerlo en Python es más barato que indexar NumPy por cada línea).
+        """
+        lo = bisect.bisect_right(sorted_vals, center - tol)
+        hi = bisect.bisect_left(sorted_vals, center + tol)
+        best = None
+        for i in order[lo:hi]:
+            if not marked[i]:
+                continue
+            if best is None or densities[i] > densities[best] or (densities[i] == densities[best] and i < best):
+                best = i
+        return best
 
-    def _decode_rut(self, marks):
+    def _decode_rut(self, marks, grid=None, scores=None):
         """
         Decodifica RUT reconstruyendo la grilla mediante pasos relativos.
+        Si se entrega `grid` (dict), guarda en grid['rut'] las columnas, filas y el carácter
+        de cada fila (usado para calibrar la plantilla).
+        Si se entrega `scores` (lista), agrega por columna un dict carácter -> densidad de burbuja.
         """
-        if not marks: return ""
+        if len(marks) == 0: return ""
         
         # 1. Detectar Grilla X (Columnas)
-        all_xs = [m['pos'][0] for m in marks]
-        avg_area = sum(m['area'] for m in marks) / len(marks)
+        avg_area = float(marks['area'].mean())
         estim_dim = avg_area ** 0.5
         tol = max(10, estim_dim * 0.6)
-        x_lines = self._cluster_1d(all_xs, tol)
+        x_lines = self._cluster_1d(marks['x'], tol)
         
         # 2. Detectar Grilla Y (Filas)
-        all_ys = [m['pos'][1] for m in marks]
-        y_lines = self._cluster_1d(all_ys, tol)
+        y_lines = self._cluster_1d(marks['y'], tol)
         
         # Calcular paso vertical promedio (altura de fila)
         if len(y_lines) > 1:
@@ -291,21 +812,38 @@ class ScannerLogic:
 
         # Asumimos que la primera linea Y detectada es la fila 0
         y0 = y_lines[0] if y_lines else 0
+
+        if grid is not None:
+            row_chars = []
+            for y in y_lines:
+                row_idx = int(round((y - y0) / avg_step))
+                row_chars.append(str(row_idx) if row_idx < 10 else "K")
+            grid['rut'] = {'x': x_lines, 'y': y_lines, 'labels': row_chars, 'tol': tol}
         
+        # Marcas ordenadas por X: cada columna se ubica por búsqueda binaria
+        sorted_xs, order = self._sorted_by(marks, np.arange(len(marks)), 'x')
+        order = order.tolist()
+        densities = marks['density'].tolist()
+        marked = marks['marked'].tolist()
+
         rut_str = ""
         for x_line in x_lines:
-            col_candidates = [m for m in marks if abs(m['pos'][0] - x_line) < tol]
-            if not col_candidates:
+            if scores is not None:
+                column = {}
+                lo = bisect.bisect_right(sorted_xs, x_line - tol)
+                hi = bisect.bisect_left(sorted_xs, x_line + tol)
+                for i in order[lo:hi]:
+                    row_idx = int(round((int(marks['y'][i]) - y0) / avg_step))
+                    char = str(row_idx) if row_idx < 10 else "K"
+                    column[char] = max(densities[i], column.get(char, 0.0))
+                scores.append(column)
+            best = self._best_marked(sorted_xs, order, x_line, tol, densities, marked)
+            if best is None:
+                # Columna sin candidatos o sin marcas
                 rut_str += "?"
                 continue
             
-            marked_ones = [m for m in col_candidates if m['marked']]
-            if not marked_ones:
-                rut_str += "?" 
-                continue
-            
-            best_mark = max(marked_ones, key=lambda m: m['density'])
-            y_mark = best_mark['pos'][1]
+            y_mark = int(marks['y'][best])
             
             # Calcular índice relativo basado en distancia a y0
             row_idx = int(round((y_mark - y0) / avg_step))
@@ -318,20 +856,21 @@ class ScannerLogic:
 
         return rut_str
 
-    def _decode_answers(self, marks):
+    def _decode_answers(self, marks, grid=None, questions=None):
         """
         Decodifica respuestas soportando múltiples columnas de preguntas.
         Ej: Q1-Q25 a la izquierda, Q26-50 a la derecha.
+        Si se entrega `grid` (dict), guarda en grid['answers'] la grilla de cada bloque.
+        Si se entrega `questions` (arreglo del largo de marks), anota la pregunta de cada marca.
         """
-        if not marks: return []
+        if len(marks) == 0: return []
         
-        avg_area = sum(m['area'] for m in marks) / len(marks)
+        avg_area = float(marks['area'].mean())
         estim_dim = avg_area ** 0.5
         tol = max(10, estim_dim * 0.6)
         
         # 1. Detectar TODAS las líneas verticales de burbujas (X-lines)
-        all_xs = [m['pos'][0] for m in marks]
-        x_lines = self._cluster_1d(all_xs, tol)
+        x_lines = self._cluster_1d(marks['x'], tol)
         
         if not x_lines: return []
         
@@ -356,21 +895,33 @@ class ScannerLogic:
                 current_block.append(x)
         blocks.append(current_block)
         
+        # Marcas ordenadas por X: cada bloque es un rango contiguo (búsqueda binaria)
+        sorted_xs, order_x = self._sorted_by(marks, np.arange(len(marks)), 'x')
+        densities = marks['density'].tolist()
+        marked = marks['marked'].tolist()
+
         # 3. Procesar cada Bloque secuencialmente
         answers = []
         options = "ABCDEFGHIJK"
+        if grid is not None:
+            grid['answers'] = []
         
         for block_x_lines in blocks:
             # Definir rango X del bloque
             min_x_block = min(block_x_lines) - tol
             max_x_block = max(block_x_lines) + tol
             
-            block_marks = [m for m in marks if min_x_block <= m['pos'][0] <= max_x_block]
-            if not block_marks: continue
+            lo = bisect.bisect_left(sorted_xs, min_x_block)
+            hi = bisect.bisect_right(sorted_xs, max_x_block)
+            block_idx = order_x[lo:hi]
+            if len(block_idx) == 0: continue
+
+            # Marcas del bloque ordenadas por Y: cada fila se ubica por búsqueda binaria
+            sorted_ys, order_y = self._sorted_by(marks, block_idx, 'y')
+            order_y = order_y.tolist()
 
             # Detectar filas Y dentro de este bloque
-            block_ys = [m['pos'][1] for m in block_marks]
-            y_lines = self._cluster_1d(block_ys, tol)
+            y_lines = self._cluster_1d(sorted_ys, tol)
             
             # Parametros para decodificar opciones
             start_x = block_x_lines[0]
@@ -380,17 +931,25 @@ class ScannerLogic:
                 block_step = sorted(bgaps)[len(bgaps)//2]
             else:
                 block_step = 100 
+
+            if grid is not None:
+                letters = []
+                for x in block_x_lines:
+                    col_idx = int(round((x - start_x) / block_step))
+                    letters.append(options[col_idx] if 0 <= col_idx < len(options) else "?")
+                grid['answers'].append({'x': block_x_lines, 'y': y_lines, 'labels': letters, 'tol': tol})
             
             for y in y_lines:
-                row_candidates = [m for m in block_marks if abs(m['pos'][1] - y) < tol]
-                marked_ones = [m for m in row_candidates if m['marked']]
-                
-                if not marked_ones:
+                if questions is not None:
+                    lo = bisect.bisect_right(sorted_ys, y - tol)
+                    hi = bisect.bisect_left(sorted_ys, y + tol)
+                    questions[order_y[lo:hi]] = len(answers)
+                best = self._best_marked(sorted_ys, order_y, y, tol, densities, marked)
+                if best is None:
                     answers.append("") 
                     continue
                 
-                best_mark = max(marked_ones, key=lambda m: m['density'])
-                mx = best_mark['pos'][0]
+                mx = int(marks['x'][best])
                 
                 # Indice relativo al inicio del bloque
                 col_idx = int(round((mx - start_x) / block_step))
@@ -0,0 +1,251 @@
+import argparse
+import csv
+import sys
+import time
+
+import numpy as np
+
+from answer_matrix import PREGUNTAS, VALORES, DUDOSA, encode_answers
+
+# Caracteres de una pauta que dejan la pregunta sin puntaje
+SIN_PUNTAJE = "-._0"
+
+# Fracción de alumnos del grupo alto y del grupo bajo para el índice de discriminación
+GRUPO_EXTREMO = 0.27
+
+
+class AnswerKey:
+    """Pauta de una forma de la prueba: código de la respuesta correcta por pregunta (0 = sin puntaje)."""
+    def __init__(self, name, answers):
+        self.name = name
+        self.codes = encode_answers([("" if a in SIN_PUNTAJE else a) for a in answers])
+        if (self.codes == DUDOSA).any():
+            bad = [VALORES[c] for c in self.codes if c == DUDOSA]
+            raise ValueError(f"La pauta {name} tiene respuestas no válidas: {bad[:3]}")
+
+    @property
+    def scored(self):
+        return self.codes > 0
+
+
+def load_keys(filename):
+    """
+    Lee las pautas de un archivo de texto, una forma por línea:
+        NOMBRE: RESPUESTAS
+    RESPUESTAS es una letra por pregunta (se ignoran espacios, comas y punto y coma);
+    '-' o '.' = pregunta sin puntaje. Una línea sin "NOMBRE:" se nombra "Forma N".
+    Lo que sigue a # es comentario.
+    """
+    keys = []
+    with open(filename, 'r', encoding='utf-8-sig') as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            if ':' in line:
+                name, answers = (part.strip() for part in line.split(':', 1))
+            else:
+                name, answers = f"Forma {len(keys) + 1}", line
+            answers = "".join(answers.replace(';', ' ').replace(',', ' ').split())
+            keys.append(AnswerKey(name, answers.upper()))
+    if not keys:
+        raise ValueError("El archivo no tiene pautas.")
+    return keys
+
+
+class ScoreReport:
+    """
+    Resultado de corregir una sesión completa.
+
+    Por alumno (arreglos de largo N):
+    - forms: índice de la pauta usada; correct: respuestas correctas; scored: preguntas con puntaje.
+    - percent: porcentaje de logro.
+    - hits: matriz N x PREGUNTAS (bool) de respuestas correctas.
+
+    Por forma y pregunta (item_analysis): dificultad, discriminación y distribución de opciones.
+    """
+    def __init__(self, keys, matrix, forms, auto_forms):
+        self.keys = keys
+        self.matrix = matrix
+        self.forms = forms
+        self.auto_forms = auto_forms
+
+        key_codes = np.stack([k.codes for k in keys])[forms] # N x PREGUNTAS
+        self.scored_mask = key_codes > 0
+        self.hits = (matrix == key_codes) & self.scored_mask
+        self.correct = self.hits.sum(axis=1)
+        self.scored = self.scored_mask.sum(axis=1)
+        self.percent = np.where(self.scored > 0, 100.0 * self.correct / np.maximum(self.scored, 1), 0.0)
+
+    def item_analysis(self):
+        """
+        Tabla por forma y pregunta con puntaje: lista de dicts con
+        n, clave, dificultad (proporción de correctas), discriminación (correlación punto-biserial
+        entre la pregunta y el puntaje del resto de la prueba), índice D (grupo alto - grupo bajo,
+        GRUPO_EXTREMO de cada extremo) y proporción de cada opción.
+        """
+        rows = []
+        n_values = len(VALORES)
+        for k, key in enumerate(self.keys):
+            members = np.flatnonzero(self.forms == k)
+            n = len(members)
+            if n == 0:
+                continue
+            items = np.flatnonzero(key.scored)
+            hits = self.hits[np.ix_(members, items)].astype(np.float64)
+            total = hits.sum(axis=1)
+
+            difficulty = hits.mean(axis=0)
+
+            # Punto-biserial corregida: cada pregunta contra el puntaje sin ella
+            rest = total[:, None] - hits
+            dh = hits - hits.mean(axis=0)
+            dr = rest - rest.mean(axis=0)
+            denom = np.sqrt((dh * dh).sum(axis=0) * (dr * dr).sum(axis=0))
+            with np.errstate(invalid='ignore', divide='ignore'):
+                discrimination = np.where(denom > 0, (dh * dr).sum(axis=0) / denom, np.nan)
+
+            # Índice D: grupo alto y bajo por puntaje total
+            group = max(1, int(round(n * GRUPO_EXTREMO)))
+            order = np.argsort(total, kind='stable')
+            index_d = hits[order[-group:]].mean(axis=0) - hits[order[:group]].mean(axis=0)
+
+            # Distribución de opciones: conteos por pregunta y código en una sola pasada
+            answers = self.matrix[np.ix_(members, items)].astype(np.intp)
+            offsets = np.arange(len(items)) * n_values
+            counts = np.bincount((answers + offsets).ravel(), minlength=len(items) * n_values)
+            shares = counts.reshape(len(items), n_values) / n
+
+            for j, q in enumerate(items.tolist()):
+                rows.append({
+                    'forma': key.name,
+                    'pregunta': q + 1,
+                    'clave': VALORES[key.codes[q]],
+                    'n': n,
+                    'dificultad': float(difficulty[j]),
+                    'discriminacion': float(discrimination[j]),
+                    'indice_d': float(index_d[j]),
+                    'opciones': {VALORES[c] or 'blanco': float(shares[j, c]) for c in range(n_values)},
+                })
+        return rows
+
+    def summary(self):
+        return {
+            'hojas': len(self.correct),
+            'promedio_porcentaje': float(self.percent.mean()) if len(self.percent) else 0.0,
+            'por_forma': {key.name: int((self.forms == k).sum()) for k, key in enumerate(self.keys)},
+        }
+
+
+def score_matrix(matrix, keys, forms=None):
+    """
+    Corrige todas las hojas en una pasada.
+    matrix: N x PREGUNTAS de códigos (SessionManager.answer_matrix()).
+    forms: nombre de la forma de cada hoja. Si no se entrega (o es "") y hay varias pautas,
+    a cada hoja se le asigna la pauta con la que obtiene más respuestas correctas.
+    """
+    matrix = np.asarray(matrix, dtype=np.uint8)
+    n = len(matrix)
+    codes = np.stack([k.codes for k in keys]) # K x PREGUNTAS
+
+    # Forma automática: correctas de cada hoja con cada pauta (N x K)
+    matches = ((matrix[:, None, :] == codes[None]) & (codes[None] > 0)).sum(axis=2)
+    chosen = np.argmax(matches, axis=1) if n else np.zeros(0, dtype=np.intp)
+    auto = np.ones(n, dtype=bool)
+
+    if forms is not None:
+        by_name = {k.name.upper(): i for i, k in enumerate(keys)}
+        for i, name in enumerate(forms):
+            k = by_name.get(str(name or "").strip().upper())
+            if k is not None:
+                chosen[i] = k
+                auto[i] = False
+    return ScoreReport(keys, matrix, chosen, auto)
+
+
+def score_session(session, keys):
+    """Corrige la sesión (SessionManager). La forma de cada hoja sale de su campo 'form', si lo tiene."""
+    forms = [s.get('form', "") for s in session.get_scans()]
+    return score_matrix(session.answer_matrix(), keys, forms)
+
+
+def write_students(report, filename, ruts, names):
+    """CSV por alumno: RUT, nombre, forma, correctas, preguntas y porcentaje."""
+    with open(filename, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f, delimiter=';')
+        writer.writerow(['rut', 'nombre', 'forma', 'forma_detectada', 'correctas', 'preguntas', 'porcentaje'])
+        forms = [report.keys[k].name for k in report.forms.tolist()]
+        for row in zip(ruts, names, forms, report.auto_forms.tolist(), report.correct.tolist(),
+                       report.scored.tolist(), report.percent.tolist()):
+            rut, name, form, auto, correct, scored, percent = row
+            writer.writerow([rut, name, form, "si" if auto else "no", correct, scored, f"{percent:.1f}"])
+
+
+def write_items(report, filename):
+    """CSV por forma y pregunta: clave, dificultad, discriminación, índice D y % de cada opción."""
+    rows = report.item_analysis()
+    options = [v or 'blanco' for v in VALORES]
+    with open(filename, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f, delimiter=';')
+        writer.writerow(['forma', 'pregunta', 'clave', 'n', 'dificultad', 'discriminacion', 'indice_d'] + options)
+        for r in rows:
+            disc = "" if np.isnan(r['discriminacion']) else f"{r['discriminacion']:.3f}"
+            writer.writerow([r['forma'], r['pregunta'], r['clave'], r['n'], f"{r['dificultad']:.3f}", disc,
+                             f"{r['indice_d']:.3f}"] + [f"{100 * r['opciones'][o]:.1f}" for o in options])
+
+
+def load_answers(filename):
+    """
+    Respuestas a corregir desde una sesión (.escaner) o un CSV de batch_processor.
+    Retorna (ruts, nombres, formas, matriz N x PREGUNTAS).
+    """
+    if filename.lower().endswith('.csv'):
+        ruts, names, rows = [], [], []
+        with open(filename, 'r', newline='', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            first = header.index('P1') if header and 'P1' in header else 5
+            for line in reader:
+                ruts.append(line[1] if len(line) > 1 else "")
+                names.append(line[2] if len(line) > 2 else "")
+                rows.append(encode_answers(line[first:first + PREGUNTAS]))
+        matrix = np.stack(rows) if rows else np.zeros((0, PREGUNTAS), dtype=np.uint8)
+        return ruts, names, [""] * len(ruts), matrix
+
+    from session_manager import SessionManager
+    session = SessionManager()
+    try:
+        session.load_session(filename)
+        forms = [s.get('form', "") for s in session.get_scans()]
+        return list(session.ruts), list(session.names), forms, session.answer_matrix()
+    finally:
+        session.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Corrección de pruebas con pautas y análisis de preguntas (sin interfaz gráfica).")
+    parser.add_argument('entrada', help="Sesión (.escaner) o CSV de batch_processor")
+    parser.add_argument('pautas', help="Archivo de pautas: una forma por línea (NOMBRE: RESPUESTAS)")
+    parser.add_argument('-a', '--alumnos', default="puntajes.csv", help="CSV de puntajes por alumno (default: puntajes.csv)")
+    parser.add_argument('-p', '--preguntas', default="preguntas.csv",
+                        help="CSV de análisis por pregunta (default: preguntas.csv)")
+    args = parser.parse_args(argv)
+
+    keys = load_keys(args.pautas)
+    ruts, names, forms, matrix = load_answers(args.entrada)
+
+    started = time.perf_counter()
+    report = score_matrix(matrix, keys, forms)
+    write_students(report, args.alumnos, ruts, names)
+    write_items(report, args.preguntas)
+    elapsed = time.perf_counter() - started
+
+    summary = report.summary()
+    print(f"Corregidas {summary['hojas']} hojas en {elapsed * 1000:.0f} ms. "
+          f"Logro promedio: {summary['promedio_porcentaje']:.1f}%. "
+          f"Salida: {args.alumnos}, {args.preguntas}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,331 @@
+import json
+import os
+import queue
+import struct
+import threading
+import zlib
+
+# --- Diario de la sesión en curso (autoguardado) ---
+# Cada cambio de la sesión se agrega al final de un segmento del diario apenas ocurre.
+# Si el programa se cierra de forma inesperada, al abrirlo se reconstruye la sesión con
+# la última compactación más los segmentos posteriores.
+CARPETA_DIARIO = "autoguardado"
+ARCHIVO_COMPACTADO = "sesion.escaner"
+PREFIJO_SEGMENTO = "diario_"
+EXTENSION_SEGMENTO = ".log"
+
+# Registros de un segmento antes de compactarlo en segundo plano
+REGISTROS_POR_SEGMENTO = 500
+
+# fsync tras cada tanda de registros: la sesión sobrevive también a un corte de luz
+SINCRONIZAR_DISCO = True
+
+# Cabecera de cada registro: largo del JSON, largo del bloque binario (JPG) y CRC32 de ambos
+_CABECERA = struct.Struct('<III')
+
+
+def _segment_number(name):
+    """Número de un segmento a partir de su nombre de archivo (None si no es un segmento)."""
+    if not (name.startswith(PREFIJO_SEGMENTO) and name.endswith(EXTENSION_SEGMENTO)):
+        return None
+    digits = name[len(PREFIJO_SEGMENTO):-len(EXTENSION_SEGMENTO)]
+    return int(digits) if digits.isdigit() else None
+
+
+def read_records(path):
+    """
+    Lee los registros válidos de un segmento, en orden: lista de (cabecera, bloque).
+    Se detiene en el primer registro incompleto o dañado (escritura cortada por el cierre).
+    """
+    records = []
+    with open(path, 'rb') as f:
+        data = f.read()
+    pos = 0
+    while pos + _CABECERA.size <= len(data):
+        json_len, blob_len, crc = _CABECERA.unpack_from(data, pos)
+        start = pos + _CABECERA.size
+        end = start + json_len + blob_len
+        if end > len(data) or zlib.crc32(data[start:end]) != crc:
+            break
+        try:
+            header = json.loads(data[start:start + json_len].decode('utf-8'))
+        except ValueError:
+            break
+        records.append((header, data[start + json_len:end] if blob_len else None))
+        pos = end
+    return records
+
+
+class SessionJournal:
+    """
+    Diario de Sesión (append-only).
+
+    SessionManager informa cada cambio (add_scan, update_rut, update_name, update_answer,
+    remove_scan, además de limpiar y cargar) con log(); el registro se arma en el hilo de Tk
+    con costo constante y un hilo escritor lo agrega al segmento actual (flush + fsync por tanda).
+    La imagen de una hoja nueva se comprime a JPG en el hilo escritor.
+
+    Archivos en `folder`:
+    - diario_NNNNNN.log: segmentos de registros [cabecera | JSON | JPG], cada uno con su número
+      de secuencia (seq).
+    - sesion.escaner: compactación, una sesión completa (formato de SessionManager) con el seq
+      del último registro que incluye.
+
+    Compactación: cada REGISTROS_POR_SEGMENTO registros (o al cargar/guardar una sesión) se
+    copia la tabla de escaneos en el hilo de Tk, el escritor pasa a un segmento nuevo y un hilo
+    aparte escribe sesion.escaner con esa copia; recién entonces se borran los segmentos anteriores.
+
+    Recuperación (recover): carga la compactación y aplica los registros con seq posterior.
+    """
+    def __init__(self, folder=CARPETA_DIARIO):
+        self.folder = folder
+        self.session = None
+        self._seq = 0
+        self._segment = 0
+        self._segment_records = 0
+        self._dirty = False
+        self._compact_requested = False
+        self._compacting = threading.Event()
+        self._compactor = None
+        self._queue = queue.Queue()
+        self._writer = None
+
+    # --- Recuperación ---
+
+    def has_pending(self):
+        """True si quedó una sesión en el diario (el programa no se cerró luego de guardarla)."""
+        if not os.path.isdir(self.folder):
+            return False
+        if os.path.exists(os.path.join(self.folder, ARCHIVO_COMPACTADO)):
+            return True
+        return any(os.path.getsize(path) > 0 for _, path in self._segments())
+
+    def recover(self, session):
+        """
+        Reconstruye en `session` la sesión del diario. Retorna la lista de escaneos.
+        Las imágenes de la compactación se copian a memoria (comprimidas) para que el archivo
+        pueda reemplazarse en la próxima compactación.
+        """
+        snapshot = os.path.join(self.folder, ARCHIVO_COMPACTADO)
+        session.journal = None # La reconstrucción no se vuelve a registrar
+        session.clear_session()
+        last_seq = 0
+        if os.path.exists(snapshot):
+            scans, meta = session._load_container(snapshot, with_meta=True)
+            for scan in scans:
+                data = session._read_image_bytes(scan)
+                scan.pop('image_ref', None)
+                scan['vis_img_compressed'] = data
+            session.close()
+            last_seq = meta.get('diario_seq', 0)
+
+        self._seq = last_seq
+        for _, path in self._segments():
+            for header, blob in read_records(path):
+                if header.get('seq', 0) <= last_seq:
+                    continue
+                self._apply(session, header, blob)
+                self._seq = max(self._seq, header['seq'])
+        session.session_format = None
+        self._dirty = True
+        return session.get_scans()
+
+    def _apply(self, session, header, blob):
+        op = header.get('op')
+        if op == 'agregar':
+            scan = header['escaneo']
+            scan['vis_img'] = None
+            scan['vis_img_compressed'] = blob
+            session.add_scan(scan)
+        elif op == 'rut':
+            session.update_rut(header['indice'], header['valor'])
+        elif op == 'nombre':
+            session.update_name(header['indice'], header['valor'])
+        elif op == 'respuesta':
+            session.update_answer(header['indice'], header['pregunta'], header['valor'])
+        elif op == 'eliminar':
+            session.remove_scan(header['indice'])
+        elif op == 'limpiar':
+            session.clear_session()
+        elif op == 'cargar':
+            try:
+                session.load_session(header['archivo'])
+            except Exception as e:
+                print(f"No se pudo volver a cargar {header['archivo']}: {e}")
+                session.clear_session()
+
+    def discard(self):
+        """Borra el diario (la sesión anterior no se recupera)."""
+        if not os.path.isdir(self.folder):
+            return
+        paths = [path for _, path in self._segments()]
+        paths.append(os.path.join(self.folder, ARCHIVO_COMPACTADO))
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    # --- Registro ---
+
+    def start(self, session):
+        """Comienza a registrar los cambios de `session` (después de recover o discard)."""
+        os.makedirs(self.folder, exist_ok=True)
+        tmp = os.path.join(self.folder, ARCHIVO_COMPACTADO + ".tmp")
+        if os.path.exists(tmp):
+            os.remove(tmp) # Compactación que no alcanzó a terminar
+        segments = self._segments()
+        self._segment = segments[-1][0] + 1 if segments else 1
+        self.session = session
+        session.journal = self
+        self._writer = threading.Thread(target=self._run_writer, args=(self._segment,),
+                                        name="diario-sesion", daemon=True)
+        self._writer.start()
+        if segments:
+            # Lo recuperado queda en una sola compactación
+            self.compact()
+
+    def log(self, op, scan=None, **fields):
+        """
+        Agrega un registro (hilo de Tk). `scan` solo en 'agregar': sus metadatos se copian
+        ahora y su imagen se comprime en el hilo escritor.
+        """
+        if self._writer is None:
+            return
+        self._seq += 1
+        header = dict(fields, seq=self._seq, op=op)
+        image = None
+        if scan is not None:
+            header['escaneo'] = self.session.scan_metadata(scan)
+            image = self.session.image_source(scan)
+        payload = json.dumps(header, default=self.session.json_default, ensure_ascii=False).encode('utf-8')
+        self._queue.put(('registro', payload, image))
+
+        self._dirty = True
+        self._segment_records += 1
+        if self._segment_records >= REGISTROS_POR_SEGMENTO or self._compact_requested:
+            self.compact()
+
+    @property
+    def seq(self):
+        """Número del último registro."""
+        return self._seq
+
+    def mark_saved(self, seq=None):
+        """
+        La sesión quedó guardada por el usuario: al cerrar no hace falta conservar el diario.
+        seq: último registro incluido en lo guardado (guardado en segundo plano); si hubo
+        cambios después, el diario se sigue conservando.
+        """
+        if seq is None or seq == self._seq:
+            self._dirty = False
+        self.compact()
+
+    def compact(self):
+        """
+        Programa una compactación con el estado actual (hilo de Tk).
+        Si ya hay una en curso, se repite con el próximo registro.
+        """
+        if self._writer is None:
+            return
+        if self._compacting.is_set():
+            self._compact_requested = True
+            return
+        self._compacting.set()
+        self._compact_requested = False
+        self._segment_records = 0
+        self._queue.put(('rotar', self.session.snapshot_scans(), self._seq))
+
+    def close(self):
+        """
+        Cierre normal del programa: vacía la cola de registros. Si la sesión estaba guardada
+        (sin cambios desde entonces) el diario se borra; si no, se ofrecerá recuperarla.
+        """
+        if self._writer is None:
+            return
+        self._queue.put(None)
+        self._writer.join()
+        self._writer = None
+        if self.session is not None:
+            self.session.journal = None
+        if self._compactor is not None:
+            self._compactor.join()
+        if not self._dirty:
+            self.discard()
+
+    # --- Hilos ---
+
+    def _segments(self):
+        """Segmentos existentes ordenados: lista de (número, ruta)."""
+        found = []
+        for name in os.listdir(self.folder):
+            number = _segment_number(name)
+            if number is not None:
+                found.append((number, os.path.join(self.folder, name)))
+        found.sort()
+        return found
+
+    def _segment_path(self, number):
+        return os.path.join(self.folder, f"{PREFIJO_SEGMENTO}{number:06d}{EXTENSION_SEGMENTO}")
+
+    def _run_writer(self, segment):
+        f = open(self._segment_path(segment), 'ab')
+        try:
+            while True:
+                # Se escribe todo lo que esté en cola y se sincroniza una vez por tanda
+                batch = [self._queue.get()]
+                while True:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                for item in batch:
+                    if item is None:
+                        self._sync(f)
+                        return
+                    if item[0] == 'registro':
+                        _, payload, image = item
+                        blob = b""
+                        if image is not None:
+                            try:
+                                blob = self.session.encode_image(image) or b""
+                            except Exception as e:
+                                print(f"Error comprimiendo imagen para el diario: {e}")
+                        f.write(_CABECERA.pack(len(payload), len(blob), zlib.crc32(payload + blob)))
+                        f.write(payload)
+                        f.write(blob)
+                    else:
+                        _, scans, seq = item
+                        self._sync(f)
+                        f.close()
+                        old = [path for number, path in self._segments() if number <= segment]
+                        segment += 1
+                        f = open(self._segment_path(segment), 'ab')
+                        self._compactor = threading.Thread(target=self._run_compaction, args=(scans, seq, old),
+                                                           name="compactar-sesion", daemon=True)
+                        self._compactor.start()
+                self._sync(f)
+        except Exception as e:
+            print(f"Error escribiendo el diario de sesión: {e}")
+        finally:
+            f.close()
+
+    @staticmethod
+    def _sync(f):
+        f.flush()
+        if SINCRONIZAR_DISCO:
+            os.fsync(f.fileno())
+
+    def _run_compaction(self, scans, seq, old_segments):
+        path = os.path.join(self.folder, ARCHIVO_COMPACTADO)
+        tmp = path + ".tmp"
+        try:
+            self.session.write_container(tmp, scans, {'diario_seq': seq})
+            os.replace(tmp, path)
+            for segment in old_segments:
+                os.remove(segment)
+        except Exception as e:
+            print(f"Error compactando el diario de sesión: {e}")
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        finally:
+            self._compacting.clear()
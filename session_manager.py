@@ -1,24 +1,139 @@
+import itertools
 import pickle
+import json
 import os
+import threading
 import time
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import cv2
+import numpy as np
+from answer_matrix import AnswerMatrix, AnswerRow, PREGUNTAS, VALORES, encode_answer
+from image_cache import ImageCache
+from scanner_logic import SheetOverlay
+
+# --- Formato de sesión (.escaner) ---
+# Contenedor ZIP: una tabla de metadatos (RUT, nombre, respuestas) y una imagen JPG por hoja.
+# Abrir una sesión solo lee la tabla; cada imagen se lee cuando se selecciona la hoja.
+# Los .escaner antiguos (pickle con todo adentro) se siguen pudiendo abrir y se convierten al guardar.
+FORMATO_SESION = 2
+ARCHIVO_METADATOS = "sesion.json"
+CARPETA_IMAGENES = "imagenes/"
+CALIDAD_JPEG = 65
+
+# Hilos que comprimen imágenes al guardar (cv2.imencode libera el GIL)
+HILOS_GUARDADO = max(1, (os.cpu_count() or 2) - 1)
+
+# Imágenes comprimidas en espera de escribirse, por hilo (acota la memoria al guardar)
+IMAGENES_EN_VUELO = 4
+
+# Claves de un escaneo que guardan su imagen (no van en la tabla de metadatos)
+CLAVES_IMAGEN = ('vis_img', 'vis_img_compressed', 'image_ref')
+
+# Clave de cada escaneo en la caché de imágenes: correlativo de la sesión en memoria, nunca se
+# reutiliza (id() del dict sí puede repetirse tras eliminar una hoja). No se guarda en el archivo.
+CLAVE_CACHE = 'cache_key'
+CLAVES_NO_GUARDADAS = CLAVES_IMAGEN + (CLAVE_CACHE,)
+
+def _json_default(value):
+    """Serializa tipos NumPy (p.ej. posiciones en rut_marks/ans_marks) como tipos nativos."""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, AnswerRow):
+        return list(value)
+    raise TypeError(f"Tipo no serializable: {type(value).__name__}")
+
+def compress_image(vis_img):
+    """Bytes JPG de una imagen de visualización (BGR, grises o SheetOverlay); None si falla."""
+    if isinstance(vis_img, SheetOverlay):
+        vis_img = vis_img.render() # Overlay diferido: se dibuja solo al comprimir
+    success, encoded_img = cv2.imencode('.jpg', vis_img, [int(cv2.IMWRITE_JPEG_QUALITY), CALIDAD_JPEG])
+    return encoded_img.tobytes() if success else None
+
+def compress_view(vis_img):
+    """
+    Claves de un escaneo para su imagen de visualización:
+    - SheetOverlay: la página limpia en grises (JPG) y las marcas como datos ('mark_boxes');
+      el visor dibuja las marcas encima.
+    - Imagen BGR (sin marcas como datos): el JPG tal cual.
+    """
+    if isinstance(vis_img, SheetOverlay):
+        return {'vis_img_compressed': compress_image(vis_img.gray), 'mark_boxes': vis_img.to_data()}
+    return {'vis_img_compressed': compress_image(vis_img)}
 
 class SessionManager:
     """
     Gestor de Estado y Persistencia.
     
     Almacena la lista de pruebas escaneadas en memoria.
-    Maneja el guardar/cargar archivos .escaner usando Pickle.
+    Maneja el guardar/cargar archivos .escaner (contenedor ZIP indexado; lee también el pickle antiguo).
     Implementa optimización de espacio comprimiendo imágenes (JPG) antes de guardar.
+    Las imágenes de una sesión cargada no se decodifican al abrir: get_image() las lee al pedirlas.
+    En memoria cada hoja guarda solo su JPG (o su referencia en el archivo); las imágenes
+    decodificadas viven en una caché LRU acotada (image_cache).
     Genera reportes de texto para exportación.
+
+    Columnas: las respuestas de todas las hojas viven en una matriz uint8 (answers, ver
+    answer_matrix); 'answers_values' de cada escaneo es una vista (AnswerRow) de su fila.
+    RUT y nombre se llevan además en listas paralelas a scans (ruts, names). Reportes,
+    estadísticas por pregunta y filtros trabajan sobre la matriz completa.
     """
     def __init__(self):
-        # Lista de dicts { 'path': str, 'rut_marks': list, 'ans_marks': list, 'vis_img': numpy_array, 'rut_text': str }
+        # Lista de dicts { 'path': str, 'rut_marks': list, 'ans_marks': list, 'vis_img_compressed': bytes, 'rut_text': str }
+        # 'vis_img' queda en None: la imagen vive comprimida ('vis_img_compressed', JPG en memoria)
+        # o en el archivo de la sesión ('image_ref', entrada del contenedor).
         self.scans = []
+        self.answers = AnswerMatrix()
+        self._slots = [] # Fila de la matriz de cada escaneo (mismo orden que scans)
+        self.ruts = []
+        self.names = []
+        self.image_cache = ImageCache()
+        self._cache_keys = itertools.count()
+        self._live_keys = set() # CLAVE_CACHE de las hojas que están en la sesión
+        self.session_format = None # "zip" o "pickle" según el último archivo cargado
+        self._container = None # ZipFile de la sesión abierta (imágenes diferidas)
+        self._container_lock = threading.Lock()
+        self.journal = None # SessionJournal que registra cada cambio (autoguardado), si está activo
+        self._save_executor = None
+        self._pending_save = None # (archivo, escaneos guardados, seq del diario, Future)
 
     def add_scan(self, scan_data):
-        """Agrega un nuevo escaneo a la sesión activa en memoria."""
+        """
+        Agrega un nuevo escaneo a la sesión activa en memoria.
+        Si trae la imagen decodificada ('vis_img'), se comprime aquí; conviene comprimirla
+        antes (compress_view) fuera del hilo de la UI.
+        """
+        if scan_data.get('vis_img') is not None:
+            scan_data.update(compress_view(scan_data['vis_img']))
+            scan_data['vis_img'] = None
+        scan_data.setdefault('vis_img', None)
+        self._index_scan(scan_data)
         self.scans.append(scan_data)
+        if self.journal is not None:
+            self.journal.log('agregar', scan=scan_data)
+
+    def _index_scan(self, scan):
+        """Pasa las respuestas del escaneo a la matriz y agrega sus columnas."""
+        scan[CLAVE_CACHE] = next(self._cache_keys)
+        self._live_keys.add(scan[CLAVE_CACHE])
+        row = self.answers.allocate(scan.get('answers_values'))
+        scan['answers_values'] = row
+        self._slots.append(row.slot)
+        self.ruts.append(scan.get('rut_text', ''))
+        self.names.append(scan.get('student_name', ''))
+
+    def _set_scans(self, scans):
+        self.answers.clear()
+        self._slots = []
+        self.ruts = []
+        self.names = []
+        self._live_keys = set()
+        for scan in scans:
+            self._index_scan(scan)
+        self.scans = scans
 
     def get_scans(self):
         return self.scans
@@ -28,100 +143,368 @@ class SessionManager:
             return self.scans[index]
         return None
 
+    def has_scan(self, scan):
+        """True si el escaneo (dict) sigue en la sesión (thread safe; usado por la precarga)."""
+        return scan.get(CLAVE_CACHE) in self._live_keys
+
     def remove_scan(self, index):
         if 0 <= index < len(self.scans):
+            key = self.scans[index][CLAVE_CACHE]
+            self._live_keys.discard(key)
+            self.image_cache.discard(key)
+            self.answers.release(self._slots[index])
             del self.scans[index]
+            del self._slots[index]
+            del self.ruts[index]
+            del self.names[index]
+            if self.journal is not None:
+                self.journal.log('eliminar', indice=index)
             return True
         return False
 
     def update_name(self, index, new_name):
         if 0 <= index < len(self.scans):
             self.scans[index]['student_name'] = new_name
+            self.names[index] = new_name
+            if self.journal is not None:
+                self.journal.log('nombre', indice=index, valor=new_name)
 
     def update_rut(self, index, new_rut):
         if 0 <= index < len(self.scans):
             self.scans[index]['rut_text'] = new_rut
+            self.ruts[index] = new_rut
+            if self.journal is not None:
+                self.journal.log('rut', indice=index, valor=new_rut)
 
     def update_answer(self, scan_index, ans_index, value):
         if 0 <= scan_index < len(self.scans):
-            # Asumimos que scan_data ya tiene la llave, si no la creamos
-            if 'answers_values' not in self.scans[scan_index]:
-                self.scans[scan_index]['answers_values'] = [""] * 90
-            
-            if 0 <= ans_index < 90:
-                self.scans[scan_index]['answers_values'][ans_index] = value
+            if 0 <= ans_index < PREGUNTAS:
+                self.answers.data[self._slots[scan_index], ans_index] = encode_answer(value)
+                if self.journal is not None:
+                    self.journal.log('respuesta', indice=scan_index, pregunta=ans_index, valor=value)
 
     def clear_session(self):
-        self.scans = []
+        self._set_scans([])
+        self.session_format = None
+        self._close_container()
+        self.image_cache.clear()
+        if self.journal is not None:
+            self.journal.log('limpiar')
+
+    def close(self):
+        """Libera el archivo de la sesión abierta."""
+        self._close_container()
+
+    def get_image(self, index):
+        """
+        Imagen de visualización de un escaneo, compartida: no modificarla.
+        SheetOverlay (página en grises + marcas) si la hoja guarda sus marcas como datos; si no, BGR.
+        Se decodifica recién aquí y queda en la caché LRU (image_cache) mientras quepa.
+        """
+        scan = self.get_scan(index)
+        if scan is None:
+            return None
+        return self.get_scan_image(scan)
+
+    def get_scan_image(self, scan):
+        """Como get_image, a partir del dict del escaneo (thread safe; usado por la precarga)."""
+        if scan.get('vis_img') is not None:
+            return scan['vis_img']
+        return self.image_cache.get(scan[CLAVE_CACHE], lambda: self._decode_image(scan))
+
+    def _decode_image(self, scan):
+        data = self._read_image_bytes(scan)
+        if data is None:
+            return None
+        if scan.get('mark_boxes'):
+            gray = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_GRAYSCALE)
+            return SheetOverlay.from_data(gray, scan['mark_boxes']) if gray is not None else None
+        return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+    def memory_stats(self):
+        """Caché de imágenes decodificadas y JPG residentes en memoria (para ajustar el presupuesto)."""
+        stats = self.image_cache.stats()
+        stats['hojas'] = len(self.scans)
+        stats['bytes_comprimidos'] = sum(len(s['vis_img_compressed']) for s in self.scans
+                                         if s.get('vis_img_compressed') is not None)
+        return stats
 
-    def save_session(self, filename):
+    def save_session(self, filename, progress=None):
         """
-        Guarda la sesión en disco usando Pickle.
+        Guarda la sesión en disco como contenedor ZIP indexado:
+        - sesion.json: formato y tabla de escaneos (todo menos las imágenes).
+        - imagenes/NNNNNN.jpg: una entrada por hoja, referenciada desde la tabla ('image_ref').
         OPTIMIZACIÓN: Convierte las imágenes NumPy (pesadas) a JPG en memoria para reducir drásticamente el tamaño final del archivo (factor 10x-20x).
+        Las hojas que siguen en el archivo de origen se copian sin volver a comprimir.
+
+        Se escribe en un archivo temporal y se reemplaza al final: un fallo a mitad de camino
+        no daña la sesión anterior (que puede ser el mismo archivo).
+        Espera a que termine; para no bloquear la UI usar start_save/finish_save.
         """
-        # Crear copia optimizada para guardar
-        scans_to_save = []
-        for s in self.scans:
-            item = s.copy()
-            # Si tiene imagen CV2, comprimirla a JPG
-            if 'vis_img' in item and item['vis_img'] is not None:
-                success, encoded_img = cv2.imencode('.jpg', item['vis_img'], [int(cv2.IMWRITE_JPEG_QUALITY), 65])
-                if success:
-                    item['vis_img_compressed'] = encoded_img
-                    del item['vis_img'] # Quitamos la versión pesada
-            scans_to_save.append(item)
-
-        with open(filename, 'wb') as f:
-            pickle.dump(scans_to_save, f)
+        self.start_save(filename, progress)
+        self._pending_save[3].exception() # Espera sin lanzar: finish_save limpia y re-lanza
+        self.finish_save()
+
+    def start_save(self, filename, progress=None):
+        """
+        Guardado en segundo plano (hilo de Tk). Se copia la tabla de escaneos y el archivo
+        temporal se escribe en otro hilo; los cambios posteriores no entran en este guardado.
+        progress(hechas, total) se llama desde el hilo de guardado.
+        Cuando save_done(), finish_save() (hilo de Tk) reemplaza el archivo.
+        """
+        if self._pending_save is not None:
+            raise Exception("Ya hay un guardado en curso.")
+        if self._save_executor is None:
+            self._save_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="guardar-sesion")
+        seq = self.journal.seq if self.journal is not None else None
+        future = self._save_executor.submit(self._write_tmp, filename + ".tmp", self.snapshot_scans(), progress)
+        self._pending_save = (filename, list(self.scans), seq, future)
+
+    def is_saving(self):
+        return self._pending_save is not None
+
+    def save_done(self):
+        return self._pending_save is None or self._pending_save[3].done()
+
+    def finish_save(self):
+        """Completa el guardado en curso (espera si no terminó). Re-lanza el error del guardado."""
+        filename, saved, seq, future = self._pending_save
+        self._pending_save = None
+        refs = future.result()
+
+        # El contenedor anterior se cierra antes de reemplazar (en Windows no se puede reemplazar un archivo abierto)
+        self._close_container()
+        os.replace(filename + ".tmp", filename)
+
+        # Las hojas sin imagen en memoria pasan a leerse del archivo recién guardado
+        for s, ref in zip(saved, refs):
+            if s.get('vis_img') is None and ref is not None:
+                s.pop('vis_img_compressed', None)
+                s['image_ref'] = ref
+        if any(s.get('image_ref') for s in self.scans):
+            self._container = zipfile.ZipFile(filename, 'r')
+        self.session_format = "zip"
+        if self.journal is not None:
+            self.journal.mark_saved(seq)
+        return filename
+
+    def _write_tmp(self, tmp_filename, scans, progress):
+        try:
+            return self.write_container(tmp_filename, scans, progress=progress)
+        except Exception:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+            raise
+
+    def write_container(self, filename, scans, extra_meta=None, progress=None):
+        """
+        Escribe `scans` como contenedor ZIP en `filename` (sin tocar el contenedor abierto).
+        Cada imagen conserva su entrada ('image_ref') si ya tenía una: una copia de la tabla
+        tomada antes de guardar (compactación del diario) sigue apuntando a la imagen correcta.
+        Las imágenes se comprimen en paralelo (HILOS_GUARDADO) y se escriben en orden.
+        Retorna la referencia de la imagen de cada escaneo (None si no tiene).
+        """
+        used = {s['image_ref'] for s in scans if s.get('image_ref')}
+        next_name = 0
+        refs = []
+        total = len(scans)
+        # JPG ya está comprimido: las imágenes van sin deflate; solo la tabla se comprime
+        with ThreadPoolExecutor(max_workers=HILOS_GUARDADO, thread_name_prefix="jpg") as pool, \
+                zipfile.ZipFile(filename, 'w', zipfile.ZIP_STORED) as zf:
+            table = []
+            window = deque()
+            pending = iter(scans)
+            for s in scans:
+                # Ventana acotada de imágenes en compresión por delante de la escritura
+                while len(window) < HILOS_GUARDADO * IMAGENES_EN_VUELO:
+                    nxt = next(pending, None)
+                    if nxt is None:
+                        break
+                    window.append(pool.submit(self._encoded_image, nxt))
+                data = window.popleft().result()
+
+                item = {k: v for k, v in s.items() if k not in CLAVES_NO_GUARDADAS}
+                ref = None
+                if data is not None:
+                    ref = s.get('image_ref')
+                    while not ref:
+                        candidate = f"{CARPETA_IMAGENES}{next_name:06d}.jpg"
+                        next_name += 1
+                        if candidate not in used:
+                            ref = candidate
+                    zf.writestr(ref, data)
+                    item['image_ref'] = ref
+                refs.append(ref)
+                table.append(item)
+                if progress is not None:
+                    progress(len(table), total)
+
+            meta = {'formato': FORMATO_SESION, 'guardado': time.strftime("%Y-%m-%d %H:%M:%S"), 'escaneos': table}
+            meta.update(extra_meta or {})
+            zf.writestr(ARCHIVO_METADATOS, json.dumps(meta, default=_json_default, ensure_ascii=False),
+                        compress_type=zipfile.ZIP_DEFLATED)
+        return refs
 
     def load_session(self, filename):
         """
-        Carga una sesión y restaura las imágenes comprimidas a formato NumPy apto para OpenCV/Tkinter.
+        Carga una sesión. Solo se leen los metadatos; las imágenes quedan en el archivo
+        (o comprimidas en memoria, en el formato pickle antiguo) hasta que get_image() las pide.
+        Retorna (escaneos, faltantes).
         """
+        if zipfile.is_zipfile(filename):
+            result = self._load_container(filename)
+        else:
+            result = self._load_pickle(filename)
+        if self.journal is not None:
+            # La sesión recién cargada coincide con su archivo: cuenta como guardada
+            self.journal.log('cargar', archivo=os.path.abspath(filename))
+            self.journal.mark_saved()
+        return result
+
+    def _load_pickle(self, filename):
+        # Formato antiguo: lista de dicts en un pickle
         with open(filename, 'rb') as f:
             loaded_scans = pickle.load(f)
         
         if not isinstance(loaded_scans, list):
             raise ValueError("El archivo no tiene el formato correcto.")
         
-        # Reconstruir imagenes comprimidas
-        final_scans = []
+        # Las imagenes comprimidas se decodifican recién al mostrarlas (get_image)
         for item in loaded_scans:
-            if 'vis_img_compressed' in item:
-                # Descomprimir
-                nparr = item['vis_img_compressed']
-                img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-                item['vis_img'] = img
-                del item['vis_img_compressed']
-            final_scans.append(item)
-
-        self.scans = final_scans
+            item.setdefault('vis_img', None)
+
+        self._close_container()
+        self.image_cache.clear()
+        self._set_scans(loaded_scans)
+        self.session_format = "pickle"
         return self.scans, []
 
+    @staticmethod
+    def convert_session(filename, new_filename=None):
+        """Convierte un .escaner antiguo (pickle) al formato contenedor. Por defecto lo reemplaza."""
+        session = SessionManager()
+        try:
+            session.load_session(filename)
+            session.save_session(new_filename or filename)
+        finally:
+            session.close()
+
+    def _load_container(self, filename, with_meta=False):
+        container = zipfile.ZipFile(filename, 'r')
+        try:
+            meta = json.loads(container.read(ARCHIVO_METADATOS).decode('utf-8'))
+        except Exception:
+            container.close()
+            raise ValueError("El archivo no tiene el formato correcto.")
+        if meta.get('formato', 0) > FORMATO_SESION:
+            container.close()
+            raise ValueError("La sesión fue guardada con una versión más nueva del programa.")
+
+        names = set(container.namelist())
+        scans = []
+        missing = []
+        for item in meta.get('escaneos', []):
+            item['vis_img'] = None
+            ref = item.get('image_ref')
+            if ref and ref not in names:
+                missing.append(ref)
+                item.pop('image_ref')
+            scans.append(item)
+
+        self._close_container()
+        self.image_cache.clear()
+        self._container = container
+        self._set_scans(scans)
+        self.session_format = "zip"
+        if with_meta:
+            return self.scans, meta
+        return self.scans, missing
+
+    def _close_container(self):
+        with self._container_lock:
+            if self._container is not None:
+                self._container.close()
+                self._container = None
+
+    def _read_image_bytes(self, scan):
+        """JPG de una hoja que no está decodificada en memoria (contenedor o pickle antiguo)."""
+        data = scan.get('vis_img_compressed')
+        if data is not None:
+            if isinstance(data, bytes):
+                return data
+            return np.asarray(data, dtype=np.uint8).tobytes()
+        ref = scan.get('image_ref')
+        if ref:
+            with self._container_lock:
+                if self._container is not None:
+                    try:
+                        return self._container.read(ref)
+                    except KeyError:
+                        return None # La hoja ya no está en el archivo abierto
+        return None
+
+    def _encoded_image(self, scan):
+        """Bytes JPG de la imagen de un escaneo para guardarla (None si no tiene)."""
+        if scan.get('vis_img') is not None:
+            return compress_image(scan['vis_img'])
+        return self._read_image_bytes(scan)
+
+    # --- Soporte para el diario de sesión (SessionJournal) ---
+
+    json_default = staticmethod(_json_default)
+
+    @staticmethod
+    def scan_metadata(scan):
+        """Datos de un escaneo sin su imagen (lo que va en la tabla de la sesión)."""
+        return {k: v for k, v in scan.items() if k not in CLAVES_NO_GUARDADAS}
+
+    @staticmethod
+    def image_source(scan):
+        """Referencias a la imagen de un escaneo, para comprimirla en otro hilo (encode_image)."""
+        return {k: scan.get(k) for k in CLAVES_IMAGEN}
+
+    def encode_image(self, source):
+        return self._encoded_image(source)
+
+    def snapshot_scans(self):
+        """Copia de la tabla de escaneos que no cambia con las ediciones posteriores."""
+        copies = []
+        for s in self.scans:
+            item = dict(s)
+            if 'answers_values' in item:
+                item['answers_values'] = list(item['answers_values'])
+            copies.append(item)
+        return copies
+
+    # --- Operaciones sobre la matriz de respuestas ---
+
+    def answer_matrix(self):
+        """Códigos de respuesta de todas las hojas (N x PREGUNTAS, uint8, ver answer_matrix.VALORES), en orden."""
+        return self.answers.rows(self._slots)
+
     def generate_report(self, filename):
-        val_map = {"A": "1", "B": "2", "C": "3", "D": "4", "E": "5"}
+        # Código de respuesta -> dígito del reporte: A..E = 1..5, vacío u otro = 0
+        digits = np.full(len(VALORES), ord("0"), dtype=np.uint8)
+        for i, letter in enumerate("ABCDE"):
+            digits[encode_answer(letter)] = ord("1") + i
+
+        # Todas las respuestas separadas por tabulador en una sola operación (N x (2*PREGUNTAS-1) bytes)
+        n = len(self.scans)
+        width = 2 * PREGUNTAS - 1
+        cells = np.full((n, width), ord("\t"), dtype=np.uint8)
+        cells[:, 0::2] = digits[self.answer_matrix()]
+        joined = cells.tobytes().decode('ascii')
         
         # Encodign latin-1 para compatibilidad con sistemas escolares antiguos (, )
         with open(filename, 'w', encoding='latin-1') as f:
-            # Escribir cabecera opcional o dejar en blanco si se requiere formato raw
-            pass
-
-            for scan in self.scans:
-                rut = scan.get('rut_text', '')
+            lines = []
+            for i, (rut, name) in enumerate(zip(self.ruts, self.names)):
                 # Extraer solo numeros y K
                 raw_rut = ''.join(filter(lambda x: x.isdigit() or x.lower() == 'k', rut)).upper()
                 if not raw_rut: raw_rut = "0"
                 
-                name = scan.get('student_name', '')
-                
-                answers = scan.get('answers_values', [""] * 90)
-                # Mapear A->1, B->2... vacio->0
-                ans_nums = [val_map.get(v.upper(), "0") for v in answers]
-                # Asegurar 90 items
-                while len(ans_nums) < 90: ans_nums.append("0")
-                
-                joined_ans = "\t".join(ans_nums)
+                joined_ans = joined[i * width:(i + 1) * width]
                 
                 # Formato estricto: Rut<21 \t Name<40 \t Espacio \t Respuestas
-                line = f"{raw_rut:<21}\t{name:<40}\t           \t{joined_ans}\n"
-                f.write(line)
+                lines.append(f"{raw_rut:<21}\t{name:<40}\t           \t{joined_ans}\n")
+            f.write("".join(lines))
@@ -0,0 +1,153 @@
+import random
+
+import cv2
+import numpy as np
+
+from rut_index import check_digit
+
+
+OPCIONES = "ABCDE"
+TOTAL_PREGUNTAS = 90
+PREGUNTAS_POR_BLOQUE = 30
+COLUMNAS_RUT = 9
+FILAS_RUT = 11  # 0-9 + K
+
+# Geometría de la hoja expresada a 200 dpi (se escala a la resolución pedida).
+DPI_BASE = 200
+ANCHO_PAGINA_IN = 8.5
+ALTO_PAGINA_IN = 11.0
+RADIO_BURBUJA = 13
+PASO_RUT = 40
+ORIGEN_RUT = (600, 250)
+PASO_OPCION = 40
+PASO_FILA = 40
+ORIGEN_RESPUESTAS_Y = 880
+BLOQUES_X = (250, 750, 1250)
+
+
+class SyntheticSheet:
+    """
+    Hoja sintética con su verdad de terreno (RUT y respuestas).
+
+    `image` es la imagen BGR lista para entregar a ScannerLogic.process_image.
+    """
+    def __init__(self, image, rut, answers, dpi):
+        self.image = image
+        self.rut = rut
+        self.answers = answers
+        self.dpi = dpi
+
+
+def random_rut(rng):
+    body = str(rng.randint(10000000, 25999999))
+    return body + check_digit(body)
+
+
+def random_answers(rng, blank_ratio=0.05):
+    return ["" if rng.random() < blank_ratio else rng.choice(OPCIONES) for _ in range(TOTAL_PREGUNTAS)]
+
+
+def bubble_layout():
+    """
+    Centros (a DPI_BASE) de todas las burbujas impresas.
+    Retorna (rut_centers, answer_centers) donde:
+    - rut_centers[col][fila] = (x, y)
+    - answer_centers[pregunta][opcion] = (x, y)
+    """
+    ox, oy = ORIGEN_RUT
+    rut_centers = [[(ox + c * PASO_RUT, oy + r * PASO_RUT) for r in range(FILAS_RUT)] for c in range(COLUMNAS_RUT)]
+
+    answer_centers = []
+    for q in range(TOTAL_PREGUNTAS):
+        block = q // PREGUNTAS_POR_BLOQUE
+        row = q % PREGUNTAS_POR_BLOQUE
+        bx = BLOQUES_X[block]
+        y = ORIGEN_RESPUESTAS_Y + row * PASO_FILA
+        answer_centers.append([(bx + o * PASO_OPCION, y) for o in range(len(OPCIONES))])
+    return rut_centers, answer_centers
+
+
+def render_sheet(rut, answers, dpi=DPI_BASE, pencil_gray=70, erasures=0, streaks=0,
+                 skew_deg=0.0, shift=(0, 0), noise=0.0, seed=None):
+    """
+    Dibuja una hoja de respuestas con el RUT y las respuestas indicadas.
+
+    Parámetros de degradación:
+    - pencil_gray: nivel de gris del relleno (0 negro, 255 blanco). Simula lápiz grafito.
+    - erasures: cantidad de burbujas no marcadas con restos de borrado (relleno tenue parcial).
+    - streaks: cantidad de líneas verticales de escáner.
+    - skew_deg: rotación de la hoja en grados.
+    - shift: desplazamiento (dx, dy) en pixeles, como una hoja que entra corrida al alimentador.
+    - noise: desviación estándar del ruido gaussiano.
+    """
+    rng = random.Random(seed)
+    s = dpi / DPI_BASE
+    w = int(round(ANCHO_PAGINA_IN * dpi))
+    h = int(round(ALTO_PAGINA_IN * dpi))
+    img = np.full((h, w), 255, np.uint8)
+
+    radius = max(2, int(round(RADIO_BURBUJA * s)))
+    ring = max(1, int(round(2 * s)))
+    font_scale = 0.45 * s
+    font_thick = max(1, int(round(s)))
+
+    def pt(p):
+        return (int(round(p[0] * s)), int(round(p[1] * s)))
+
+    rut_centers, answer_centers = bubble_layout()
+    unmarked = []
+
+    # RUT: una columna por dígito, filas 0-9 y K
+    for c, col in enumerate(rut_centers):
+        target = rut[c] if c < len(rut) else None
+        for r, center in enumerate(col):
+            cv2.circle(img, pt(center), radius, 0, ring, cv2.LINE_AA)
+            label = "K" if r == 10 else str(r)
+            if target is not None and label == target.upper():
+                cv2.circle(img, pt(center), radius - ring, pencil_gray, -1, cv2.LINE_AA)
+            else:
+                unmarked.append(center)
+
+    # Respuestas: tres bloques de 30 preguntas con opciones A-E
+    for q, row in enumerate(answer_centers):
+        x0, y0 = pt(row[0])
+        cv2.putText(img, str(q + 1), (x0 - int(45 * s), y0 + int(5 * s)),
+                    cv2.FONT_HERSHEY_SIMPLEX, font_scale, 0, font_thick, cv2.LINE_AA)
+        for o, center in enumerate(row):
+            cv2.circle(img, pt(center), radius, 0, ring, cv2.LINE_AA)
+            if answers[q] == OPCIONES[o]:
+                cv2.circle(img, pt(center), radius - ring, pencil_gray, -1, cv2.LINE_AA)
+            else:
+                unmarked.append(center)
+
+    # Restos de borrado: manchas tenues que no deben contarse como marca
+    for center in rng.sample(unmarked, min(erasures, len(unmarked))):
+        cx, cy = pt(center)
+        r = max(1, radius // 2)
+        cv2.ellipse(img, (cx + rng.randint(-2, 2), cy), (r, max(1, r // 2)), rng.randint(0, 180),
+                    0, 360, 200, -1, cv2.LINE_AA)
+
+    for _ in range(streaks):
+        x = rng.randint(0, w - 3)
+        cv2.line(img, (x, 0), (x, h - 1), rng.randint(20, 90), max(1, int(round(s))))
+
+    if skew_deg or any(shift):
+        m = cv2.getRotationMatrix2D((w / 2, h / 2), skew_deg, 1.0)
+        m[:, 2] += shift
+        img = cv2.warpAffine(img, m, (w, h), flags=cv2.INTER_LINEAR, borderValue=255)
+
+    if noise:
+        np_rng = np.random.default_rng(seed)
+        img = np.clip(img.astype(np.float32) + np_rng.normal(0, noise, img.shape), 0, 255).astype(np.uint8)
+
+    return cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+
+
+def generate_sheets(count, dpi=DPI_BASE, seed=0, **degradations):
+    """Genera `count` hojas aleatorias (SyntheticSheet) reproducibles a partir de `seed`."""
+    rng = random.Random(seed)
+    for i in range(count):
+        rut = random_rut(rng)
+        answers = random_answers(rng)
+        img = render_sheet(rut, answers, dpi=dpi, seed=seed * 100003 + i, **degradations)
+        yield SyntheticSheet(img, rut, answers, dpi)
@@ -1,7 +1,14 @@
 import tkinter as tk
 import customtkinter as ctk
+import tkinter.font as tkfont
 from PIL import Image, ImageTk
 import cv2
+from collections import OrderedDict
+
+# Visor: miniaturas ya renderizadas (por imagen y tamaño del canvas) que se conservan,
+# y espera tras el último <Configure> antes de volver a renderizar al redimensionar.
+CACHE_VISOR = 8
+ESPERA_REDIMENSION_MS = 120
 
 class ToolTip:
     """Widget auxiliar para mostrar texto flotante al pasar el mouse."""
@@ -62,6 +69,9 @@ class TopBar(ctk.CTkFrame):
         self.menu_ops = tk.Menu(self, tearoff=0)
         self.menu_ops.add_command(label="Seleccionar Escáner", command=self.callbacks.get('select_source'))
         self.menu_ops.add_command(label="Ocultar Visor", command=self.callbacks.get('toggle_view'))
+        self.menu_ops.add_command(label="Uso de memoria", command=self.callbacks.get('memory_stats'))
+        self.menu_ops.add_command(label="Corregir con pauta...", command=self.callbacks.get('score'))
+        self.menu_ops.add_command(label="Modo revisión (Ctrl+← / Ctrl+→)", command=self.callbacks.get('review_mode'))
 
     def show_options_menu(self):
         try:
@@ -71,19 +81,221 @@ class TopBar(ctk.CTkFrame):
         finally:
             self.menu_ops.grab_release()
 
+    def set_review_text(self, text):
+        try:
+            self.menu_ops.entryconfigure(4, label=text)
+        except: pass
+
     def set_toggle_text(self, text):
         try:
              self.menu_ops.entryconfigure(1, label=text)
         except: pass
 
+class VirtualList(tk.Frame):
+    """
+    Lista Virtualizada (reemplaza al Listbox de la barra lateral).
+
+    Las filas son solo datos (texto y si va en rojo); en el canvas existen únicamente los
+    ítems de las filas visibles, que se reutilizan al desplazarse. Cada ítem recuerda lo que
+    muestra y solo se reconfigura si cambió. Los cambios se aplican juntos en un idle, así
+    agregar una hoja o desplazarse cuesta lo mismo con 50 que con 5.000 filas.
+    on_select(event) se llama cuando el usuario elige una fila (clic o flechas).
+    """
+    COLORES = {
+        'normal': ("#2c3e50", "#ecf0f1"),
+        'alerta': ("white", "#e74c3c"),
+        'seleccion': ("white", "#3498db"),
+    }
+
+    def __init__(self, parent, on_select=None, font=("Segoe UI", 10), rows=30):
+        super().__init__(parent, bg=self.COLORES['normal'][1])
+        self.on_select = on_select
+        self.font = font
+        self.row_height = tkfont.Font(font=font).metrics('linespace') + 4
+        self.canvas = tk.Canvas(self, bg=self.COLORES['normal'][1], highlightthickness=0, takefocus=1,
+                                height=rows * self.row_height, width=160)
+        self.scrollbar = tk.Scrollbar(self, orient=tk.VERTICAL, command=self._on_scrollbar)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        self._texts = []
+        self._alerts = []
+        self.selected = None
+        self._top = 0
+        self._slots = [] # Por fila visible: (id rectángulo, id texto, estado mostrado)
+        self._shown_scroll = None
+        self._render_job = None
+
+        self.canvas.bind("<Configure>", self._on_configure)
+        self.canvas.bind("<Button-1>", self._on_click)
+        self.canvas.bind("<MouseWheel>", lambda e: self.scroll(-3 if e.delta > 0 else 3))
+        self.canvas.bind("<Button-4>", lambda e: self.scroll(-3))
+        self.canvas.bind("<Button-5>", lambda e: self.scroll(3))
+        for key, step in (("<Up>", -1), ("<Down>", 1), ("<Prior>", None), ("<Next>", None)):
+            self.canvas.bind(key, lambda e, step=step, key=key: self._on_key(e, step, key))
+        self.canvas.bind("<Home>", lambda e: self._select_by_user(0, e))
+        self.canvas.bind("<End>", lambda e: self._select_by_user(len(self._texts) - 1, e))
+
+    # --- Datos ---
+
+    def size(self):
+        return len(self._texts)
+
+    def insert(self, text, alert=False):
+        self._texts.append(text)
+        self._alerts.append(alert)
+        self._schedule()
+
+    def set_rows(self, texts, alerts):
+        self._texts = list(texts)
+        self._alerts = list(alerts)
+        self.selected = None
+        self._top = 0
+        self._schedule()
+
+    def delete(self, index):
+        del self._texts[index]
+        del self._alerts[index]
+        if self.selected is not None:
+            if self.selected == index:
+                self.selected = None
+            elif self.selected > index:
+                self.selected -= 1
+        self._top = max(0, min(self._top, len(self._texts) - self._visible_rows()))
+        self._schedule()
+
+    def set_text(self, index, text):
+        if self._texts[index] != text:
+            self._texts[index] = text
+            self._schedule()
+
+    def is_alert(self, index):
+        return self._alerts[index]
+
+    def set_alert(self, index, alert):
+        if self._alerts[index] != alert:
+            self._alerts[index] = alert
+            self._schedule()
+
+    def select(self, index):
+        """Selección desde el programa (no llama a on_select); la fila queda a la vista."""
+        self.selected = index if 0 <= index < len(self._texts) else None
+        if self.selected is not None:
+            self.see(self.selected)
+        self._schedule()
+
+    def see(self, index):
+        visible = self._visible_rows()
+        if index < self._top:
+            self._top = index
+        elif index >= self._top + visible:
+            self._top = index - visible + 1
+        self._schedule()
+
+    def scroll(self, rows):
+        top = max(0, min(self._top + rows, len(self._texts) - self._visible_rows()))
+        if top != self._top:
+            self._top = top
+            self._schedule()
+
+    # --- Dibujo ---
+
+    def _visible_rows(self):
+        return max(1, self.canvas.winfo_height() // self.row_height)
+
+    def _schedule(self):
+        if self._render_job is None:
+            self._render_job = self.after_idle(self._render)
+
+    def _render(self):
+        self._render_job = None
+        height = self.canvas.winfo_height()
+        width = self.canvas.winfo_width()
+        count = len(self._texts)
+        visible = self._visible_rows()
+        self._top = max(0, min(self._top, count - visible))
+
+        # Ítems para las filas que caben (se crean una vez por tamaño del canvas)
+        needed = height // self.row_height + 1
+        while len(self._slots) < needed:
+            y = len(self._slots) * self.row_height
+            rect = self.canvas.create_rectangle(0, y, width, y + self.row_height, width=0, state=tk.HIDDEN)
+            text = self.canvas.create_text(4, y + self.row_height // 2, anchor=tk.W, font=self.font, state=tk.HIDDEN)
+            self._slots.append([rect, text, None])
+
+        for k, slot in enumerate(self._slots):
+            row = self._top + k
+            if row < count:
+                style = 'seleccion' if row == self.selected else 'alerta' if self._alerts[row] else 'normal'
+                state = (self._texts[row], style, width)
+            else:
+                state = None
+            if state == slot[2]:
+                continue
+            rect, text = slot[0], slot[1]
+            if state is None:
+                self.canvas.itemconfigure(rect, state=tk.HIDDEN)
+                self.canvas.itemconfigure(text, state=tk.HIDDEN)
+            else:
+                fg, bg = self.COLORES[state[1]]
+                if slot[2] is None or slot[2][2] != width:
+                    y = k * self.row_height
+                    self.canvas.coords(rect, 0, y, width, y + self.row_height)
+                self.canvas.itemconfigure(rect, fill=bg, state=tk.NORMAL)
+                self.canvas.itemconfigure(text, text=state[0], fill=fg, state=tk.NORMAL)
+            slot[2] = state
+
+        scroll = (self._top / count, min(1.0, (self._top + visible) / count)) if count else (0.0, 1.0)
+        if scroll != self._shown_scroll:
+            self.scrollbar.set(*scroll)
+            self._shown_scroll = scroll
+
+    # --- Eventos ---
+
+    def _on_configure(self, event):
+        self._schedule()
+
+    def _on_scrollbar(self, *args):
+        if args[0] == 'moveto':
+            self.scroll(int(float(args[1]) * len(self._texts)) - self._top)
+        elif args[0] == 'scroll':
+            step = self._visible_rows() if args[2] == 'pages' else 1
+            self.scroll(int(args[1]) * step)
+
+    def _on_click(self, event):
+        self.canvas.focus_set()
+        row = self._top + event.y // self.row_height
+        if row < len(self._texts):
+            self._select_by_user(row, event)
+
+    def _on_key(self, event, step, key):
+        if not self._texts:
+            return "break"
+        if step is None:
+            step = self._visible_rows() * (-1 if key == "<Prior>" else 1)
+        current = self.selected if self.selected is not None else self._top
+        self._select_by_user(max(0, min(current + step, len(self._texts) - 1)), event)
+        return "break"
+
+    def _select_by_user(self, index, event):
+        if index >= 0 and index != self.selected:
+            self.select(index)
+            if self.on_select is not None:
+                self.on_select(event)
+        return "break"
+
+
 class SideBar(ctk.CTkFrame):
     """
     Panel Lateral Izquierdo.
     Muestra la lista de escaneos, estadísticas simples y controles de escaneo/eliminación.
+    Los contadores (total, sin nombre) se actualizan en cada cambio de fila, sin recorrer la lista.
     """
     def __init__(self, parent, callbacks):
         super().__init__(parent, width=200, corner_radius=10)
         self.callbacks = callbacks 
+        self._unnamed = 0
+        self._shown_stats = None
         self._init_ui()
 
     def _init_ui(self):
@@ -111,54 +323,101 @@ class SideBar(ctk.CTkFrame):
         self.lbl_no_name = ctk.CTkLabel(self.stats_frame, text="S/N: 0", font=("Segoe UI", 12, "bold"), text_color="#e74c3c")
         self.lbl_no_name.pack(side=tk.RIGHT, padx=10)
         ToolTip(self.lbl_no_name, "Pruebas sin nombre")
+
+        # Hojas transferidas que aún se están procesando (solo visible durante el escaneo)
+        self.lbl_queue = ctk.CTkLabel(self, text="", font=("Segoe UI", 11), text_color="#7f8c8d")
+        self.lbl_queue.pack(side=tk.BOTTOM, fill=tk.X, padx=10)
+
+        # Progreso de operaciones en segundo plano (p.ej. guardar la sesión)
+        self.lbl_status = ctk.CTkLabel(self, text="", font=("Segoe UI", 11), text_color="#7f8c8d")
+        self.lbl_status.pack(side=tk.BOTTOM, fill=tk.X, padx=10)
         
         # Lista ocupando el resto
-        self.lst_scans = tk.Listbox(self, height=30, font=("Segoe UI", 10), borderwidth=0, highlightthickness=0, bg="#ecf0f1", fg="#2c3e50")
+        self.lst_scans = VirtualList(self, self.callbacks.get('on_select'), font=("Segoe UI", 10), rows=30)
         self.lst_scans.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
-        self.lst_scans.bind('<<ListboxSelect>>', self.callbacks.get('on_select'))
 
-    def add_item(self, text):
-        self.lst_scans.insert(tk.END, text)
+    def add_item(self, text, unnamed=False):
+        self.lst_scans.insert(text, unnamed)
+        self._unnamed += unnamed
+        self._refresh_stats()
+
+    def set_items(self, items):
+        """Reemplaza la lista completa: items = [(texto, sin_nombre), ...]."""
+        texts = [text for text, _ in items]
+        flags = [bool(unnamed) for _, unnamed in items]
+        self.lst_scans.set_rows(texts, flags)
+        self._unnamed = sum(flags)
+        self._refresh_stats()
 
     def delete_item(self, index):
+        self._unnamed -= self.lst_scans.is_alert(index)
         self.lst_scans.delete(index)
+        self._refresh_stats()
+
+    def set_unnamed(self, index, unnamed):
+        """Marca la fila como sin nombre (rojo) o con nombre; ajusta el contador S/N."""
+        unnamed = bool(unnamed)
+        if 0 <= index < self.lst_scans.size() and self.lst_scans.is_alert(index) != unnamed:
+            self._unnamed += 1 if unnamed else -1
+            self.lst_scans.set_alert(index, unnamed)
+            self._refresh_stats()
+
+    def set_item_text(self, index, text):
+        if 0 <= index < self.lst_scans.size():
+            self.lst_scans.set_text(index, text)
+
+    def size(self):
+        return self.lst_scans.size()
 
     def select_last(self):
-        self.lst_scans.selection_clear(0, tk.END)
-        self.lst_scans.selection_set(tk.END)
+        self.lst_scans.select(self.lst_scans.size() - 1)
 
     def select_index(self, index):
-        self.lst_scans.selection_clear(0, tk.END)
-        self.lst_scans.selection_set(index)
+        self.lst_scans.select(index)
+
+    def _refresh_stats(self):
+        stats = (self.lst_scans.size(), self._unnamed)
+        if stats != self._shown_stats:
+            self._shown_stats = stats
+            self.update_stats(*stats)
 
     def update_stats(self, total, unnamed):
         self.lbl_total.configure(text=f"Total: {total}")
         self.lbl_no_name.configure(text=f"S/N: {unnamed}")
 
+    def update_queue(self, depth):
+        self.lbl_queue.configure(text=f"En cola: {depth}" if depth else "")
+
+    def set_status(self, text):
+        self.lbl_status.configure(text=text)
+
     def clear(self):
-        self.lst_scans.delete(0, tk.END)
+        self.set_items([])
     
     def get_selection_index(self):
-        sel = self.lst_scans.curselection()
-        if sel: return sel[0]
-        return None
-
-    def set_item_style(self, index, fg_color, bg_color):
-        try:
-            self.lst_scans.itemconfig(index, fg=fg_color, bg=bg_color)
-        except: pass
+        return self.lst_scans.selected
 
 class AnswerPanel(ctk.CTkFrame):
     """
     Panel Central.
     Muestra los campos editables para el RUT, Nombre y la grilla de Respuestas (1-90).
     Captura eventos de teclado y los delega al controlador.
+
+    Las respuestas no se escriben en los widgets al pedirlas: set_answer/show_answers fijan
+    el estado deseado y una sola llamada en idle aplica solo las celdas que cambiaron
+    respecto de lo que se muestra (valor o resaltado). Cambiar de hoja varias veces antes
+    del idle aplica solo la última.
     """
     def __init__(self, parent, callbacks):
         super().__init__(parent, corner_radius=10)
         self.callbacks = callbacks 
         self.answer_widgets = []
         self._init_ui()
+        count = len(self.answer_widgets)
+        self._shown = [("", False)] * count  # (valor, resaltado) en pantalla
+        self._wanted = [("", False)] * count # lo que debe quedar tras el próximo idle
+        self._flush_job = None
+        self.last_flush_cells = 0 # Celdas actualizadas en el último idle (medición)
 
     def _init_ui(self):
         self.pack(side=tk.LEFT, fill=tk.BOTH, padx=(0, 10), expand=True)
@@ -172,6 +431,8 @@ class AnswerPanel(ctk.CTkFrame):
         self.entry_rut = ctk.CTkEntry(frame_rut, textvariable=self.rut_var, font=("Segoe UI", 16, "bold"), justify="center", height=35)
         self.entry_rut.pack(fill=tk.X, pady=2)
         self.entry_rut.bind('<KeyRelease>', self.callbacks.get('on_rut_change'))
+        self.lbl_rut_hint = ctk.CTkLabel(frame_rut, text="", font=("Segoe UI", 11), text_color="#7f8c8d", anchor="w", justify="left")
+        self.lbl_rut_hint.pack(fill=tk.X)
 
         # Name Area
         frame_name = ctk.CTkFrame(self, fg_color="transparent")
@@ -259,38 +520,109 @@ class AnswerPanel(ctk.CTkFrame):
     def set_name(self, val):
         self.name_var.set(val)
 
+    def set_rut_hint(self, text, valid=True):
+        """Aviso bajo el RUT (validación / candidatos); en rojo si el RUT no es válido."""
+        self.lbl_rut_hint.configure(text=text, text_color="#7f8c8d" if valid else "#e74c3c")
+        self.entry_rut.configure(text_color=("gray10", "#DCE4EE") if valid else "#e74c3c")
+
     def update_rut_cursor(self):
         self.entry_rut.icursor(tk.END)
     
     def clear_answers(self):
-        for f, lbl, entry in self.answer_widgets:
-            f.configure(fg_color="transparent")
-            entry.delete(0, tk.END)
+        self._wanted = [("", False)] * len(self.answer_widgets)
+        self._schedule_flush()
     
     def set_answer(self, index, value, mark_detected=False):
         if 0 <= index < len(self.answer_widgets):
-            f, lbl, entry = self.answer_widgets[index]
-            entry.delete(0, tk.END)
-            entry.insert(0, value)
-            if mark_detected:
-                f.configure(fg_color="#a8e6cf") # Verde suave
-            else:
-                 f.configure(fg_color="transparent")
+            self._wanted[index] = (value or "", mark_detected)
+            self._schedule_flush()
 
     def highlight_mark(self, index):
         if 0 <= index < len(self.answer_widgets):
-             f, lbl, entry = self.answer_widgets[index]
-             f.configure(fg_color="#a8e6cf")
+            self._wanted[index] = (self._wanted[index][0], True)
+            self._schedule_flush()
+
+    def show_answers(self, values, highlighted=()):
+        """Estado completo de la grilla: valores (lista de 90) y preguntas resaltadas."""
+        count = len(self.answer_widgets)
+        marks = set(i for i in highlighted if 0 <= i < count)
+        values = list(values[:count]) + [""] * (count - len(values))
+        self._wanted = [(v or "", i in marks) for i, v in enumerate(values)]
+        self._schedule_flush()
+
+    def answer_edited(self, index, value):
+        """El usuario escribió `value` en la celda: ya está en pantalla, no hay que repintarla."""
+        if 0 <= index < len(self.answer_widgets):
+            self._shown[index] = (value, self._shown[index][1])
+            self._wanted[index] = (value, self._wanted[index][1])
+
+    def _schedule_flush(self):
+        if self._flush_job is None:
+            self._flush_job = self.after_idle(self._flush_answers)
+
+    def flush_answers(self):
+        """Aplica ya lo pendiente (sin esperar al idle)."""
+        if self._flush_job is not None:
+            self.after_cancel(self._flush_job)
+            self._flush_answers()
+
+    def _flush_answers(self):
+        self._flush_job = None
+        changed = 0
+        for i, (wanted, shown) in enumerate(zip(self._wanted, self._shown)):
+            if wanted == shown:
+                continue
+            f, lbl, entry = self.answer_widgets[i]
+            if wanted[0] != shown[0]:
+                entry.delete(0, tk.END)
+                if wanted[0]:
+                    entry.insert(0, wanted[0])
+            if wanted[1] != shown[1]:
+                f.configure(fg_color="#a8e6cf" if wanted[1] else "transparent") # Verde suave
+            changed += 1
+        self._shown = list(self._wanted)
+        self.last_flush_cells = changed
+
+def source_image(image):
+    """Imagen PIL para el visor: página en grises de un SheetOverlay, o BGR convertida a RGB."""
+    if hasattr(image, 'question_anchors'):
+        return Image.fromarray(image.gray)
+    return Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+
+
+def render_thumbnail(im_pil, canvas_width, canvas_height):
+    """
+    Miniatura para un canvas de ancho x alto: (PIL, escala). Igual que thumbnail(): se reduce
+    para caber, nunca se agranda. No usa Tk, se puede llamar desde otro hilo.
+    """
+    img_w, img_h = im_pil.size
+    scale = min(canvas_width / img_w, canvas_height / img_h, 1.0)
+    disp_w, disp_h = max(1, round(img_w * scale)), max(1, round(img_h * scale))
+    im_display = im_pil.resize((disp_w, disp_h), Image.Resampling.BILINEAR) if scale < 1.0 else im_pil
+    return im_display, scale
+
 
 class ImagePanel(ctk.CTkFrame):
     """
     Panel Derecho (Visor).
     Muestra la imagen escaneada procesada con marcas visuales superpuestas.
+
+    Caché de render: la miniatura (PhotoImage) de cada imagen queda guardada por tamaño de
+    canvas (CACHE_VISOR entradas, LRU), junto con la imagen PIL de origen (ya en RGB), así
+    volver a una hoja o a un tamaño ya visto no convierte ni escala de nuevo.
+    Los <Configure> de un arrastre de ventana se agrupan: se renderiza solo el tamaño final.
     """
     def __init__(self, parent):
         super().__init__(parent, corner_radius=10)
         self._init_ui()
         self.current_vis_img = None
+        self.current_labels = None
+        self.current_labels_drawn = None
+        self._renders = OrderedDict() # (id imagen, ancho, alto) -> (imagen, PhotoImage, escala)
+        self._sources = OrderedDict() # id imagen -> (imagen, PIL de origen)
+        self._shown_key = None
+        self._resize_job = None
+        self.prerendered = None # Opcional: (imagen, ancho, alto) -> (PIL, escala) ya preparados
     
     def _init_ui(self):
         self.pack(side=tk.RIGHT, fill=tk.BOTH, expand=True)
@@ -302,24 +634,99 @@ class ImagePanel(ctk.CTkFrame):
         self.canvas.bind("<Configure>", self._on_resize)
     
     def _on_resize(self, event):
+        if self.current_vis_img is None:
+            return
+        if self._resize_job is not None:
+            self.after_cancel(self._resize_job)
+        self._resize_job = self.after(ESPERA_REDIMENSION_MS, self._on_resize_done)
+
+    def _on_resize_done(self):
+        self._resize_job = None
         if self.current_vis_img is not None:
-            self.display_image(self.current_vis_img)
+            self.display_image(self.current_vis_img, self.current_labels)
+
+    def clear_cache(self):
+        self._renders.clear()
+        self._sources.clear()
+        self._shown_key = None
             
-    def display_image(self, cv2_img):
+    def display_image(self, cv2_img, labels=None):
+        """
+        Muestra una imagen BGR o una hoja con sus marcas como datos (SheetOverlay: página en
+        grises + rectángulos y pregunta de cada marca). Las marcas (verde = marcada, rojo = vacía)
+        y los números de pregunta se dibujan como ítems del canvas: la imagen no se copia ni se pinta.
+        labels: lista opcional de (texto, (x, y)) en coordenadas de la imagen.
+        Solo se dibuja si el visor está visible y tiene tamaño útil.
+        """
         if cv2_img is None: return
         self.current_vis_img = cv2_img 
-        
-        vis_img_rgb = cv2.cvtColor(cv2_img, cv2.COLOR_BGR2RGB)
-        im_pil = Image.fromarray(vis_img_rgb)
+        self.current_labels = labels
         
         canvas_width = self.canvas.winfo_width()
         canvas_height = self.canvas.winfo_height()
         
         if canvas_width < 10 or canvas_height < 10: return
- 
-        im_display = im_pil.copy()
-        im_display.thumbnail((canvas_width, canvas_height), Image.Resampling.BILINEAR)
-        
-        self.tk_image = ImageTk.PhotoImage(im_display)
+        if not self.winfo_viewable(): return
+
+        overlay = cv2_img if hasattr(cv2_img, 'question_anchors') else None
+        key = (id(cv2_img), canvas_width, canvas_height)
+        if key == self._shown_key and labels is self.current_labels_drawn:
+            return # Ya está en pantalla (p.ej. <Configure> sin cambio de tamaño)
+
+        entry = self._renders.get(key)
+        if entry is not None:
+            self._renders.move_to_end(key)
+            _, self.tk_image, scale = entry
+        else:
+            # Miniatura preparada en segundo plano (precarga) o renderizada aquí
+            ready = self.prerendered(cv2_img, canvas_width, canvas_height) if self.prerendered else None
+            if ready is not None:
+                im_display, scale = ready
+            else:
+                im_display, scale = render_thumbnail(self._source_image(cv2_img), canvas_width, canvas_height)
+            self.tk_image = ImageTk.PhotoImage(im_display)
+            # Se guarda la imagen junto a su render: su id no se reutiliza mientras esté en la caché
+            self._renders[key] = (cv2_img, self.tk_image, scale)
+            while len(self._renders) > CACHE_VISOR:
+                self._renders.popitem(last=False)
+        disp_w, disp_h = self.tk_image.width(), self.tk_image.height()
+        self._shown_key = key
+        self.current_labels_drawn = labels
+
         self.canvas.delete("all")
         self.canvas.create_image(canvas_width//2, canvas_height//2, image=self.tk_image, anchor=tk.CENTER)
+
+        # Esquina de la imagen en el canvas y escala imagen -> canvas
+        ox = canvas_width // 2 - disp_w // 2
+        oy = canvas_height // 2 - disp_h // 2
+        if overlay is not None:
+            self._draw_marks(overlay, ox, oy, scale)
+        for text, (x, y) in labels or []:
+            self.canvas.create_text(ox + x * scale, oy + y * scale, text=text, fill="#ff0000",
+                                    font=("Segoe UI", 8, "bold"), anchor=tk.W)
+
+    def canvas_size(self):
+        return self.canvas.winfo_width(), self.canvas.winfo_height()
+
+    def _source_image(self, cv2_img):
+        """Imagen PIL de origen (grises o RGB); la conversión de color se hace una vez por imagen."""
+        entry = self._sources.get(id(cv2_img))
+        if entry is not None:
+            self._sources.move_to_end(id(cv2_img))
+            return entry[1]
+        im_pil = source_image(cv2_img)
+        self._sources[id(cv2_img)] = (cv2_img, im_pil)
+        while len(self._sources) > CACHE_VISOR:
+            self._sources.popitem(last=False)
+        return im_pil
+
+    def _draw_marks(self, overlay, ox, oy, scale):
+        width = max(1, round(overlay.line_width * scale))
+        boxes = (overlay.rects * scale).tolist()
+        for (x, y, w, h), is_marked in zip(boxes, overlay.marked.tolist()):
+            color = "#00c000" if is_marked else "#ff0000"
+            self.canvas.create_rectangle(ox + x, oy + y, ox + x + w, oy + y + h, outline=color, width=width)
+        # Número de pregunta a la izquierda de su primera opción
+        for number, (x, y, w, h) in overlay.question_anchors():
+            self.canvas.create_text(ox + (x - 2) * scale, oy + (y + h / 2) * scale, text=str(number),
+                                    fill="#c0392b", font=("Segoe UI", 7), anchor=tk.E)